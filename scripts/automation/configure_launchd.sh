@@ -75,6 +75,7 @@ SERVICES=(
   "jellyfin"      # Jellyfin Media Server
   "landing"       # Landing page + Tailscale serving
   "media.watcher" # Media processing automation
+  "takeout.watcher" # Google Photos takeout import as parts download
   "tailscale"     # Tailscale VPN connection
   "updatecheck"   # System update monitoring
 )
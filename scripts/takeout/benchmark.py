@@ -0,0 +1,241 @@
+"""
+End-to-end benchmark for the takeout importer.
+
+Generates (or reuses) a synthetic takeout, runs TakeoutProcessor over it once
+per mode in a fresh subprocess, and reports files/s, MB/s, peak RSS and the
+time spent in each stage. Results can be saved as JSON and compared against a
+saved baseline to catch regressions.
+
+    python3 benchmark.py --photos 500 --modes extract,stream,workers --json results.json
+    python3 benchmark.py --takeout-dir /tmp/takeout --baseline results.json
+"""
+
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+import zipfile
+from collections import defaultdict
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Dict, List
+
+from enhanced_takeout_import import TakeoutProcessor
+from fake_immich import FakeImmichServer
+from run_report import peak_rss_bytes
+from synthetic_takeout import generate_takeout
+
+# Named processor configurations; others can be given inline as name:key=value,...
+MODES = {
+    'extract': {},
+    'stream': {'stream': True},
+    'workers': {'stream': True, 'workers': os.cpu_count() or 2},
+    'dedup': {'stream': True, 'dedup': 'hardlink'},
+    'upload': {'stream': True, 'uploader': 'native', 'upload': True},
+    'pipeline': {'stream': True, 'pipeline': True, 'delete_after_upload': True, 'upload': True},
+}
+
+STAGES = ('extract', 'process', 'dedup', 'upload')
+
+# Slowdown in files/s beyond which a mode counts as a regression
+DEFAULT_TOLERANCE = 0.2
+
+
+def parse_mode(spec: str) -> Dict:
+    """Return the processor options for a named mode or an inline name:key=value,... spec."""
+    name, _, options = spec.partition(':')
+    if not options:
+        if name not in MODES:
+            raise ValueError(f"Unknown mode {name!r}; use one of {', '.join(MODES)} or name:key=value,...")
+        return dict(MODES[name])
+
+    config = dict(MODES.get(name, {}))
+    for option in options.split(','):
+        key, _, value = option.partition('=')
+        try:
+            # Numbers and true/false; anything else is a plain string
+            config[key.strip().replace('-', '_')] = json.loads(value)
+        except ValueError:
+            config[key.strip().replace('-', '_')] = value
+    return config
+
+
+def measure_input(takeout_dir: Path, extensions) -> Dict[str, int]:
+    """Count the media members and their uncompressed bytes across the takeout zips."""
+    files = size = 0
+    for archive in sorted(takeout_dir.glob('takeout-*.zip')):
+        with zipfile.ZipFile(archive) as zip_ref:
+            for info in zip_ref.infolist():
+                if Path(info.filename).suffix.lower() in extensions:
+                    files += 1
+                    size += info.file_size
+    return {'media_files': files, 'media_bytes': size}
+
+
+class TimedProcessor(TakeoutProcessor):
+    """TakeoutProcessor that adds up wall time per stage."""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.stage_seconds = defaultdict(float)
+
+    @contextmanager
+    def stage(self, name: str):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.stage_seconds[name] += time.perf_counter() - started
+
+    def extract_archives(self):
+        with self.stage('extract'):
+            return super().extract_archives()
+
+    def link_duplicates(self):
+        with self.stage('dedup'):
+            return super().link_duplicates()
+
+    def upload_to_immich(self):
+        with self.stage('upload'):
+            return super().upload_to_immich()
+
+    def finish_pipeline(self):
+        with self.stage('upload'):
+            return super().finish_pipeline()
+
+    def process_media(self):
+        with self.stage('process'):
+            return super().process_media()
+
+
+def run_mode(takeout_dir: Path, output_dir: Path, config: Dict) -> Dict:
+    """Run one import in this process and return its measurements."""
+    config = dict(config)
+    server = None
+    if config.pop('upload', False):
+        server = FakeImmichServer().start()
+        config.update(immich_server=server.url, api_key=server.api_key)
+
+    try:
+        processor = TimedProcessor(str(takeout_dir), str(output_dir), **config)
+        started = time.perf_counter()
+        processor.process_all()
+        seconds = time.perf_counter() - started
+    finally:
+        if server is not None:
+            server.stop()
+
+    stages = dict.fromkeys(STAGES, 0.0)
+    stages.update(processor.stage_seconds)
+    # process_media includes the extraction and dedup stages it calls
+    stages['process'] -= stages['extract'] + stages['dedup']
+
+    result = measure_input(takeout_dir, processor.image_extensions | processor.video_extensions)
+    result.update(seconds=seconds, peak_rss=peak_rss_bytes(), stages=stages, errors=processor.stats['errors'],
+                  timings=processor.timings.to_dict())
+    result['files_per_s'] = result['media_files'] / seconds
+    result['mb_per_s'] = result['media_bytes'] / (1024 * 1024) / seconds
+    return result
+
+
+def run_mode_subprocess(takeout_dir: Path, work_dir: Path, name: str, config: Dict) -> Dict:
+    """Run one mode in a fresh interpreter so peak RSS is measured per mode."""
+    mode_dir = work_dir / name
+    mode_dir.mkdir(parents=True, exist_ok=True)
+    result_file = mode_dir / 'result.json'
+    subprocess.run([sys.executable, str(Path(__file__).resolve()), '--run-one', json.dumps(config),
+                    '--takeout-dir', str(takeout_dir), '--result', str(result_file)],
+                   cwd=mode_dir, check=True, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    return json.loads(result_file.read_text())
+
+
+def format_results(results: Dict[str, Dict]) -> str:
+    """Return results as a fixed-width table."""
+    header = f"{'mode':<12}{'files':>7}{'MB':>9}{'sec':>8}{'files/s':>9}{'MB/s':>8}{'RSS MB':>8}" + \
+        ''.join(f"{stage:>9}" for stage in STAGES) + f"{'errors':>8}"
+    lines = [header]
+    for name, result in results.items():
+        lines.append(
+            f"{name:<12}{result['media_files']:>7}{result['media_bytes'] / (1024 * 1024):>9.1f}"
+            f"{result['seconds']:>8.2f}{result['files_per_s']:>9.1f}{result['mb_per_s']:>8.1f}"
+            f"{result['peak_rss'] / (1024 * 1024):>8.0f}"
+            + ''.join(f"{result['stages'][stage]:>9.2f}" for stage in STAGES)
+            + f"{result['errors']:>8}")
+    return '\n'.join(lines)
+
+
+def find_regressions(results: Dict[str, Dict], baseline: Dict[str, Dict], tolerance: float) -> List[str]:
+    """Return a message for every mode whose files/s fell more than tolerance below the baseline."""
+    regressions = []
+    for name, result in results.items():
+        if name not in baseline:
+            continue
+        before, after = baseline[name]['files_per_s'], result['files_per_s']
+        if after < before * (1 - tolerance):
+            regressions.append(f"{name}: {after:.1f} files/s vs {before:.1f} baseline "
+                               f"({(after - before) / before:+.0%})")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the takeout importer on a synthetic takeout')
+    parser.add_argument('--takeout-dir', help='Existing takeout to benchmark (default: generate one)')
+    parser.add_argument('--work-dir', help='Directory for generated data and outputs (default: a temp dir)')
+    parser.add_argument('--modes', default='extract,stream',
+                        help=f"Comma-separated modes ({', '.join(MODES)}) or name:key=value specs separated by ';'")
+    parser.add_argument('--photos', type=int, default=200)
+    parser.add_argument('--pngs', type=int, default=10)
+    parser.add_argument('--videos', type=int, default=5)
+    parser.add_argument('--albums', type=int, default=4)
+    parser.add_argument('--parts', type=int, default=2)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--json', help='Write results to this JSON file')
+    parser.add_argument('--baseline', help='Compare against results saved with --json')
+    parser.add_argument('--tolerance', type=float, default=DEFAULT_TOLERANCE,
+                        help='Allowed files/s slowdown against the baseline (0.2 = 20%%)')
+    parser.add_argument('--run-one', help=argparse.SUPPRESS)
+    parser.add_argument('--result', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.run_one:
+        result = run_mode(Path(args.takeout_dir), Path.cwd() / 'output', json.loads(args.run_one))
+        Path(args.result).write_text(json.dumps(result))
+        return
+
+    work_dir = Path(args.work_dir or tempfile.mkdtemp(prefix='takeout-bench-'))
+    work_dir.mkdir(parents=True, exist_ok=True)
+
+    if args.takeout_dir:
+        takeout_dir = Path(args.takeout_dir)
+    else:
+        takeout_dir = work_dir / 'takeout'
+        summary = generate_takeout(takeout_dir, args.photos, args.pngs, args.videos, args.albums, args.parts,
+                                   seed=args.seed)
+        print(f"Generated {summary.media_files} media files "
+              f"({summary.media_bytes / (1024 * 1024):.1f} MB) in {takeout_dir}")
+
+    specs = args.modes.split(';') if ':' in args.modes else args.modes.split(',')
+    results = {}
+    for spec in specs:
+        name = spec.partition(':')[0]
+        print(f"Running {name}...", flush=True)
+        results[name] = run_mode_subprocess(takeout_dir, work_dir, name, parse_mode(spec))
+
+    print(format_results(results))
+
+    if args.json:
+        Path(args.json).write_text(json.dumps(results, indent=2))
+
+    if args.baseline:
+        regressions = find_regressions(results, json.loads(Path(args.baseline).read_text()), args.tolerance)
+        for message in regressions:
+            print(f"REGRESSION {message}")
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
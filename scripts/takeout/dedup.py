@@ -0,0 +1,68 @@
+"""
+Cross-album duplicate detection for the takeout importer.
+
+Google Takeout repeats the same photo in "Photos from <year>" and in every
+named album that contains it. Media jobs are bucketed by a cheap pre-key
+(size and the zip CRC-32 when known); only jobs that share a bucket with an
+earlier job are held back. Those are confirmed against the earlier job with a
+streaming content hash of the source plus a digest of the metadata that would
+be embedded, and then linked to its output instead of being processed again.
+"""
+
+import hashlib
+import json
+from typing import BinaryIO, Dict, List, Optional, Tuple
+
+HASH_CHUNK_SIZE = 1024 * 1024
+
+# Sidecar fields that end up in the processed file
+EMBEDDED_FIELDS = ('photoTakenTime', 'geoData', 'description', 'title', 'googlePhotosOrigin')
+
+
+def content_hash(stream: BinaryIO) -> str:
+    """Return the SHA-256 of a binary stream, read in chunks."""
+    digest = hashlib.sha256()
+    for chunk in iter(lambda: stream.read(HASH_CHUNK_SIZE), b''):
+        digest.update(chunk)
+    return digest.hexdigest()
+
+
+def metadata_digest(metadata: Dict) -> str:
+    """Return a digest of the sidecar fields that affect the processed output."""
+    embedded = {field: metadata.get(field) for field in EMBEDDED_FIELDS}
+    return hashlib.sha256(json.dumps(embedded, sort_keys=True).encode()).hexdigest()
+
+
+class DuplicateIndex:
+    """Processed jobs bucketed by pre-key, plus the jobs held back as likely duplicates."""
+
+    def __init__(self):
+        self._buckets: Dict[Tuple[int, Optional[int]], List] = {}
+        self.deferred: List = []
+
+    @staticmethod
+    def prekey(job) -> Tuple[int, Optional[int]]:
+        return job.size, job.key.crc if job.key is not None else None
+
+    def defer(self, job) -> bool:
+        """Hold job back if an earlier job may have the same content; otherwise track it."""
+        bucket = self._buckets.get(self.prekey(job))
+        if bucket:
+            self.deferred.append(job)
+            return True
+        self._buckets[self.prekey(job)] = [job]
+        return False
+
+    def candidates(self, job) -> List:
+        """Return the processed jobs job may duplicate."""
+        return list(self._buckets.get(self.prekey(job), ()))
+
+    def add(self, job) -> None:
+        """Track a job that was processed after all."""
+        self._buckets.setdefault(self.prekey(job), []).append(job)
+
+    def discard(self, job) -> None:
+        """Stop offering a job (e.g. one that failed) as a link target."""
+        bucket = self._buckets.get(self.prekey(job))
+        if bucket and job in bucket:
+            bucket.remove(job)
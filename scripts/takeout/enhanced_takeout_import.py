@@ -8,6 +8,7 @@ Usage: python3 enhanced_takeout_import.py [options]
 
 import os
 import sys
+import io
 import json
 import zipfile
 import shutil
@@ -15,72 +16,674 @@ import tempfile
 import argparse
 import subprocess
 import logging
+import copy
+import threading
+import time
+from concurrent.futures import ALL_COMPLETED, FIRST_COMPLETED, ProcessPoolExecutor, ThreadPoolExecutor, wait
 from datetime import datetime, timezone
 from pathlib import Path
-from typing import Dict, List, Optional, Tuple
-import piexif
-from PIL import Image, ExifTags
-from PIL.ExifTags import TAGS, GPSTAGS
-import ffmpeg
-
-# Configure logging
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(levelname)s - %(message)s',
-    handlers=[
-        logging.FileHandler('takeout_import.log'),
-        logging.StreamHandler()
-    ]
-)
+from typing import Dict, Iterator, List, NamedTuple, Optional, Tuple, Union
+
+import exiftool_writer
+import integrity
+import jpeg_exif
+import immich_upload
+import media_formats
+import near_duplicates
+import placement
+import video_metadata
+import zip_range
+from dedup import DuplicateIndex, content_hash, metadata_digest
+from import_index import DELTA_METADATA, DELTA_STATES, DELTA_UNCHANGED, ImportIndex
+import run_logging
+from run_report import PROFILE_MODES, Instrumentation, Profiler, write_report
+from scheduler import DEFAULT_IO_WORKERS, DEFAULT_LARGE_VIDEO_SIZE, LANE_CPU, LANE_IO, Lane, large_first
+from job_manifest import (JobManifest, MemberKey, STATE_EMBEDDED, STATE_FAILED, STATE_SKIPPED)
+from part_watcher import DEFAULT_IDLE_SECONDS, DEFAULT_SETTLE_SECONDS, PartWatcher
+from sidecar_index import SidecarIndex
+from work_plan import AlbumPlan, ArchiveMember, PlannedFile, WorkPlan, format_summary, load_calibration
+
 logger = logging.getLogger(__name__)
 
+# JSON lines log, run report and --plan output written by the command line
+DEFAULT_LOG_PATH = 'takeout_import.log'
+DEFAULT_REPORT_PATH = 'takeout_import.report.json'
+DEFAULT_PLAN_PATH = 'takeout_import.plan.json'
+
+# Takeout archive layout and streaming parameters
+TAKEOUT_PHOTOS_PREFIX = "Takeout/Google Photos/"
+STREAM_CHUNK_SIZE = 1024 * 1024
+
+# Images whose EXIF is spliced in while the file is written once
+JPEG_EXTENSIONS = {'.jpg', '.jpeg'}
+
+# Metadata writers for images; piexif only understands JPEG and WebP
+IMAGE_BACKENDS = ('piexif', 'exiftool')
+
+# Formats written with exiftool by default when it is installed
+EXIFTOOL_EXTENSIONS = {'.heic', '.png', '.tiff'}
+
+# Pending tasks allowed per worker before the dispatcher waits for results
+WORKER_QUEUE_FACTOR = 64
+
+# Default cap on concurrent member extractions; past this a single disk is the bottleneck, not inflate
+MAX_EXTRACT_WORKERS = 8
+
+def parse_backend(text: str) -> Tuple[str, str]:
+    """Parse an EXT=BACKEND pair for --metadata-backend."""
+    extension, _, backend = text.partition('=')
+    extension = '.' + extension.strip().lower().lstrip('.')
+    if backend not in IMAGE_BACKENDS:
+        raise argparse.ArgumentTypeError(f"Unknown backend {backend!r}; use one of {', '.join(IMAGE_BACKENDS)}")
+    return extension, backend
+
+
+# Binary unit suffixes accepted by --scratch-budget
+SIZE_UNITS = {'': 1, 'K': 1024, 'M': 1024 ** 2, 'G': 1024 ** 3, 'T': 1024 ** 4}
+
+
+# Bytes of file paths passed to one immich-go call, well below the argument list limit (256 KiB on older macOS)
+IMMICH_GO_ARGS_BYTES = 128 * 1024
+
+
+def chunk_paths(paths: List[Path], limit: int = IMMICH_GO_ARGS_BYTES) -> List[List[str]]:
+    """Split paths into argument lists of at most limit bytes each, so no command line hits E2BIG."""
+    chunks: List[List[str]] = []
+    size = limit
+    for path in paths:
+        arg = str(path)
+        arg_size = len(os.fsencode(arg)) + 1
+        if size + arg_size > limit:
+            chunks.append([])
+            size = 0
+        chunks[-1].append(arg)
+        size += arg_size
+    return chunks
+
+
+def parse_size(text: str) -> int:
+    """Parse a byte count such as 500M, 50G or 1.5T."""
+    value = text.strip().upper().rstrip('B')
+    unit = value[-1:] if value[-1:] in SIZE_UNITS else ''
+    try:
+        size = int(float(value[:len(value) - len(unit)]) * SIZE_UNITS[unit])
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"Invalid size: {text}")
+    if size <= 0:
+        raise argparse.ArgumentTypeError(f"Size must be positive: {text}")
+    return size
+
+
+class MediaJob(NamedTuple):
+    """One media file to process, either an extracted file or a zip member."""
+    name: str
+    album: str
+    size: int
+    source: Union[Path, ArchiveMember]
+    sidecar: Union[Path, ArchiveMember, None]
+    output: Path
+    key: Optional[MemberKey] = None
+
+
+# Per-worker processor copy, set up by the pool initializer
+_worker_state = threading.local()
+
+
+def _init_worker(processor: 'TakeoutProcessor', log_queue=None) -> None:
+    """Give each pool worker its own processor copy with private stats and archive handles."""
+    if log_queue is not None and not logging.getLogger().handlers:
+        # Spawned workers start without the parent's logging setup
+        run_logging.attach(log_queue)
+    _worker_state.processor = processor.worker_copy()
+
+
+def _run_worker_task(job: MediaJob) -> Tuple[Dict[str, int], Dict, Dict[Path, str]]:
+    """Run one media job in a pool worker and return the stats, stage timings and output digests it produced."""
+    processor = _worker_state.processor
+    processor.stats = dict.fromkeys(processor.stats, 0)
+    processor.run_job(job)
+    digests, processor._output_digests = processor._output_digests, {}
+    return processor.stats, processor.timings.drain(), digests
+
 class TakeoutProcessor:
     """Processes Google Photos takeout data for Immich import."""
     
-    def __init__(self, takeout_dir: str, output_dir: str, immich_server: str = None, api_key: str = None):
+    def __init__(self, takeout_dir: str, output_dir: str, immich_server: str = None, api_key: str = None,
+                 stream: bool = False, workers: int = 1, worker_type: str = 'process', resume: bool = False,
+                 dedup: str = 'off', uploader: str = 'immich-go',
+                 upload_concurrency: int = immich_upload.DEFAULT_CONCURRENCY, pipeline: bool = False,
+                 pipeline_depth: int = 64, delete_after_upload: bool = False, profile: Optional[str] = None,
+                 report_path: Optional[str] = None, scratch_budget: Optional[int] = None,
+                 extract_workers: Optional[int] = None, metadata_backends: Optional[Dict[str, str]] = None,
+                 delta_index: Optional[str] = None, large_video_size: int = DEFAULT_LARGE_VIDEO_SIZE,
+                 io_workers: int = DEFAULT_IO_WORKERS, upload_check: bool = True,
+                 near_duplicate_policy: Optional[str] = None,
+                 near_duplicate_distance: int = near_duplicates.DEFAULT_MAX_DISTANCE):
         self.takeout_dir = Path(takeout_dir)
         self.output_dir = Path(output_dir)
         self.immich_server = immich_server
         self.api_key = api_key
+        if pipeline and not stream:
+            # Extracting every archive first would put the whole export on disk before the queue bounds it
+            logger.info("--pipeline reads media straight from the archives, as with --stream")
+            stream = True
+        self.stream = stream
+        self.workers = workers
+        self.worker_type = worker_type
+        self.resume = resume
+        self.dedup = dedup
+        self.uploader = uploader
+        self.upload_concurrency = upload_concurrency
+        self.pipeline = pipeline
+        self.pipeline_depth = pipeline_depth
+        self.delete_after_upload = delete_after_upload
+        self.profile = profile
+        self.report_path = Path(report_path) if report_path else None
+        self.scratch_budget = scratch_budget
+        self.extract_workers = extract_workers or min(os.cpu_count() or 1, MAX_EXTRACT_WORKERS)
+        self.delta_index = Path(delta_index) if delta_index else None
+        self.large_video_size = large_video_size
+        self.io_workers = io_workers
+        self.upload_check = upload_check
+        # Uploads the bulk upload check found unnecessary, for the run report
+        self.uploads_avoided = 0
+        # Perceptual near-duplicate pass over the processed images, off unless a policy is given
+        self.near_duplicate_policy = near_duplicate_policy
+        self.near_duplicate_distance = near_duplicate_distance
         self.stats = {
             'total_files': 0,
             'processed_images': 0,
             'processed_videos': 0,
             'skipped_files': 0,
             'errors': 0,
-            'albums_created': 0
+            'albums_created': 0,
+            'duplicates': 0,
+            'bytes_saved': 0
         }
         
-        # Supported file types
-        self.image_extensions = {'.jpg', '.jpeg', '.png', '.heic', '.webp', '.tiff', '.bmp'}
-        self.video_extensions = {'.mp4', '.mov', '.avi', '.mkv', '.m4v', '.3gp', '.webm'}
+        # Per-stage latency, bytes and slowest files for the run report
+        self.timings = Instrumentation()
+        
+        # Supported file types, from the format registry
+        self.image_extensions = media_formats.extensions(media_formats.KIND_IMAGE)
+        self.video_extensions = media_formats.extensions(media_formats.KIND_VIDEO)
+        
+        # Metadata writer per image extension; anything not listed uses piexif
+        self.metadata_backends = {}
+        if exiftool_writer.available():
+            self.metadata_backends.update(dict.fromkeys(EXIFTOOL_EXTENSIONS, 'exiftool'))
+        for extension, backend in (metadata_backends or {}).items():
+            if backend == 'exiftool' and not exiftool_writer.available():
+                logger.warning(f"exiftool not found; writing {extension} metadata with piexif")
+                backend = 'piexif'
+            self.metadata_backends[extension] = backend
+        
+        # Albums and files to process, built from the central directories on first use
+        self.plan: Optional[WorkPlan] = None
+        # Parts to import instead of every takeout-*.zip, and whether media without a sidecar wait;
+        # set by --watch while parts are still downloading
+        self.archives: Optional[List[Path]] = None
+        self.defer_unmatched = False
+        
+        # Index of earlier runs when running with --delta, opened while planning and kept until the run ends
+        self._import_index: Optional[ImportIndex] = None
+        self.delta_counts = dict.fromkeys(DELTA_STATES, 0)
+        # Metadata digest per planned path, and pending in-place metadata updates by Immich asset id
+        self._delta_digests: Dict[str, str] = {}
+        self._metadata_updates: Dict[str, Tuple[str, str, Dict]] = {}
+        
+        # Long-lived exiftool process, started on first use in each processor copy
+        self._exiftool: Optional[exiftool_writer.ExifTool] = None
+        
+        # Checkpoint database, opened for the duration of process_all
+        self.manifest: Optional[JobManifest] = None
+        
+        # Digests of finished outputs, kept across runs; opened for the duration of process_all
+        self.integrity: Optional[integrity.IntegrityManifest] = None
+        # Digests of outputs written by this processor copy, and of extracted and scratch copies
+        self._output_digests: Dict[Path, str] = {}
+        self._source_digests: Dict[Path, str] = {}
+        
+        # Cross-album duplicate tracking when running with --dedup
+        self._duplicates: Optional[DuplicateIndex] = None
+        
+        # Background uploader fed with finished files when running with --pipeline
+        self._uploads: Optional[immich_upload.BackgroundUploader] = None
+        
+        # Open zip files by path, and the worker lanes when running with --workers
+        self._archives: Dict[Path, zipfile.ZipFile] = {}
+        self._lanes: Dict[str, Lane] = {}
+        self._pending = {}
+        # Jobs and queue depth per lane, kept for the run report once the lanes shut down
+        self.lane_report: Dict[str, Dict[str, int]] = {}
+        
+        # Zip members of extracted and scratch copies, so duplicates can still be hashed
+        # once a copy was moved into processed/ or its batch was deleted
+        self._scratch_sources: Dict[Path, ArchiveMember] = {}
         
         # Create output directory
         self.output_dir.mkdir(parents=True, exist_ok=True)
+    
+    def __getstate__(self) -> Dict:
+        """Drop open archives, the manifest and the pool when a processor is sent to a worker process."""
+        state = self.__dict__.copy()
+        state['manifest'] = None
+        state['integrity'] = None
+        state['_output_digests'] = {}
+        state['_source_digests'] = {}
+        state['timings'] = Instrumentation()
+        state['_duplicates'] = None
+        state['_uploads'] = None
+        state['_archives'] = {}
+        state['_lanes'] = {}
+        state['_pending'] = {}
+        state['_scratch_sources'] = {}
+        state['_exiftool'] = None
+        state['plan'] = None
+        state['_import_index'] = None
+        state['_delta_digests'] = {}
+        state['_metadata_updates'] = {}
+        return state
+    
+    def worker_copy(self) -> 'TakeoutProcessor':
+        """Return a copy of this processor for a pool worker."""
+        worker = copy.copy(self)
+        worker.stats = dict.fromkeys(self.stats, 0)
+        worker.manifest = None
+        worker.integrity = None
+        worker._output_digests = {}
+        worker._source_digests = {}
+        worker.timings = Instrumentation()
+        worker._duplicates = None
+        worker._uploads = None
+        worker._archives = {}
+        worker._lanes = {}
+        worker._pending = {}
+        worker._scratch_sources = {}
+        worker._exiftool = None
+        worker.plan = None
+        worker._import_index = None
+        worker._delta_digests = {}
+        worker._metadata_updates = {}
+        return worker
+    
+    @property
+    def manifest_path(self) -> Path:
+        """Location of the checkpoint database, next to the output directory."""
+        return self.output_dir.parent / f"{self.output_dir.name}.manifest.sqlite"
+    
+    @property
+    def hash_workers(self) -> int:
+        """Threads hashing files for --verify and the upload check."""
+        return self.workers if self.workers > 1 else integrity.DEFAULT_HASH_WORKERS
+    
+    @property
+    def integrity_path(self) -> Path:
+        """Location of the integrity manifest, next to the output directory."""
+        return self.output_dir.parent / f"{self.output_dir.name}.integrity.sqlite"
+    
+    @property
+    def near_duplicates_path(self) -> Path:
+        """Location of the near-duplicate report, next to the output directory."""
+        return self.output_dir.parent / f"{self.output_dir.name}.near-duplicates.json"
+    
+    def merge_stats(self, stats: Dict[str, int]) -> None:
+        """Add stats produced by a worker into this processor's totals."""
+        for key, value in stats.items():
+            self.stats[key] += value
+    
+    def record_error(self, stage: str, detail: str) -> None:
+        """Count an error that is not tied to a single media file."""
+        self.stats['errors'] += 1
+        if self.manifest is not None:
+            self.manifest.record_error(stage, detail)
+    
+    def record_result(self, job: MediaJob, stats: Dict[str, int], linked_to: Optional[Path] = None) -> None:
+        """Checkpoint the outcome of one media job from the stats it produced."""
+        embedded = not stats['errors'] and (stats['processed_images'] or stats['processed_videos'])
+        # A plain copy written when embedding failed is still an output to verify and upload
+        placed = embedded or (stats['errors'] and job.output in self._output_digests)
+        failed = not placed and (stats['errors'] or not stats['skipped_files'])
+        if not embedded and self._duplicates is not None:
+            # A first copy without its metadata must not be linked into other albums
+            self._duplicates.discard(job)
+        
+        digest = self._output_digests.pop(job.output, None)
+        if self.integrity is not None and placed:
+            # Recorded before the upload queue sees the file, which may delete it once uploaded
+            digest = self.record_integrity(job, digest, linked_to)
+        
+        if self._uploads is not None and placed:
+            # Blocks while the upload queue is full, which caps files waiting on disk
+            self._uploads.put(job.album, job.output, job, digest if self.upload_check else None)
+        
+        if self._import_index is not None and not failed and job.key is not None:
+            path = f"{job.album}/{job.name}"
+            if path in self._delta_digests:
+                self._import_index.record(path, job.album, job.size, job.key.crc, self._delta_digests[path])
+        
+        if self.manifest is None or job.key is None:
+            return
+        
+        if embedded:
+            kind = 'image' if stats['processed_images'] else 'video'
+            if linked_to is not None:
+                linked_to = linked_to.relative_to(self.output_dir / "processed").as_posix()
+            self.manifest.record(job.key, STATE_EMBEDDED, job.album, kind, linked_to, stats['bytes_saved'])
+        elif failed or placed:
+            # A resumed run tries a plain copy's embedding again
+            self.manifest.record(job.key, STATE_FAILED, job.album)
+        else:
+            self.manifest.record(job.key, STATE_SKIPPED, job.album, 'other')
+    
+    def record_integrity(self, job: MediaJob, digest: Optional[str],
+                         linked_to: Optional[Path] = None) -> Optional[str]:
+        """Add a finished output to the integrity manifest and return its digest.
+        
+        The output is only read to be hashed if nothing hashed it while it was written.
+        """
+        processed_dir = self.output_dir / "processed"
+        if linked_to is not None:
+            digest = self.integrity.digest(linked_to.relative_to(processed_dir).as_posix())
+        elif digest == integrity.SAME_AS_SOURCE:
+            digest = self._source_digests.pop(job.source, None)
+        try:
+            stat = job.output.stat()
+            if digest is None:
+                with self.timings.measure('hash', job.name, stat.st_size):
+                    digest = integrity.hash_file(job.output)
+        except OSError as e:
+            logger.error(f"Failed to hash {job.output}: {e}")
+            return None
+        self.integrity.record(job.output.relative_to(processed_dir).as_posix(), stat, digest)
+        return digest
+    
+    def hash_output(self, output_path: Path) -> None:
+        """Hash an output written by an external tool, which no HashingWriter saw."""
+        with self.timings.measure('hash', output_path.name, output_path.stat().st_size):
+            self._output_digests[output_path] = integrity.hash_file(output_path)
+    
+    def write_output(self, output_path: Path, data: bytes) -> None:
+        """Write in-memory file data to output_path, hashing it on the way."""
+        with integrity.HashingWriter(output_path, self._output_digests) as out:
+            out.write(data)
+    
+    def start_workers(self) -> None:
+        """Start the worker lanes if more than one worker was requested."""
+        if self.workers <= 1:
+            return
+        
+        pool_class = ThreadPoolExecutor if self.worker_type == 'thread' else ProcessPoolExecutor
+        logger.info(f"Starting {self.workers} {self.worker_type} workers")
+        self._lanes[LANE_CPU] = Lane(LANE_CPU, pool_class(max_workers=self.workers, initializer=_init_worker,
+                                                          initargs=(self, run_logging.log_queue())), self.workers)
+        if self.io_workers > 0:
+            # Large videos mostly wait on ffmpeg and the disk, so threads are enough
+            logger.info(f"Videos of {self.large_video_size / (1024 * 1024):.0f} MB or more run first "
+                        f"on {self.io_workers} I/O lane threads")
+            self._lanes[LANE_IO] = Lane(LANE_IO, ThreadPoolExecutor(
+                max_workers=self.io_workers, initializer=_init_worker, initargs=(self,),
+                thread_name_prefix='io-lane'), self.io_workers)
+    
+    def lane_for(self, job: MediaJob) -> str:
+        """Return the lane a job runs on: large videos get the I/O lane when there is one."""
+        if LANE_IO in self._lanes and self.is_video(job.name) and job.size >= self.large_video_size:
+            return LANE_IO
+        return LANE_CPU
+    
+    def queue_depths(self) -> Dict[str, int]:
+        """Return the tasks queued or running per lane."""
+        return {name: lane.depth for name, lane in self._lanes.items()}
+    
+    def run_job(self, job: MediaJob) -> None:
+        """Process one media job with the method matching its source."""
+        if isinstance(job.source, ArchiveMember):
+            self.process_archive_member(job.name, job.source, job.sidecar, job.output.parent)
+        else:
+            self.process_media_file(job.source, job.output.parent, job.sidecar)
+    
+    def dispatch(self, job: MediaJob) -> None:
+        """Run a media job inline, or queue it on the worker pool.
+        
+        With --dedup, likely copies of an earlier job are held back for link_duplicates().
+        """
+        if (self._duplicates is not None and self.is_media(job.name)
+                and self._duplicates.defer(job)):
+            return
+        
+        if not self._lanes:
+            self._run_inline(job)
+            return
+        
+        # Keep the number of queued tasks bounded per lane so huge albums do not pile up in memory
+        lane = self._lanes[self.lane_for(job)]
+        while lane.depth >= lane.workers * WORKER_QUEUE_FACTOR:
+            self._collect(FIRST_COMPLETED)
+        self._pending[lane.submit(_run_worker_task, job)] = job
+    
+    def _run_inline(self, job: MediaJob) -> None:
+        """Run a media job in this process and checkpoint its outcome."""
+        before = dict(self.stats)
+        self.run_job(job)
+        self.record_result(job, {k: self.stats[k] - before[k] for k in self.stats})
+    
+    def _collect(self, return_when) -> None:
+        """Merge the stats of finished worker tasks and checkpoint their outcome."""
+        done, _ = wait(self._pending, return_when=return_when)
+        for future in done:
+            job = self._pending.pop(future)
+            self._lanes[self.lane_for(job)].finished()
+            try:
+                stats, timings, digests = future.result()
+                self.timings.merge(timings)
+                self._output_digests.update(digests)
+            except Exception as e:
+                logger.error(f"Worker task failed: {e}")
+                stats = dict.fromkeys(self.stats, 0)
+                stats['errors'] = 1
+            self.merge_stats(stats)
+            self.record_result(job, stats)
+    
+    def stop_workers(self) -> None:
+        """Wait for all queued work and shut the worker lanes down."""
+        if not self._lanes:
+            return
+        
+        self._collect(ALL_COMPLETED)
+        for lane in self._lanes.values():
+            lane.shutdown()
+            self.lane_report[lane.name] = lane.to_dict()
+            logger.info(f"Lane {lane.name}: {lane.jobs} jobs on {lane.workers} workers, "
+                        f"max queue depth {lane.max_depth}")
+        self._lanes = {}
+    
+    def is_media(self, name: str) -> bool:
+        """Return True if a file name has a supported image or video extension."""
+        return media_formats.handler_for(name) is not None
+    
+    def is_video(self, name: str) -> bool:
+        handler = media_formats.handler_for(name)
+        return handler is not None and handler.kind == media_formats.KIND_VIDEO
+    
+    def open_source(self, source: Union[Path, ArchiveMember]):
+        """Open an extracted file or a zip member for binary reading."""
+        if isinstance(source, ArchiveMember):
+            return self.open_archive(source.archive).open(source.info)
+        member = self._scratch_sources.get(source)
+        if member is not None and not source.exists():
+            # The copy was moved into place or went away with its batch; the zip still has the bytes
+            return self.open_archive(member.archive).open(member.info)
+        return open(source, 'rb')
+    
+    def load_sidecar(self, sidecar: Union[Path, ArchiveMember, None]) -> Dict:
+        """Parse the sidecar of a media job, wherever it lives."""
+        if sidecar is None:
+            return {}
+        if isinstance(sidecar, ArchiveMember):
+            return self.read_member_metadata(sidecar)
+        return self.parse_metadata(sidecar)
+    
+    def link_duplicates(self) -> None:
+        """Link held-back duplicates to the first processed copy, or process them if they differ."""
+        deferred, self._duplicates.deferred = self._duplicates.deferred, []
+        if not deferred:
+            return
         
+        logger.info(f"Checking {len(deferred)} possible duplicates...")
+        fingerprints = {}
+        
+        def fingerprint(job: MediaJob) -> Tuple[str, str]:
+            if job not in fingerprints:
+                with self.open_source(job.source) as stream:
+                    fingerprints[job] = (content_hash(stream), metadata_digest(self.load_sidecar(job.sidecar)))
+            return fingerprints[job]
+        
+        for job in deferred:
+            match = None
+            try:
+                for first in self._duplicates.candidates(job):
+                    if first.output.exists() and fingerprint(first) == fingerprint(job):
+                        match = first
+                        break
+            except Exception as e:
+                logger.error(f"Failed to hash {job.name}: {e}")
+            
+            if match is None:
+                # Same size and CRC but different content or metadata: process it after all
+                self._duplicates.add(job)
+                self._run_inline(job)
+                continue
+            
+            self.link_duplicate(match, job)
+    
+    def link_duplicate(self, first: MediaJob, job: MediaJob) -> None:
+        """Place a duplicate's output as a link to the first copy's output."""
+        with self.timings.measure('dedup_link', job.name, job.size):
+            linked = placement.link_file(first.output, job.output, self.dedup)
+        
+        stats = dict.fromkeys(self.stats, 0)
+        stats['total_files'] = 1
+        stats[f'processed_{media_formats.handler_for(job.name).kind}s'] = 1
+        stats['duplicates'] = 1
+        if linked:
+            stats['bytes_saved'] = job.output.stat().st_size
+        
+        self.merge_stats(stats)
+        self.record_result(job, stats, linked_to=first.output)
+    
+    def open_archive(self, archive: Path) -> zipfile.ZipFile:
+        """Return an open handle for a takeout zip, reusing it across members."""
+        zip_ref = self._archives.get(archive)
+        if zip_ref is None:
+            zip_ref = self._archives[archive] = zipfile.ZipFile(archive, 'r')
+        return zip_ref
+    
+    def close_archives(self) -> None:
+        """Close every zip opened by open_archive."""
+        for zip_ref in self._archives.values():
+            zip_ref.close()
+        self._archives = {}
+    
+    def find_archives(self) -> List[Path]:
+        """Find all takeout zip files in the takeout directory, or the finished parts when watching."""
+        if self.archives is not None:
+            return list(self.archives)
+        zip_files = sorted(self.takeout_dir.glob("takeout-*.zip"))
+        if not zip_files:
+            raise ValueError(f"No takeout zip files found in {self.takeout_dir}")
+        return zip_files
+    
     def extract_archives(self) -> None:
-        """Extract all takeout zip files to a temporary directory."""
+        """Extract all takeout zip files to a temporary directory, inflating members in parallel."""
         logger.info("Extracting takeout archives...")
         
         # Find all zip files
-        zip_files = list(self.takeout_dir.glob("takeout-*.zip"))
-        if not zip_files:
-            raise ValueError(f"No takeout zip files found in {self.takeout_dir}")
-            
-        logger.info(f"Found {len(zip_files)} zip files to extract")
+        zip_files = self.find_archives()
+        logger.info(f"Found {len(zip_files)} zip files to extract with {self.extract_workers} threads")
         
         # Create extraction directory
         self.extraction_dir = self.output_dir / "extracted"
         self.extraction_dir.mkdir(exist_ok=True)
         
-        for zip_file in zip_files:
-            logger.info(f"Extracting {zip_file.name}...")
-            try:
-                with zipfile.ZipFile(zip_file, 'r') as zip_ref:
-                    zip_ref.extractall(self.extraction_dir)
-            except Exception as e:
-                logger.error(f"Failed to extract {zip_file}: {e}")
-                self.stats['errors'] += 1
+        # A resumed run can only trust earlier extractions if the tree is still there
+        if self.manifest is not None and not (self.extraction_dir / "Takeout").exists():
+            self.manifest.reset_archives()
+        
+        try:
+            plan = self.plan_extraction(zip_files)
+        finally:
+            self.close_archives()
+        
+        # zlib releases the GIL, so threads inflate members concurrently; each keeps its own zip handles
+        local = threading.local()
+        opened: List[zipfile.ZipFile] = []
+        opened_lock = threading.Lock()
+        
+        def extract_member(zip_file: Path, info: zipfile.ZipInfo, target: Path) -> Tuple[float, str]:
+            started = time.perf_counter()
+            if zip_range.is_stored(info):
+                # Already compressed media is copied straight out of the archive
+                digest = zip_range.copy_stored(zip_file, info, target)
+                return time.perf_counter() - started, digest
+            handles = local.__dict__.setdefault('handles', {})
+            zip_ref = handles.get(zip_file)
+            if zip_ref is None:
+                zip_ref = handles[zip_file] = zipfile.ZipFile(zip_file, 'r')
+                with opened_lock:
+                    opened.append(zip_ref)
+            with zip_ref.open(info) as source, integrity.HashingWriter(target) as out:
+                shutil.copyfileobj(source, out, STREAM_CHUNK_SIZE)
+            return time.perf_counter() - started, out.hexdigest()
+        
+        remaining = {zip_file: len(infos) for zip_file, infos in plan.items()}
+        failed = set()
+        pending = {}
+        
+        def finish(done) -> None:
+            for future in done:
+                zip_file, info, target = pending.pop(future)
+                try:
+                    seconds, self._source_digests[target] = future.result()
+                    self.timings.record('extract', seconds, info.file_size, info.filename)
+                except Exception as e:
+                    logger.error(f"Failed to extract {info.filename} from {zip_file.name}: {e}")
+                    if zip_file not in failed:
+                        failed.add(zip_file)
+                        self.record_error('extract', f"{zip_file.name}: {info.filename}: {e}")
+                remaining[zip_file] -= 1
+                if not remaining[zip_file]:
+                    self.finish_archive(zip_file, plan[zip_file], zip_file not in failed)
+        
+        try:
+            with ThreadPoolExecutor(max_workers=self.extract_workers) as pool:
+                for zip_file, infos in plan.items():
+                    if self.manifest is not None and self.manifest.archive_extracted(zip_file):
+                        logger.info(f"Skipping {zip_file.name}, already extracted")
+                        continue
+                    
+                    logger.info(f"Extracting {zip_file.name}...")
+                    if not infos:
+                        self.finish_archive(zip_file, infos, True)
+                    for info in infos:
+                        target = self.extraction_target(info)
+                        if target is None:
+                            logger.error(f"Refusing to extract {info.filename} from {zip_file.name}: unsafe path")
+                            self.record_error('extract', f"{zip_file.name}: unsafe path {info.filename}")
+                            failed.add(zip_file)
+                            remaining[zip_file] -= 1
+                            continue
+                        # Directories are made here so threads never race to create them
+                        target.parent.mkdir(parents=True, exist_ok=True)
+                        if len(pending) >= self.extract_workers * WORKER_QUEUE_FACTOR:
+                            finish(wait(pending, return_when=FIRST_COMPLETED)[0])
+                        pending[pool.submit(extract_member, zip_file, info, target)] = (zip_file, info, target)
+                    if infos and not remaining[zip_file]:
+                        self.finish_archive(zip_file, infos, False)
+                
+                finish(wait(pending)[0])
+        finally:
+            for zip_ref in opened:
+                zip_ref.close()
                 
         # Find the Google Photos directory
         self.photos_dir = self.extraction_dir / "Takeout" / "Google Photos"
@@ -89,11 +692,54 @@ class TakeoutProcessor:
             
         logger.info(f"Extraction complete. Photos directory: {self.photos_dir}")
     
+    def plan_extraction(self, zip_files: List[Path]) -> Dict[Path, List[zipfile.ZipInfo]]:
+        """Return the members to extract from each archive.
+        
+        When several parts contain the same path, the first part in sorted order wins, so the
+        result does not depend on which extraction finishes first.
+        """
+        owners: Dict[str, Tuple[Path, zipfile.ZipInfo]] = {}
+        plan = {}
+        for zip_file in zip_files:
+            try:
+                zip_ref = self.open_archive(zip_file)
+            except Exception as e:
+                logger.error(f"Failed to extract {zip_file}: {e}")
+                self.record_error('extract', f"{zip_file.name}: {e}")
+                continue
+            
+            plan[zip_file] = []
+            for info in zip_ref.infolist():
+                if info.is_dir():
+                    continue
+                owner = owners.get(info.filename)
+                if owner is None:
+                    owners[info.filename] = (zip_file, info)
+                    plan[zip_file].append(info)
+                elif (owner[1].file_size, owner[1].CRC) != (info.file_size, info.CRC):
+                    logger.warning(f"{info.filename} differs between {owner[0].name} and {zip_file.name}; "
+                                   f"keeping the copy from {owner[0].name}")
+        return plan
+    
+    def extraction_target(self, info: zipfile.ZipInfo) -> Optional[Path]:
+        """Return where a member is extracted, or None if its name would escape the extraction directory."""
+        relative = os.path.normpath(info.filename.replace('\\', '/'))
+        if os.path.isabs(relative) or relative.split(os.sep)[0] == '..':
+            return None
+        return self.extraction_dir / relative
+    
+    def finish_archive(self, zip_file: Path, infos: List[zipfile.ZipInfo], succeeded: bool) -> None:
+        """Checkpoint an archive once every member planned from it has been written."""
+        if succeeded and self.manifest is not None:
+            self.manifest.record_extracted(zip_file, infos)
+    
     def parse_metadata(self, json_path: Path) -> Dict:
         """Parse metadata from Google Photos JSON file."""
         try:
-            with open(json_path, 'r', encoding='utf-8') as f:
-                return json.load(f)
+            with self.timings.measure('metadata', json_path.name) as measurement, open(json_path, 'rb') as f:
+                data = f.read()
+                measurement.bytes = len(data)
+                return json.loads(data)
         except Exception as e:
             logger.error(f"Failed to parse metadata from {json_path}: {e}")
             return {}
@@ -108,6 +754,7 @@ class TakeoutProcessor:
     
     def set_gps_exif(self, exif_dict: Dict, latitude: float, longitude: float, altitude: float = None) -> None:
         """Set GPS information in EXIF data."""
+        import piexif
         try:
             # Convert decimal degrees to degrees, minutes, seconds
             def decimal_to_dms(decimal_deg):
@@ -137,110 +784,243 @@ class TakeoutProcessor:
         except Exception as e:
             logger.error(f"Failed to set GPS EXIF data: {e}")
     
+    def build_exif_bytes(self, image, metadata: Dict) -> bytes:
+        """Build EXIF bytes for an image (path, raw bytes or EXIF payload) from Google Photos metadata."""
+        # Heavy format dependencies are imported on first use; media_formats loads them per format
+        import piexif
+        # Load existing EXIF data
+        try:
+            if image is None:
+                raise ValueError("No existing EXIF data")
+            exif_dict = piexif.load(image)
+        except Exception:
+            # Create new EXIF structure if none exists
+            exif_dict = {"0th": {}, "Exif": {}, "GPS": {}, "Interop": {}, "1st": {}, "thumbnail": None}
+        
+        # Set timestamp from photoTakenTime
+        if 'photoTakenTime' in metadata:
+            timestamp = metadata['photoTakenTime'].get('timestamp')
+            if timestamp:
+                exif_time = self.convert_timestamp_to_exif(timestamp)
+                if exif_time:
+                    exif_dict['Exif'][piexif.ExifIFD.DateTimeOriginal] = exif_time.encode()
+                    exif_dict['Exif'][piexif.ExifIFD.DateTimeDigitized] = exif_time.encode()
+                    exif_dict['0th'][piexif.ImageIFD.DateTime] = exif_time.encode()
+        
+        # Set GPS data
+        if 'geoData' in metadata:
+            geo = metadata['geoData']
+            lat = geo.get('latitude')
+            lon = geo.get('longitude')
+            alt = geo.get('altitude')
+            if lat is not None and lon is not None:
+                self.set_gps_exif(exif_dict, lat, lon, alt)
+        
+        # Set image description
+        if 'description' in metadata and metadata['description']:
+            exif_dict['0th'][piexif.ImageIFD.ImageDescription] = metadata['description'].encode()
+        
+        # Set camera make/model if available
+        if 'googlePhotosOrigin' in metadata:
+            origin = metadata['googlePhotosOrigin']
+            if 'mobileUpload' in origin:
+                device_type = origin['mobileUpload'].get('deviceType', '')
+                if device_type:
+                    exif_dict['0th'][piexif.ImageIFD.Make] = f"Google Photos ({device_type})".encode()
+        
+        return piexif.dump(exif_dict)
+    
+    def build_exiftool_tags(self, metadata: Dict) -> List[str]:
+        """Build exiftool tag arguments carrying the same fields as build_exif_bytes."""
+        tags = []
+        timestamp = metadata.get('photoTakenTime', {}).get('timestamp')
+        exif_time = self.convert_timestamp_to_exif(timestamp) if timestamp else ''
+        if exif_time:
+            tags += [f'-EXIF:DateTimeOriginal={exif_time}', f'-EXIF:CreateDate={exif_time}',
+                     f'-EXIF:ModifyDate={exif_time}']
+        
+        geo = metadata.get('geoData', {})
+        lat, lon, alt = geo.get('latitude'), geo.get('longitude'), geo.get('altitude')
+        if lat is not None and lon is not None:
+            tags += [f'-EXIF:GPSLatitude={abs(lat)}', f"-EXIF:GPSLatitudeRef={'N' if lat >= 0 else 'S'}",
+                     f'-EXIF:GPSLongitude={abs(lon)}', f"-EXIF:GPSLongitudeRef={'E' if lon >= 0 else 'W'}"]
+            if alt is not None:
+                tags += [f'-EXIF:GPSAltitude={alt}', '-EXIF:GPSAltitudeRef=0']
+        
+        if metadata.get('description'):
+            tags.append(f"-EXIF:ImageDescription={exiftool_writer.escape(metadata['description'])}")
+        
+        device_type = metadata.get('googlePhotosOrigin', {}).get('mobileUpload', {}).get('deviceType', '')
+        if device_type:
+            tags.append(f'-EXIF:Make=Google Photos ({exiftool_writer.escape(device_type)})')
+        return tags
+    
+    def exiftool(self) -> exiftool_writer.ExifTool:
+        """Return this processor copy's exiftool process, starting it on first use."""
+        if self._exiftool is None:
+            self._exiftool = exiftool_writer.ExifTool().start()
+        return self._exiftool
+    
+    def close_exiftool(self) -> None:
+        if self._exiftool is not None:
+            self._exiftool.close()
+            self._exiftool = None
+    
+    def write_with_exiftool(self, source: Path, metadata: Dict, output_path: Optional[Path] = None) -> None:
+        """Write metadata with the persistent exiftool, into output_path or in place."""
+        tags = self.build_exiftool_tags(metadata)
+        with self.timings.measure('exiftool', source.name):
+            if not tags:
+                if output_path is not None:
+                    self.place_output(source, output_path)
+                return
+            self.exiftool().write(source, tags, output_path)
+        self.hash_output(output_path or source)
+    
     def process_image_metadata(self, image_path: Path, metadata: Dict, output_path: Path) -> bool:
         """Process and embed metadata into image file."""
-        try:
-            # Load existing EXIF data
+        if image_path.suffix.lower() in JPEG_EXTENSIONS:
+            success = self.process_jpeg(lambda: open(image_path, 'rb'), metadata, output_path)
+            shutil.copystat(image_path, output_path)
+            return success
+        
+        if self.metadata_backends.get(image_path.suffix.lower()) == 'exiftool':
             try:
-                exif_dict = piexif.load(str(image_path))
-            except Exception:
-                # Create new EXIF structure if none exists
-                exif_dict = {"0th": {}, "Exif": {}, "GPS": {}, "1st": {}, "thumbnail": None}
-            
-            # Set timestamp from photoTakenTime
-            if 'photoTakenTime' in metadata:
-                timestamp = metadata['photoTakenTime'].get('timestamp')
-                if timestamp:
-                    exif_time = self.convert_timestamp_to_exif(timestamp)
-                    if exif_time:
-                        exif_dict['Exif'][piexif.ExifIFD.DateTimeOriginal] = exif_time.encode()
-                        exif_dict['Exif'][piexif.ExifIFD.DateTimeDigitized] = exif_time.encode()
-                        exif_dict['0th'][piexif.ImageIFD.DateTime] = exif_time.encode()
-            
-            # Set GPS data
-            if 'geoData' in metadata:
-                geo = metadata['geoData']
-                lat = geo.get('latitude')
-                lon = geo.get('longitude')
-                alt = geo.get('altitude')
-                if lat is not None and lon is not None:
-                    self.set_gps_exif(exif_dict, lat, lon, alt)
-            
-            # Set image description
-            if 'description' in metadata and metadata['description']:
-                exif_dict['0th'][piexif.ImageIFD.ImageDescription] = metadata['description'].encode()
-            
-            # Set camera make/model if available
-            if 'googlePhotosOrigin' in metadata:
-                origin = metadata['googlePhotosOrigin']
-                if 'mobileUpload' in origin:
-                    device_type = origin['mobileUpload'].get('deviceType', '')
-                    if device_type:
-                        exif_dict['0th'][piexif.ImageIFD.Make] = f"Google Photos ({device_type})".encode()
-            
-            # Copy image with new EXIF data
-            shutil.copy2(image_path, output_path)
-            
-            # Save EXIF data
-            exif_bytes = piexif.dump(exif_dict)
-            piexif.insert(exif_bytes, str(output_path))
-            
+                self.write_with_exiftool(image_path, metadata, output_path)
+                return True
+            except Exception as e:
+                logger.error(f"Failed to process image metadata for {image_path}: {e}")
+                self.place_output(image_path, output_path)
+                return False
+        
+        # piexif rewrites the whole file anyway, so it is read once and written once, hashed on the way
+        return self.process_image_bytes(image_path.read_bytes(), metadata, output_path)
+    
+    def process_jpeg(self, open_source, metadata: Dict, output_path: Path) -> bool:
+        """Write a JPEG once with its EXIF segment spliced in, copying scan data through in chunks.
+        
+        open_source is a callable returning a fresh binary stream of the source image,
+        so a failed splice can fall back to a plain copy.
+        """
+        try:
+            with open_source() as source:
+                segments = jpeg_exif.read_header_segments(source)
+                with self.timings.measure('exif'):
+                    exif_bytes = self.build_exif_bytes(jpeg_exif.find_exif(segments), metadata)
+                with integrity.HashingWriter(output_path, self._output_digests) as out:
+                    jpeg_exif.write_spliced(segments, exif_bytes, source, out)
             return True
             
         except Exception as e:
-            logger.error(f"Failed to process image metadata for {image_path}: {e}")
+            logger.error(f"Failed to process image metadata for {output_path.name}: {e}")
             # Fallback: just copy the file
-            shutil.copy2(image_path, output_path)
+            with open_source() as source, integrity.HashingWriter(output_path, self._output_digests) as out:
+                shutil.copyfileobj(source, out, STREAM_CHUNK_SIZE)
             return False
     
-    def process_video_metadata(self, video_path: Path, metadata: Dict, output_path: Path) -> bool:
-        """Process and embed metadata into video file using ffmpeg."""
+    def process_image_bytes(self, data: bytes, metadata: Dict, output_path: Path) -> bool:
+        """Embed metadata into in-memory image data and write it to output_path once."""
+        import piexif
+        if self.metadata_backends.get(output_path.suffix.lower()) == 'exiftool':
+            try:
+                self.write_output(output_path, data)
+                self.write_with_exiftool(output_path, metadata)
+                return True
+            except Exception as e:
+                logger.error(f"Failed to process image metadata for {output_path.name}: {e}")
+                self.write_output(output_path, data)
+                return False
+        
         try:
-            # Copy video file first
-            shutil.copy2(video_path, output_path)
-            
-            # Prepare metadata for ffmpeg
-            ffmpeg_metadata = {}
-            
-            # Set creation time
-            if 'photoTakenTime' in metadata:
-                timestamp = metadata['photoTakenTime'].get('timestamp')
-                if timestamp:
-                    dt = datetime.fromtimestamp(int(timestamp), tz=timezone.utc)
-                    ffmpeg_metadata['creation_time'] = dt.isoformat()
-            
-            # Set title and description
-            if 'title' in metadata and metadata['title']:
-                ffmpeg_metadata['title'] = metadata['title']
-            
-            if 'description' in metadata and metadata['description']:
-                ffmpeg_metadata['comment'] = metadata['description']
-            
-            # Set GPS data in metadata
-            if 'geoData' in metadata:
-                geo = metadata['geoData']
-                lat = geo.get('latitude')
-                lon = geo.get('longitude')
-                if lat is not None and lon is not None:
-                    ffmpeg_metadata['location'] = f"{lat:+.6f}{lon:+.6f}/"
-                    ffmpeg_metadata['location-eng'] = f"{lat:+.6f}{lon:+.6f}/"
+            with self.timings.measure('exif'):
+                exif_bytes = self.build_exif_bytes(data, metadata)
+            embedded = io.BytesIO()
+            piexif.insert(exif_bytes, data, embedded)
+            self.write_output(output_path, embedded.getvalue())
+            return True
             
-            # Apply metadata if any exists
-            if ffmpeg_metadata:
-                # Create temporary file for metadata update
-                temp_output = output_path.with_suffix(f".temp{output_path.suffix}")
-                
-                input_stream = ffmpeg.input(str(output_path))
-                output_stream = ffmpeg.output(
-                    input_stream, 
-                    str(temp_output),
-                    **{'c': 'copy', 'map_metadata': '0', 'metadata': [f"{k}={v}" for k, v in ffmpeg_metadata.items()]}
-                )
-                
+        except Exception as e:
+            logger.error(f"Failed to process image metadata for {output_path.name}: {e}")
+            # Fallback: just write the original bytes
+            self.write_output(output_path, data)
+            return False
+    
+    def build_video_metadata(self, metadata: Dict) -> Dict[str, str]:
+        """Map Google Photos metadata onto ffmpeg container metadata keys."""
+        ffmpeg_metadata = {}
+        
+        # Set creation time
+        if 'photoTakenTime' in metadata:
+            timestamp = metadata['photoTakenTime'].get('timestamp')
+            if timestamp:
+                dt = datetime.fromtimestamp(int(timestamp), tz=timezone.utc)
+                ffmpeg_metadata['creation_time'] = dt.isoformat()
+        
+        # Set title and description
+        if 'title' in metadata and metadata['title']:
+            ffmpeg_metadata['title'] = metadata['title']
+        
+        if 'description' in metadata and metadata['description']:
+            ffmpeg_metadata['comment'] = metadata['description']
+        
+        # Set GPS data in metadata
+        if 'geoData' in metadata:
+            geo = metadata['geoData']
+            lat = geo.get('latitude')
+            lon = geo.get('longitude')
+            if lat is not None and lon is not None:
+                ffmpeg_metadata['location'] = f"{lat:+.6f}{lon:+.6f}/"
+                ffmpeg_metadata['location-eng'] = f"{lat:+.6f}{lon:+.6f}/"
+        
+        return ffmpeg_metadata
+    
+    def probe_video(self, video_path: Path) -> Dict[str, str]:
+        """Return a video's container tags from the cached ffprobe result."""
+        with self.timings.measure('ffprobe', video_path.name):
+            return video_metadata.probe_tags(video_path)
+    
+    def needs_remux(self, video_path: Path, ffmpeg_metadata: Dict[str, str]) -> bool:
+        """Return True unless the video already carries every tag ffmpeg_metadata would set."""
+        if not ffmpeg_metadata:
+            return False
+        try:
+            return not video_metadata.metadata_matches(self.probe_video(video_path), ffmpeg_metadata)
+        except Exception as e:
+            logger.debug(f"Could not probe {video_path.name}, remuxing: {e}")
+            return True
+    
+    def remux_video(self, source_path: Path, output_path: Path, ffmpeg_metadata: Dict[str, str]) -> None:
+        """Write source_path to output_path in one ffmpeg pass with updated container metadata."""
+        import ffmpeg
+        # Write outside processed/ and rename, so a failed remux never leaves a partial file to upload
+        temp_output = self.staging_path(output_path, 'temp')
+        
+        input_stream = ffmpeg.input(str(source_path))
+        output_stream = ffmpeg.output(
+            input_stream, 
+            str(temp_output),
+            **{'c': 'copy', 'map_metadata': '0', 'metadata': [f"{k}={v}" for k, v in ffmpeg_metadata.items()]}
+        )
+        
+        try:
+            with self.timings.measure('remux', source_path.name, source_path.stat().st_size):
                 ffmpeg.run(output_stream, quiet=True, overwrite_output=True)
-                
-                # Replace original with updated file
-                temp_output.replace(output_path)
+        except BaseException:
+            temp_output.unlink(missing_ok=True)
+            raise
+        
+        temp_output.replace(output_path)
+    
+    def process_video_metadata(self, video_path: Path, metadata: Dict, output_path: Path) -> bool:
+        """Process and embed metadata into video file using ffmpeg."""
+        try:
+            ffmpeg_metadata = self.build_video_metadata(metadata)
+            if self.needs_remux(video_path, ffmpeg_metadata):
+                self.remux_video(video_path, output_path, ffmpeg_metadata)
+                self.hash_output(output_path)
+            else:
+                # Tags already match, so placing the file is the whole job; a throwaway copy is just renamed
+                self.place_output(video_path, output_path, move=self.is_scratch_copy(video_path))
             
             return True
             
@@ -248,72 +1028,501 @@ class TakeoutProcessor:
             logger.error(f"Failed to process video metadata for {video_path}: {e}")
             # Fallback: just copy the file
             if not output_path.exists():
-                shutil.copy2(video_path, output_path)
+                self.place_output(video_path, output_path)
+            return False
+    
+    def process_jpeg_member(self, zip_ref: zipfile.ZipFile, info: zipfile.ZipInfo, metadata: Dict,
+                            output_path: Path) -> bool:
+        return self.process_jpeg(lambda: zip_ref.open(info), metadata, output_path)
+    
+    def process_image_member(self, zip_ref: zipfile.ZipFile, info: zipfile.ZipInfo, metadata: Dict,
+                             output_path: Path) -> bool:
+        return self.process_image_bytes(zip_ref.read(info), metadata, output_path)
+    
+    def process_video_member(self, zip_ref: zipfile.ZipFile, info: zipfile.ZipInfo, metadata: Dict,
+                             output_path: Path) -> bool:
+        """Write a video member to output_path and embed metadata."""
+        # ffmpeg needs a seekable file, so the member is written out once before probing
+        staged = self.staging_path(output_path, 'stream')
+        try:
+            digest = self.write_member(Path(zip_ref.filename), info, staged, zip_ref)
+        except Exception as e:
+            logger.error(f"Failed to stream {output_path.name}: {e}")
+            staged.unlink(missing_ok=True)
+            return False
+        
+        try:
+            ffmpeg_metadata = self.build_video_metadata(metadata)
+            if self.needs_remux(staged, ffmpeg_metadata):
+                self.remux_video(staged, output_path, ffmpeg_metadata)
+                staged.unlink()
+                self.hash_output(output_path)
+            else:
+                # Tags already match, so a stored member was never read into Python at all
+                staged.replace(output_path)
+                self._output_digests[output_path] = digest
+            
+            return True
+            
+        except Exception as e:
+            logger.error(f"Failed to process video metadata for {output_path.name}: {e}")
+            # The streamed copy is still usable without the remuxed metadata
+            if staged.exists():
+                staged.replace(output_path)
+                self._output_digests[output_path] = digest
             return False
     
-    def process_album(self, album_dir: Path) -> None:
-        """Process a single album directory."""
-        album_name = album_dir.name
-        logger.info(f"Processing album: {album_name}")
+    def write_member(self, archive: Path, info: zipfile.ZipInfo, target: Path,
+                     zip_ref: Optional[zipfile.ZipFile] = None) -> str:
+        """Write a member's bytes to target and return their digest.
+        
+        Stored members are copied as a byte range of the archive, CRC checked; the rest are inflated
+        through zip_ref, or this processor copy's handle of the archive.
+        """
+        if zip_range.is_stored(info):
+            return zip_range.copy_stored(archive, info, target)
+        with (zip_ref or self.open_archive(archive)).open(info) as source, \
+                integrity.HashingWriter(target) as out:
+            shutil.copyfileobj(source, out, STREAM_CHUNK_SIZE)
+        return out.hexdigest()
+    
+    def process_albums(self, albums: List[AlbumPlan], source_for) -> None:
+        """Dispatch every album; with an I/O lane, large videos of all albums are dispatched first."""
+        if LANE_IO not in self._lanes:
+            for album in albums:
+                self.process_album(album, source_for)
+            return
+        
+        # A large video started last would finish last, long after every other lane went idle
+        jobs = large_first((job for album in albums for job in self.album_jobs(album, source_for)),
+                           lambda job: self.lane_for(job) == LANE_IO, lambda job: job.size)
+        for job in jobs:
+            self.dispatch(job)
+        for album in albums:
+            self.record_album(album.name)
+    
+    def process_album(self, album: AlbumPlan, source_for) -> None:
+        """Dispatch every pending file of an album; source_for maps a zip member to what a job reads."""
+        for job in self.album_jobs(album, source_for):
+            self.dispatch(job)
+        self.record_album(album.name)
+    
+    def album_jobs(self, album: AlbumPlan, source_for) -> Iterator[MediaJob]:
+        """Yield a job for every pending file of an album."""
+        logger.info(f"Processing album: {album.name}")
         
         # Create output album directory
-        output_album_dir = self.output_dir / "processed" / album_name
+        output_album_dir = self.output_dir / "processed" / album.name
         output_album_dir.mkdir(parents=True, exist_ok=True)
         
         # Parse album metadata if available
-        album_metadata = {}
-        album_metadata_file = album_dir / "metadata.json"
-        if album_metadata_file.exists():
-            album_metadata = self.parse_metadata(album_metadata_file)
-            logger.info(f"Found album metadata: {album_metadata.get('title', album_name)}")
-        
-        # Process all media files in the album
-        for file_path in album_dir.iterdir():
-            if file_path.is_file() and not file_path.name.endswith('.json'):
-                self.process_media_file(file_path, output_album_dir)
+        if album.metadata is not None:
+            album_metadata = self.read_member_metadata(album.metadata)
+            logger.info(f"Found album metadata: {album_metadata.get('title', album.name)}")
         
+        deferred = 0
+        for planned in album.files:
+            key = planned.key
+            if self.manifest is not None and self.manifest.is_done(key):
+                continue
+            if self.defer_unmatched and planned.sidecar is None and self.is_media(planned.name):
+                # Its sidecar may be in a part that has not finished downloading
+                deferred += 1
+                continue
+            
+            source = source_for(planned.member)
+            if source is None:
+                continue
+            sidecar = source_for(planned.sidecar) if planned.sidecar is not None else None
+            yield MediaJob(planned.name, album.name, planned.size, source, sidecar,
+                           output_album_dir / planned.name, key)
+        if deferred:
+            logger.info(f"{deferred} files of {album.name} wait for their sidecar")
+    
+    def record_album(self, album_name: str) -> None:
         self.stats['albums_created'] += 1
+        if self.manifest is not None:
+            self.manifest.record_album(album_name)
     
-    def process_media_file(self, file_path: Path, output_dir: Path) -> None:
-        """Process a single media file with its metadata."""
+    def extracted_source(self, member: ArchiveMember) -> Optional[Path]:
+        """Return the extracted copy of a zip member, or None if its archive failed to extract."""
+        target = self.extraction_target(member.info)
+        if target is None or not target.exists():
+            logger.warning(f"{member.info.filename} is missing from the extracted tree")
+            return None
+        self._scratch_sources[target] = member
+        return target
+    
+    def staging_path(self, output_path: Path, tag: str) -> Path:
+        """Return where to build an output before it is renamed into place.
+        
+        Staged files live outside processed/, on the same filesystem, so an interrupted run never
+        leaves a partial file where an upload would pick it up.
+        """
+        staging_dir = self.output_dir / "staging" / output_path.parent.name
+        staging_dir.mkdir(parents=True, exist_ok=True)
+        return staging_dir / f"{output_path.stem}.{tag}{output_path.suffix}"
+    
+    def is_scratch_copy(self, path: Path) -> bool:
+        """Return True for extracted and scratch copies, which may be moved into processed/ instead of copied."""
+        # Path.is_relative_to needs Python 3.9
+        for name in ('extracted', 'scratch'):
+            try:
+                path.relative_to(self.output_dir / name)
+                return True
+            except ValueError:
+                pass
+        return False
+    
+    def place_output(self, source: Path, output_path: Path, move: bool = False) -> str:
+        """Place an unmodified source at output_path with the cheapest placement tier and time it per tier."""
+        started = time.perf_counter()
+        tier = placement.place_file(source, output_path, move)
+        # The bytes are the source's, which were hashed when it was extracted
+        self._output_digests[output_path] = integrity.SAME_AS_SOURCE
+        self.timings.record(f'place_{tier}', time.perf_counter() - started, output_path.stat().st_size,
+                            output_path.name)
+        return tier
+    
+    def process_media_file(self, file_path: Path, output_dir: Path,
+                           metadata_file: Union[Path, ArchiveMember, None] = None) -> None:
+        """Process a single media file with its metadata from metadata_file, if it has one."""
         self.stats['total_files'] += 1
         
         # Skip if not a supported media file
-        if file_path.suffix.lower() not in (self.image_extensions | self.video_extensions):
+        handler = media_formats.handler_for(file_path.name)
+        if handler is None:
             self.stats['skipped_files'] += 1
             return
         
-        # Look for metadata file
-        metadata_file = file_path.with_suffix(file_path.suffix + '.supplemental-metadata.json')
-        if not metadata_file.exists():
-            # Try alternative naming
-            metadata_file = file_path.parent / f"{file_path.name}.json"
-        
         metadata = {}
-        if metadata_file.exists():
-            metadata = self.parse_metadata(metadata_file)
+        if metadata_file is not None:
+            metadata = self.load_sidecar(metadata_file)
         else:
             logger.warning(f"No metadata found for {file_path}")
         
         # Create output file path
         output_file = output_dir / file_path.name
         
-        # Process based on file type
+        # Process with the handler registered for the file type
         success = False
-        if file_path.suffix.lower() in self.image_extensions:
-            success = self.process_image_metadata(file_path, metadata, output_file)
-            if success:
-                self.stats['processed_images'] += 1
-        elif file_path.suffix.lower() in self.video_extensions:
-            success = self.process_video_metadata(file_path, metadata, output_file)
+        size = file_path.stat().st_size
+        try:
+            with self.timings.measure(handler.kind, file_path.name, size):
+                success = handler.load().process_file(self, file_path, metadata, output_file)
+        except ImportError as e:
+            logger.error(f"Cannot process {file_path.name} without {e.name}: {e}")
+        if success:
+            self.stats[f'processed_{handler.kind}s'] += 1
+        else:
+            self.stats['errors'] += 1
+    
+    def index_archives(self, zip_files: List[Path]) -> Dict[str, Dict[str, ArchiveMember]]:
+        """Index Google Photos members of all archives by album using only their central directories."""
+        albums = {}
+        for zip_file in zip_files:
+            try:
+                zip_ref = self.open_archive(zip_file)
+            except Exception as e:
+                logger.error(f"Failed to open {zip_file}: {e}")
+                self.record_error('open', f"{zip_file.name}: {e}")
+                continue
+            
+            for info in zip_ref.infolist():
+                if info.is_dir() or not info.filename.startswith(TAKEOUT_PHOTOS_PREFIX):
+                    continue
+                
+                # Only album/file entries; top-level JSON files are not media
+                parts = info.filename[len(TAKEOUT_PHOTOS_PREFIX):].split('/')
+                if len(parts) != 2 or parts[0].startswith('.'):
+                    continue
+                
+                album_name, name = parts
+                # Albums and sidecars may be split across parts; the first archive wins
+                albums.setdefault(album_name, {}).setdefault(name, ArchiveMember(zip_file, info))
+        return albums
+    
+    def build_plan(self) -> WorkPlan:
+        """Build the work plan from the central directories of all takeout zips, without reading media."""
+        zip_files = self.find_archives()
+        logger.info(f"Planning from the central directories of {len(zip_files)} zip files")
+        albums = self.index_archives(zip_files)
+        if not albums:
+            raise ValueError("Google Photos directory not found in takeout archives")
+        
+        archive_bytes = sum(info.file_size for zip_ref in self._archives.values()
+                            for info in zip_ref.infolist() if not info.is_dir())
+        
+        plan_albums = {}
+        for album_name, members in albums.items():
+            # Resolve sidecars here so each job carries everything it needs
+            index = SidecarIndex(members)
+            files = []
+            for name in index.media:
+                sidecar_name = index.resolve(name)
+                files.append(PlannedFile(album_name, name, members[name],
+                                         members[sidecar_name] if sidecar_name else None))
+            plan_albums[album_name] = AlbumPlan(album_name, members.get('metadata.json'), files)
+        return WorkPlan(plan_albums, zip_files, archive_bytes)
+    
+    def plan_work(self) -> WorkPlan:
+        """Return the plan this run executes, building it on first use."""
+        if self.plan is None:
+            plan = self.build_plan()
+            if self.delta_index is not None:
+                plan = self.apply_delta(plan)
+            self.plan = plan
+        return self.plan
+    
+    def apply_delta(self, plan: WorkPlan) -> WorkPlan:
+        """Return the part of a plan that is new or changed since the runs recorded in the delta index.
+        
+        Files whose metadata changed but whose asset Immich already has are not processed again;
+        their new metadata is sent by update_metadata() instead. That needs the asset id, which
+        only the native uploader records.
+        """
+        if self._import_index is None:
+            self._import_index = ImportIndex(self.delta_index)
+        uploading = bool(self.immich_server and self.api_key)
+        # Metadata changes without a known asset id, processed and uploaded again
+        reprocessed = 0
+        
+        albums = {}
+        for album in plan.albums.values():
+            files = []
+            for planned in album.files:
+                if not self.is_media(planned.name):
+                    continue
+                path = f"{album.name}/{planned.name}"
+                metadata = self.read_member_metadata(planned.sidecar) if planned.sidecar is not None else {}
+                digest = metadata_digest(metadata)
+                state, asset_id = self._import_index.classify(path, planned.size, planned.member.info.CRC,
+                                                              digest, uploading)
+                self.delta_counts[state] += 1
+                if state == DELTA_UNCHANGED:
+                    continue
+                if state == DELTA_METADATA and asset_id and uploading:
+                    self._metadata_updates[asset_id] = (path, digest, metadata)
+                    continue
+                if state == DELTA_METADATA and uploading:
+                    reprocessed += 1
+                self._delta_digests[path] = digest
+                files.append(planned)
+            if files:
+                albums[album.name] = AlbumPlan(album.name, album.metadata, files)
+        
+        counts = self.delta_counts
+        logger.info(f"Delta against {self.delta_index}: {counts['new']} new or changed, "
+                    f"{counts['metadata']} with changed metadata, {counts['unchanged']} unchanged")
+        if reprocessed:
+            hint = "" if self.uploader == 'native' else "; only --uploader native records them for in-place updates"
+            logger.warning(f"{reprocessed} files have changed metadata but no recorded Immich asset id, "
+                           f"so they are processed and uploaded again{hint}")
+        return WorkPlan(albums, plan.archives, plan.archive_bytes)
+    
+    def close_import_index(self) -> None:
+        if self._import_index is not None:
+            self._import_index.close()
+            self._import_index = None
+    
+    def build_asset_update(self, metadata: Dict) -> Dict:
+        """Map Google Photos metadata onto the fields of an Immich asset update."""
+        fields = {'description': metadata.get('description', '')}
+        timestamp = metadata.get('photoTakenTime', {}).get('timestamp')
+        if timestamp:
+            fields['dateTimeOriginal'] = datetime.fromtimestamp(int(timestamp), tz=timezone.utc).isoformat()
+        geo = metadata.get('geoData', {})
+        if geo.get('latitude') is not None and geo.get('longitude') is not None:
+            fields['latitude'] = geo['latitude']
+            fields['longitude'] = geo['longitude']
+        return fields
+    
+    def update_metadata(self) -> None:
+        """Send changed metadata of files Immich already has, instead of processing them again."""
+        updates = {asset_id: self.build_asset_update(metadata)
+                   for asset_id, (_, _, metadata) in self._metadata_updates.items()}
+        logger.info(f"Updating metadata of {len(updates)} assets in Immich...")
+        report, updated = immich_upload.update_assets(self.immich_server, self.api_key, updates,
+                                                      self.upload_concurrency)
+        self.timings.record('metadata_update', report.seconds)
+        logger.info(f"Updated metadata of {report.updated} assets in {report.seconds:.1f}s")
+        for asset_id, error in report.failed:
+            logger.error(f"Failed to update asset {asset_id}: {error}")
+            self.record_error('metadata_update', f"{asset_id}: {error}")
+        for asset_id in updated:
+            path, digest, _ = self._metadata_updates[asset_id]
+            self._import_index.update_digest(path, digest)
+        self._metadata_updates = {}
+    
+    def record_asset_ids(self, report: immich_upload.UploadReport) -> None:
+        """Record the asset ids of uploaded files in the integrity manifest and the delta index."""
+        processed_dir = self.output_dir / "processed"
+        assets = [(path.relative_to(processed_dir).as_posix(), asset_id)
+                  for path, asset_id in report.asset_ids.items()]
+        if self.integrity is not None:
+            self.integrity.set_asset_ids(assets)
+        if self._import_index is not None:
+            self._import_index.mark_uploaded(assets)
+    
+    def write_plan(self, path: Path) -> Dict:
+        """Analyze the plan without touching any media, log a summary and save it as JSON."""
+        try:
+            plan = self.plan_work()
+            plan.analyze(self.read_member_metadata, self.is_media)
+        finally:
+            self.close_archives()
+            self.close_import_index()
+        
+        options = {'stream': self.stream, 'workers': self.workers, 'dedup': self.dedup,
+                   'scratch_budget': self.scratch_budget, 'pipeline': self.pipeline,
+                   'upload': bool(self.immich_server and self.api_key)}
+        summary = plan.to_dict(self.is_video, self.is_media, options, load_calibration(self.report_path))
+        for line in format_summary(summary):
+            logger.info(line)
+        Path(path).write_text(json.dumps(summary, indent=2))
+        logger.info(f"Plan written to {path}")
+        return summary
+    
+    def read_member_metadata(self, member: ArchiveMember) -> Dict:
+        """Parse a Google Photos JSON file straight from its zip member."""
+        try:
+            with self.timings.measure('metadata', member.info.filename, member.info.file_size), \
+                    self.open_archive(member.archive).open(member.info) as f:
+                return json.load(f)
+        except Exception as e:
+            logger.error(f"Failed to parse metadata from {member.info.filename}: {e}")
+            return {}
+    
+    def process_archives_streaming(self, plan: WorkPlan) -> None:
+        """Process media straight out of the takeout zips without extracting them."""
+        logger.info(f"Streaming {len(plan.archives)} takeout archives...")
+        self.process_albums(list(plan.albums.values()), lambda member: member)
+    
+    def process_archives_budgeted(self, plan: WorkPlan) -> None:
+        """Extract and process media in batches that fit the scratch budget, deleting each batch when done.
+        
+        The plan covers every archive, so albums and sidecars that are split across takeout parts
+        still resolve; sidecars are read straight from whichever zip has them.
+        """
+        logger.info(f"Processing takeout archives within a {self.scratch_budget / (1024 ** 3):.1f} GB "
+                    f"scratch budget...")
+        
+        scratch_dir = self.output_dir / "scratch"
+        # Leftovers from an interrupted run are not trusted
+        shutil.rmtree(scratch_dir, ignore_errors=True)
+        
+        try:
+            batches = self.plan_scratch_batches(plan)
+            for number, batch in enumerate(batches, 1):
+                batch_bytes = sum(planned.size for planned in batch)
+                logger.info(f"Scratch batch {number}/{len(batches)}: {len(batch)} files, "
+                            f"{batch_bytes / (1024 * 1024):.1f} MB")
+                self.process_scratch_batch(batch, scratch_dir)
+            
+            for album in plan.albums.values():
+                if album.metadata is not None:
+                    album_metadata = self.read_member_metadata(album.metadata)
+                    logger.info(f"Found album metadata: {album_metadata.get('title', album.name)}")
+                self.record_album(album.name)
+        finally:
+            shutil.rmtree(scratch_dir, ignore_errors=True)
+    
+    def plan_scratch_batches(self, plan: WorkPlan) -> List[List[PlannedFile]]:
+        """Group the pending files, in archive order, into batches within the scratch budget."""
+        pending = [planned for planned in plan.files()
+                   if self.manifest is None or not self.manifest.is_done(planned.key)]
+        
+        # Read each archive front to back, one archive (or a few small ones) at a time
+        pending.sort(key=lambda planned: (planned.member.archive, planned.member.info.header_offset))
+        
+        batches, batch, batch_bytes = [], [], 0
+        for planned in pending:
+            if batch and batch_bytes + planned.size > self.scratch_budget:
+                batches.append(batch)
+                batch, batch_bytes = [], 0
+            if planned.size > self.scratch_budget:
+                logger.warning(f"{planned.member.info.filename} ({planned.size / (1024 * 1024):.1f} MB) is "
+                               f"larger than the scratch budget; extracting it on its own")
+            batch.append(planned)
+            batch_bytes += planned.size
+        if batch:
+            batches.append(batch)
+        return batches
+    
+    def process_scratch_batch(self, batch: List[PlannedFile], scratch_dir: Path) -> None:
+        """Extract one batch to scratch, process it, then delete the scratch copies."""
+        try:
+            for planned in batch:
+                member = planned.member
+                output_album_dir = self.output_dir / "processed" / planned.album
+                output_album_dir.mkdir(parents=True, exist_ok=True)
+                job_source = scratch_dir / planned.album / planned.name
+                job = MediaJob(planned.name, planned.album, planned.size, job_source, planned.sidecar,
+                               output_album_dir / planned.name, planned.key)
+                
+                try:
+                    job_source.parent.mkdir(parents=True, exist_ok=True)
+                    with self.timings.measure('extract', member.info.filename, member.info.file_size):
+                        self._source_digests[job_source] = self.write_member(member.archive, member.info,
+                                                                             job_source)
+                except Exception as e:
+                    logger.error(f"Failed to extract {member.info.filename} from {member.archive.name}: {e}")
+                    job_source.unlink(missing_ok=True)
+                    stats = dict.fromkeys(self.stats, 0)
+                    stats.update(total_files=1, errors=1)
+                    self.merge_stats(stats)
+                    self.record_result(job, stats)
+                    continue
+                
+                if self._duplicates is not None:
+                    self._scratch_sources[job_source] = member
+                # Workers start on this file while the next one is extracted
+                self.dispatch(job)
+            
+            # Everything in the batch must be finished before its scratch copies go
+            if self._lanes:
+                self._collect(ALL_COMPLETED)
+            if self._duplicates is not None:
+                self.link_duplicates()
+        finally:
+            shutil.rmtree(scratch_dir, ignore_errors=True)
+    
+    def process_archive_member(self, name: str, member: ArchiveMember, sidecar: Optional[ArchiveMember],
+                               output_dir: Path) -> None:
+        """Read a media member once from its archive and write it once, with metadata, to output_dir."""
+        self.stats['total_files'] += 1
+        
+        # Skip if not a supported media file
+        handler = media_formats.handler_for(name)
+        if handler is None:
+            self.stats['skipped_files'] += 1
+            return
+        
+        metadata = {}
+        if sidecar is not None:
+            metadata = self.read_member_metadata(sidecar)
+        else:
+            logger.warning(f"No metadata found for {member.info.filename}")
+        
+        output_file = output_dir / name
+        
+        success = False
+        try:
+            zip_ref = self.open_archive(member.archive)
+            with self.timings.measure(handler.kind, member.info.filename, member.info.file_size):
+                success = handler.load().process_member(self, zip_ref, member.info, metadata, output_file)
             if success:
-                self.stats['processed_videos'] += 1
+                self.stats[f'processed_{handler.kind}s'] += 1
+        except ImportError as e:
+            logger.error(f"Cannot process {name} without {e.name}: {e}")
+        except Exception as e:
+            logger.error(f"Failed to read {member.info.filename} from {member.archive.name}: {e}")
         
         if not success:
             self.stats['errors'] += 1
     
     def upload_to_immich(self) -> None:
-        """Upload processed files to Immich using immich-go."""
+        """Upload processed files to Immich using immich-go or the native uploader."""
         if not self.immich_server or not self.api_key:
             logger.warning("Immich server or API key not provided. Skipping upload.")
             return
@@ -325,6 +1534,10 @@ class TakeoutProcessor:
         
         logger.info("Uploading to Immich...")
         
+        if self.uploader == 'native':
+            self.upload_native(processed_dir)
+            return
+        
         try:
             # Check if immich-go is available
             subprocess.run(['immich-go', '--version'], check=True, capture_output=True)
@@ -332,53 +1545,370 @@ class TakeoutProcessor:
             logger.error("immich-go not found. Please install from https://github.com/immich-app/immich-go")
             return
         
-        # Upload each album separately to maintain structure
+        albums = {}
         for album_dir in processed_dir.iterdir():
             if album_dir.is_dir():
-                logger.info(f"Uploading album: {album_dir.name}")
-                try:
+                if self.manifest is not None and self.manifest.album_uploaded(album_dir.name):
+                    logger.info(f"Skipping album {album_dir.name}, already uploaded")
+                    continue
+                albums[album_dir.name] = sorted(path for path in album_dir.iterdir() if path.is_file())
+        existing = self.check_existing(albums)
+        
+        # Upload each album separately to maintain structure
+        for album_name, files in albums.items():
+            album_dir = processed_dir / album_name
+            missing = [path for path in files if path not in existing]
+            try:
+                if len(missing) < len(files):
+                    # immich-go only gets the missing files, so the ones Immich has are added to the album here
+                    immich_upload.assign_albums(self.immich_server, self.api_key,
+                                                {album_name: [existing[path] for path in files if path in existing]})
+                if missing:
+                    logger.info(f"Uploading album: {album_name}")
                     cmd = [
                         'immich-go',
                         'upload',
                         '--server', self.immich_server,
                         '--api-key', self.api_key,
-                        '--album', album_dir.name,
-                        str(album_dir)
+                        '--album', album_name,
                     ]
-                    result = subprocess.run(cmd, check=True, capture_output=True, text=True)
-                    logger.info(f"Successfully uploaded {album_dir.name}")
-                except subprocess.CalledProcessError as e:
-                    logger.error(f"Failed to upload {album_dir.name}: {e.stderr}")
-                    self.stats['errors'] += 1
+                    # A mostly missing album is passed whole; Immich reports the few it has as duplicates
+                    if len(missing) * 2 > len(files):
+                        chunks = [[str(album_dir)]]
+                    else:
+                        chunks = chunk_paths(missing, IMMICH_GO_ARGS_BYTES)
+                    album_bytes = sum(path.stat().st_size for path in missing)
+                    with self.timings.measure('upload', album_name, album_bytes):
+                        for chunk in chunks:
+                            subprocess.run(cmd + chunk, check=True, capture_output=True, text=True)
+                    logger.info(f"Successfully uploaded {album_name}")
+                else:
+                    logger.info(f"Immich already has every file of album {album_name}")
+                if self.manifest is not None:
+                    self.manifest.mark_album_uploaded(album_name)
+                if self._import_index is not None:
+                    self._import_index.mark_album_uploaded(album_name)
+            except subprocess.CalledProcessError as e:
+                logger.error(f"Failed to upload {album_name}: {e.stderr}")
+                self.record_error('upload', f"{album_name}: {e.stderr}")
+            except (OSError, immich_upload.ImmichError, ValueError, KeyError) as e:
+                logger.error(f"Failed to add existing files to album {album_name}: {e}")
+                self.record_error('upload', f"{album_name}: {e}")
+    
+    def upload_checksums(self, albums: Dict[str, List[Path]]) -> Dict[Path, str]:
+        """Return the SHA-1 of files about to be uploaded, cached by inode, size and mtime; empty with the check off."""
+        if not self.upload_check:
+            return {}
+        files = list(dict.fromkeys(path for paths in albums.values() for path in paths))
+        with self.timings.measure('checksum'):
+            checksums, hashed = self.integrity.checksums(files, self.hash_workers)
+        logger.info(f"Checking {len(files)} files against Immich before upload "
+                    f"({hashed} hashed, {len(files) - hashed} from the checksum cache)")
+        return checksums
+    
+    def check_existing(self, albums: Dict[str, List[Path]]) -> Dict[Path, str]:
+        """Return the asset ids of files Immich already has, by one bulk upload check of their checksums."""
+        checksums = self.upload_checksums(albums)
+        if not checksums:
+            return {}
+        report = immich_upload.check_existing(self.immich_server, self.api_key, checksums)
+        self.timings.record('upload_check', report.seconds)
+        self.log_upload_check(report)
+        return report.asset_ids
+    
+    def log_upload_check(self, report: immich_upload.UploadReport) -> None:
+        """Log and count the uploads the bulk upload check avoided."""
+        if report.check_error:
+            logger.warning(f"Bulk upload check failed, uploading every file: {report.check_error}")
+        if report.skipped:
+            logger.info(f"Skipped {report.skipped} uploads ({report.bytes_skipped / (1024 * 1024):.1f} MB) "
+                        f"of files Immich already has")
+        self.uploads_avoided += report.skipped
+    
+    def upload_native(self, processed_dir: Path) -> None:
+        """Upload every pending album over pooled connections, then assign albums in bulk."""
+        # A delta run only uploads what the index says no earlier run uploaded
+        pending = self._import_index.pending() if self._import_index is not None else None
+        albums = {}
+        for album_dir in sorted(processed_dir.iterdir()):
+            if not album_dir.is_dir():
+                continue
+            if self.manifest is not None and self.manifest.album_uploaded(album_dir.name):
+                logger.info(f"Skipping album {album_dir.name}, already uploaded")
+                continue
+            files = sorted(path for path in album_dir.iterdir() if path.is_file()
+                           and (pending is None or f"{album_dir.name}/{path.name}" in pending))
+            if files:
+                albums[album_dir.name] = files
+        
+        if not albums:
+            return
+        
+        report = immich_upload.upload_albums(self.immich_server, self.api_key, albums, self.upload_concurrency,
+                                             self.upload_checksums(albums))
+        self.log_upload_report(report)
+        self.record_asset_ids(report)
+        
+        if self.manifest is not None:
+            for album in report.completed_albums:
+                self.manifest.mark_album_uploaded(album)
+    
+    def log_upload_report(self, report: immich_upload.UploadReport) -> None:
+        """Log upload throughput, time it as one upload sample and record failed uploads as errors."""
+        self.timings.record('upload', report.seconds, report.bytes_sent)
+        mb_sent = report.bytes_sent / (1024 * 1024)
+        logger.info(f"Uploaded {report.uploaded} assets ({report.duplicates} already in Immich), "
+                    f"{mb_sent:.1f} MB in {report.seconds:.1f}s "
+                    f"({mb_sent / max(report.seconds, 1e-9):.1f} MB/s) over {report.connections} connections")
+        
+        self.log_upload_check(report)
+        
+        for path, error in report.failed:
+            logger.error(f"Failed to upload {path.name}: {error}")
+            self.record_error('upload', f"{path}: {error}")
+    
+    def start_pipeline(self) -> None:
+        """Start uploading finished files in the background while processing continues."""
+        if not self.immich_server or not self.api_key:
+            logger.warning("Immich server or API key not provided. Running without the upload pipeline.")
+            return
+        
+        logger.info(f"Uploading in the background (queue depth {self.pipeline_depth}, "
+                    f"{self.upload_concurrency} connections)")
+        self._uploads = immich_upload.BackgroundUploader(
+            self.immich_server, self.api_key, self.upload_concurrency,
+            self.pipeline_depth, self.delete_after_upload).start()
+    
+    def finish_pipeline(self) -> None:
+        """Drain the background uploader, then checkpoint what it uploaded."""
+        uploads, self._uploads = self._uploads, None
+        logger.info("Waiting for background uploads to finish...")
+        report = uploads.close()
+        self.log_upload_report(report)
+        self.record_asset_ids(report)
+        uploaded = uploads.take_uploaded()
+        
+        if self.delete_after_upload and self.integrity is not None:
+            # Gone from processed/ on purpose, so --verify tree does not report them missing
+            processed_dir = self.output_dir / "processed"
+            self.integrity.mark_deleted(job.output.relative_to(processed_dir).as_posix() for job in uploaded)
+        
+        if self.manifest is None:
+            return
+        
+        # Members stay embedded until their album was assigned, so a resumed run uploads them again
+        completed = set(report.completed_albums)
+        self.manifest.mark_uploaded(job.key for job in uploaded if job.key is not None and job.album in completed)
+        
+        # Files finished by an earlier, interrupted run were never queued
+        processed_dir = self.output_dir / "processed"
+        if self.resume and processed_dir.exists():
+            self.upload_native(processed_dir)
+    
+    def process_media(self) -> None:
+        """Process every album, inline or on the worker pool."""
+        if self.dedup != 'off':
+            self._duplicates = DuplicateIndex()
+        
+        # Partial files of an interrupted run
+        staging_dir = self.output_dir / "staging"
+        shutil.rmtree(staging_dir, ignore_errors=True)
+        
+        self.start_workers()
+        try:
+            plan = self.plan_work()
+            if self.stream:
+                # Read media straight from the archives
+                self.process_archives_streaming(plan)
+            elif self.scratch_budget:
+                # Extract a batch of members at a time and delete it once processed
+                self.process_archives_budgeted(plan)
+            else:
+                # Extract archives
+                self.extract_archives()
+                
+                # Process each album of the plan from the extracted tree
+                self.process_albums(list(plan.albums.values()), self.extracted_source)
+            
+            self.stop_workers()
+            
+            # Every first copy is finished now, so duplicates can be linked to it
+            if self._duplicates is not None:
+                self.link_duplicates()
+        finally:
+            for lane in self._lanes.values():
+                lane.shutdown(cancel_futures=True)
+            self._lanes = {}
+            shutil.rmtree(staging_dir, ignore_errors=True)
+            self._duplicates = None
+            self.close_archives()
+            self.close_exiftool()
     
     def process_all(self) -> None:
         """Process all takeout data."""
         logger.info("Starting Google Photos takeout processing...")
         
-        # Extract archives
-        self.extract_archives()
+        self.manifest = JobManifest(self.manifest_path, resume=self.resume)
+        self.integrity = integrity.IntegrityManifest(self.integrity_path, reset=not self.resume)
+        if self.resume:
+            logger.info(f"Resuming from manifest {self.manifest_path}")
         
-        # Process each album directory
-        for album_dir in self.photos_dir.iterdir():
-            if album_dir.is_dir() and not album_dir.name.startswith('.'):
-                self.process_album(album_dir)
+        started = time.time()
+        profiler = Profiler(self.profile)
+        profiler.start()
+        try:
+            if self.pipeline:
+                self.start_pipeline()
+            
+            self.process_media()
+            
+            if self.near_duplicate_policy:
+                self.find_near_duplicates()
+            
+            # Upload to Immich if configured
+            if self._uploads is not None:
+                self.finish_pipeline()
+            else:
+                self.upload_to_immich()
+            
+            if self._metadata_updates:
+                self.update_metadata()
+            
+            # Print statistics
+            self.print_stats()
+        finally:
+            if self._uploads is not None:
+                self._uploads.close()
+                self._uploads = None
+            profile = profiler.stop(self.report_path.with_suffix('.prof') if self.report_path else None)
+            if self.report_path is not None:
+                self.write_report(started, profile)
+            self.manifest.close()
+            self.manifest = None
+            self.integrity.close()
+            self.integrity = None
+            self.close_import_index()
+    
+    def find_near_duplicates(self) -> near_duplicates.NearDuplicateReport:
+        """Group processed images that look alike, write the report and set aside what the policy drops."""
+        processed_dir = self.output_dir / "processed"
+        # Outputs with the same bytes are one image, the same photo in several albums
+        by_digest: Dict[str, List[str]] = {}
+        for path, _, digest in self.integrity.entries():
+            if Path(path).suffix.lower() in self.image_extensions and (processed_dir / path).exists():
+                by_digest.setdefault(digest, []).append(path)
+        
+        policy = self.near_duplicate_policy
+        if policy != near_duplicates.POLICY_REPORT and self._uploads is not None:
+            logger.warning(f"With --pipeline, files are uploaded as they are processed; "
+                           f"not applying {policy}, only reporting near duplicates")
+            policy = near_duplicates.POLICY_REPORT
+        
+        logger.info(f"Looking for near-duplicate images among {len(by_digest)} with {self.hash_workers} workers...")
+        report = near_duplicates.find_near_duplicates([(paths[0], paths[1:]) for paths in by_digest.values()],
+                                                      processed_dir, self.hash_workers,
+                                                      self.near_duplicate_distance, policy)
         
-        # Upload to Immich if configured
-        self.upload_to_immich()
+        removed = report.removed()
+        set_aside = self.output_dir / "near-duplicates"
+        for path in removed:
+            target = set_aside / path
+            target.parent.mkdir(parents=True, exist_ok=True)
+            os.replace(processed_dir / path, target)
+        self.integrity.remove(removed)
         
-        # Print statistics
-        self.print_stats()
+        try:
+            with open(self.near_duplicates_path, 'w') as f:
+                json.dump(report.to_dict(), f, indent=2)
+        except OSError as e:
+            logger.error(f"Failed to write near-duplicate report {self.near_duplicates_path}: {e}")
+        
+        logger.info(f"Found {len(report.groups)} groups of near-duplicate images in "
+                    f"{report.hash_seconds:.1f}s hashing and {report.match_seconds:.1f}s matching; "
+                    f"report written to {self.near_duplicates_path}")
+        if report.undecodable:
+            logger.warning(f"{len(report.undecodable)} images could not be decoded for near-duplicate "
+                           f"detection, e.g. {report.undecodable[0]}")
+        if removed:
+            logger.info(f"Set aside {len(removed)} files under {set_aside} ({policy})")
+        return report
+    
+    def verify(self, target: str = integrity.VERIFY_TREE) -> bool:
+        """Check the processed tree or the uploaded assets against the integrity manifest; True if all match."""
+        if not self.integrity_path.exists():
+            logger.error(f"No integrity manifest at {self.integrity_path}; nothing to verify")
+            return False
+        if target == integrity.VERIFY_ASSETS and (not self.immich_server or not self.api_key):
+            logger.error("Immich server and API key are needed to verify uploaded assets")
+            return False
+        
+        manifest = integrity.IntegrityManifest(self.integrity_path)
+        try:
+            if target == integrity.VERIFY_ASSETS:
+                logger.info(f"Verifying uploaded assets against {self.integrity_path}...")
+                report = integrity.verify_assets(manifest, lambda asset_ids: immich_upload.fetch_checksums(
+                    self.immich_server, self.api_key, asset_ids, self.upload_concurrency))
+            else:
+                processed_dir = self.output_dir / "processed"
+                logger.info(f"Verifying {processed_dir} against {self.integrity_path} "
+                            f"with {self.hash_workers} threads...")
+                report = integrity.verify_tree(manifest, processed_dir, self.hash_workers)
+        finally:
+            manifest.close()
+        
+        for path, problem in report.problems:
+            logger.error(f"Verification failed for {path}: {problem}")
+        summary = ', '.join(f"{count} {problem}" for problem, count in report.counts().items())
+        logger.info(f"Verified {report.ok} of {report.checked} files in {report.seconds:.1f}s"
+                    + (f", {report.bytes_hashed / (1024 * 1024):.1f} MB hashed" if report.bytes_hashed else "")
+                    + (f" ({summary})" if summary else ""))
+        if report.deleted:
+            logger.info(f"{report.deleted} files were deleted once uploaded; check them with --verify assets")
+        if report.untracked:
+            what = "never uploaded" if target == integrity.VERIFY_ASSETS else "not in the manifest"
+            logger.warning(f"{len(report.untracked)} files {what}, e.g. {report.untracked[0]}")
+        return not report.problems
+    
+    def write_report(self, started: float, profile: Optional[Dict]) -> None:
+        """Write the per-stage timings and run statistics to the JSON run report."""
+        options = {'stream': self.stream, 'workers': self.workers, 'worker_type': self.worker_type,
+                   'resume': self.resume, 'dedup': self.dedup, 'uploader': self.uploader,
+                   'pipeline': self.pipeline, 'scratch_budget': self.scratch_budget,
+                   'extract_workers': self.extract_workers, 'metadata_backends': self.metadata_backends,
+                   'profile': self.profile,
+                   'delta_index': str(self.delta_index) if self.delta_index else None,
+                   'large_video_size': self.large_video_size, 'io_workers': self.io_workers,
+                   'lanes': self.lane_report, 'upload_check': self.upload_check,
+                   'uploads_avoided': self.uploads_avoided,
+                   'near_duplicate_policy': self.near_duplicate_policy,
+                   'near_duplicate_distance': self.near_duplicate_distance}
+        if self.delta_index is not None:
+            options['delta'] = self.delta_counts
+        try:
+            write_report(self.report_path, started, options, self.manifest.stats(), self.timings, profile)
+            logger.info(f"Run report written to {self.report_path}")
+        except Exception as e:
+            logger.error(f"Failed to write run report {self.report_path}: {e}")
     
     def print_stats(self) -> None:
-        """Print processing statistics."""
+        """Print processing statistics, from the manifest when one is open."""
+        stats = self.manifest.stats() if self.manifest is not None else self.stats
         logger.info("Processing complete!")
         logger.info(f"Statistics:")
-        logger.info(f"  Total files processed: {self.stats['total_files']}")
-        logger.info(f"  Images processed: {self.stats['processed_images']}")
-        logger.info(f"  Videos processed: {self.stats['processed_videos']}")
-        logger.info(f"  Albums created: {self.stats['albums_created']}")
-        logger.info(f"  Files skipped: {self.stats['skipped_files']}")
-        logger.info(f"  Errors: {self.stats['errors']}")
+        logger.info(f"  Total files processed: {stats['total_files']}")
+        logger.info(f"  Images processed: {stats['processed_images']}")
+        logger.info(f"  Videos processed: {stats['processed_videos']}")
+        logger.info(f"  Albums created: {stats['albums_created']}")
+        logger.info(f"  Files skipped: {stats['skipped_files']}")
+        placed = {name[len('place_'):]: stage.count for name, stage in self.timings.stages.items()
+                  if name.startswith('place_')}
+        if placed:
+            logger.info("  Files placed: " + ', '.join(f"{placed[tier]} by {tier}"
+                                                       for tier in placement.PLACEMENT_TIERS if tier in placed))
+        if stats['duplicates']:
+            logger.info(f"  Duplicates linked: {stats['duplicates']} "
+                        f"({stats['bytes_saved'] / (1024 * 1024):.1f} MB saved)")
+        logger.info(f"  Errors: {stats['errors']}")
 
 def main():
     parser = argparse.ArgumentParser(description='Enhanced Google Photos Takeout Import for Immich')
@@ -392,6 +1922,74 @@ def main():
                       help='Immich API key')
     parser.add_argument('--skip-upload', action='store_true',
                       help='Skip upload to Immich (only process files)')
+    parser.add_argument('--uploader', choices=['immich-go', 'native'], default='immich-go',
+                      help='Upload with immich-go, or natively over pooled connections to the Immich API')
+    parser.add_argument('--pipeline', action='store_true',
+                      help='Upload files natively while later files are still being processed (implies --stream)')
+    parser.add_argument('--pipeline-depth', type=int, default=64,
+                      help='Processed files allowed to wait for upload before processing pauses')
+    parser.add_argument('--delete-after-upload', action='store_true',
+                      help='With --pipeline, delete each processed file once Immich has it')
+    parser.add_argument('--no-upload-check', action='store_true',
+                      help='Upload every file without first asking Immich which checksums it already has')
+    parser.add_argument('--upload-concurrency', type=int, default=immich_upload.DEFAULT_CONCURRENCY,
+                      help='Concurrent uploads (and connections) for the native uploader')
+    parser.add_argument('--stream', action='store_true',
+                      help='Read media straight from the zip archives instead of extracting them first')
+    parser.add_argument('--workers', '-j', type=int, default=1,
+                      help='Number of parallel workers for per-file processing (default: 1, serial)')
+    parser.add_argument('--worker-type', choices=['process', 'thread'], default='process',
+                      help='Use a process pool (CPU-bound EXIF work) or a thread pool (I/O-bound video work)')
+    parser.add_argument('--resume', action='store_true',
+                      help='Resume an interrupted run from its manifest, retrying only failed files')
+    parser.add_argument('--dedup', choices=['off'] + list(placement.LINK_MODES), default='off',
+                      help='Link photos repeated across albums to the first processed copy instead of reprocessing them')
+    parser.add_argument('--extract-workers', type=int,
+                      help=f'Threads inflating archive members in parallel '
+                           f'(default: CPU count, at most {MAX_EXTRACT_WORKERS})')
+    parser.add_argument('--scratch-budget', type=parse_size,
+                      help='Extract and process a few archives at a time within this much scratch space '
+                           '(e.g. 50G), deleting each batch once processed')
+    parser.add_argument('--metadata-backend', type=parse_backend, action='append', default=[],
+                      metavar='EXT=BACKEND',
+                      help='Write image metadata for EXT with piexif or exiftool, e.g. .png=exiftool '
+                           '(default: exiftool for HEIC, PNG and TIFF when installed); repeatable')
+    parser.add_argument('--plan', nargs='?', const=DEFAULT_PLAN_PATH, metavar='PATH',
+                      help=f'Only read the zip central directories and sidecars, then log and save the work plan '
+                           f'(default path: {DEFAULT_PLAN_PATH}); nothing is extracted or uploaded')
+    parser.add_argument('--large-video-size', type=parse_size, default=DEFAULT_LARGE_VIDEO_SIZE, metavar='SIZE',
+                      help='With --workers, videos at least this large run first on the I/O lane (default: 256M)')
+    parser.add_argument('--io-workers', type=int, default=DEFAULT_IO_WORKERS,
+                      help=f'Threads on the I/O lane for large videos; 0 puts them on the regular workers '
+                           f'(default: {DEFAULT_IO_WORKERS})')
+    parser.add_argument('--verify', nargs='?', const=integrity.VERIFY_TREE, choices=integrity.VERIFY_TARGETS,
+                      help='Only check the processed tree (default) or the uploaded assets against the integrity '
+                           'manifest written while processing; exits with status 1 if anything differs')
+    parser.add_argument('--near-duplicates', nargs='?', const=near_duplicates.POLICY_REPORT,
+                      choices=near_duplicates.POLICIES,
+                      help='Find images that look alike (-edited copies, re-saves) and write a report; '
+                           'keep-original or keep-edit also sets aside an edit or the original it is named after')
+    parser.add_argument('--near-duplicate-distance', type=int, default=near_duplicates.DEFAULT_MAX_DISTANCE,
+                      metavar='BITS',
+                      help=f'Most differing bits of the {near_duplicates.HASH_BITS}-bit image hashes for a near '
+                           f'duplicate (default: {near_duplicates.DEFAULT_MAX_DISTANCE})')
+    parser.add_argument('--watch', action='store_true',
+                      help='Keep running and import each takeout-*.zip part as soon as it has finished downloading')
+    parser.add_argument('--watch-settle', type=float, default=DEFAULT_SETTLE_SECONDS, metavar='SECONDS',
+                      help=f'With --watch, seconds a part must stop growing before it is checked and imported '
+                           f'(default: {DEFAULT_SETTLE_SECONDS:.0f})')
+    parser.add_argument('--watch-idle', type=float, default=DEFAULT_IDLE_SECONDS, metavar='SECONDS',
+                      help=f'With --watch, seconds without a part changing before media still missing a sidecar '
+                           f'are imported without one (default: {DEFAULT_IDLE_SECONDS:.0f})')
+    parser.add_argument('--delta', metavar='INDEX_PATH',
+                      help='Index of earlier runs (created if missing); only new or changed files are processed, '
+                           'and files with only changed metadata get a metadata update in Immich')
+    parser.add_argument('--log', default=DEFAULT_LOG_PATH,
+                      help=f'JSON lines log file (default: {DEFAULT_LOG_PATH})')
+    parser.add_argument('--report', default=DEFAULT_REPORT_PATH,
+                      help=f'JSON run report with per-stage timings (default: {DEFAULT_REPORT_PATH})')
+    parser.add_argument('--profile', choices=PROFILE_MODES,
+                      help='Profile the run with cProfile or tracemalloc and add the top entries to the report')
     
     args = parser.parse_args()
     
@@ -400,15 +1998,54 @@ def main():
         args.immich_server = None
         args.api_key = None
     
+    # Log records are written by a background thread; nothing is logged to disk at import time
+    run_logging.setup_logging(Path(args.log))
+    try:
+        run(args)
+    finally:
+        run_logging.stop_logging()
+
+
+def run(args: argparse.Namespace) -> None:
+    """Build the processor from parsed arguments and run it, watch for parts, or only write its plan or verify."""
     processor = TakeoutProcessor(
         takeout_dir=args.takeout_dir,
         output_dir=args.output_dir,
         immich_server=args.immich_server,
-        api_key=args.api_key
+        api_key=args.api_key,
+        stream=args.stream,
+        workers=args.workers,
+        worker_type=args.worker_type,
+        resume=args.resume,
+        dedup=args.dedup,
+        uploader=args.uploader,
+        upload_concurrency=args.upload_concurrency,
+        pipeline=args.pipeline,
+        pipeline_depth=args.pipeline_depth,
+        delete_after_upload=args.delete_after_upload,
+        profile=args.profile,
+        report_path=args.report,
+        scratch_budget=args.scratch_budget,
+        extract_workers=args.extract_workers,
+        metadata_backends=dict(args.metadata_backend),
+        delta_index=args.delta,
+        large_video_size=args.large_video_size,
+        io_workers=args.io_workers,
+        upload_check=not args.no_upload_check,
+        near_duplicate_policy=args.near_duplicates,
+        near_duplicate_distance=args.near_duplicate_distance
     )
     
     try:
-        processor.process_all()
+        if args.plan:
+            processor.write_plan(args.plan)
+        elif args.verify:
+            if not processor.verify(args.verify):
+                sys.exit(1)
+        elif args.watch:
+            PartWatcher(processor, args.watch_settle, args.watch_idle).run()
+        else:
+            processor.process_all()
     except KeyboardInterrupt:
         logger.info("Processing interrupted by user")
         sys.exit(1)
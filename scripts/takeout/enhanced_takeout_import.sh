@@ -15,6 +15,26 @@ IMMICH_API_KEY="${IMMICH_API_KEY:-}"
 SKIP_UPLOAD=false
 SKIP_DEPS=false
 SKIP_SYSTEM_DEPS=false
+STREAM=false
+WORKERS=1
+RESUME=false
+DEDUP=off
+UPLOADER=immich-go
+UPLOAD_CONCURRENCY=4
+UPLOAD_CHECK=true
+PIPELINE=false
+DELETE_AFTER_UPLOAD=false
+PROFILE=""
+SCRATCH_BUDGET=""
+EXTRACT_WORKERS=""
+METADATA_BACKENDS=()
+PLAN=false
+VERIFY=""
+DELTA_INDEX=""
+LARGE_VIDEO_SIZE=""
+IO_WORKERS=""
+WATCH=false
+NEAR_DUPLICATES=""
 
 # Colors for output
 RED='\033[0;31m'
@@ -35,6 +55,28 @@ OPTIONS:
     -s, --immich-server URL    Immich server URL (e.g., http://localhost:2283)
     -k, --api-key KEY          Immich API key
     --skip-upload             Skip upload to Immich (only process files)
+    --stream                  Read media straight from the zips (no extraction, ~1x takeout size needed)
+    --extract-workers N       Threads inflating zip members in parallel (default: CPU count, at most 8)
+    --metadata-backend EXT=NAME
+                              Write image metadata for EXT with piexif or exiftool (repeatable)
+    --scratch-budget SIZE     Extract a batch of archives at a time within SIZE scratch space (e.g. 50G)
+    -j, --workers N           Process files with N parallel workers (default: 1)
+    --large-video-size SIZE   With -j, videos at least SIZE run first on the I/O lane (default: 256M)
+    --io-workers N            Threads on the I/O lane for large videos, 0 to disable (default: 1)
+    --resume                  Resume an interrupted run from its job manifest
+    --dedup MODE              Link photos repeated across albums: off, hardlink or reflink (default: off)
+    --uploader NAME           Upload with immich-go or the built-in native uploader (default: immich-go)
+    --upload-concurrency N    Parallel uploads for the native uploader (default: 4)
+    --no-upload-check         Upload every file without first asking Immich which ones it already has
+    --pipeline                Upload each file as soon as it is processed (native uploader)
+    --delete-after-upload     With --pipeline, delete processed files once uploaded
+    --delta INDEX             Only import files new or changed since the runs recorded in INDEX
+    --plan                    Only print and save the work plan (counts, duplicates, space, runtime estimate)
+    --verify [tree|assets]    Only check processed files or uploaded assets against the integrity manifest
+    --near-duplicates [POLICY]
+                              Report look-alike images; keep-original or keep-edit sets aside edits or originals
+    --watch                   Keep running and import each takeout-*.zip part once it has finished downloading
+    --profile MODE            Profile the run with cprofile or tracemalloc (added to the run report)
     --skip-deps               Skip Python dependency installation
     --skip-system-deps        Skip system dependency installation (ffmpeg, immich-go)
     -h, --help                Show this help message
@@ -193,7 +235,7 @@ check_prerequisites() {
             pip install --quiet piexif pillow ffmpeg-python pillow-heif
         fi
         
-        # Install exiftool if available (optional, for advanced HEIC processing)
+        # Install exiftool if available (optional, writes HEIC, PNG and TIFF metadata)
         if command -v brew >/dev/null 2>&1; then
             log "Installing exiftool for advanced metadata handling..."
             if ! brew list exiftool >/dev/null 2>&1; then
@@ -239,16 +281,18 @@ validate_inputs() {
         return 1
     fi
     
-    # Check for zip files
-    if ! ls "$TAKEOUT_DIR"/*.zip &> /dev/null; then
+    # Check for zip files; in watch mode they may not have started downloading yet
+    if [[ "$WATCH" == true ]]; then
+        log "Watching $TAKEOUT_DIR for takeout parts as they finish downloading"
+    elif ! ls "$TAKEOUT_DIR"/*.zip &> /dev/null; then
         error "No zip files found in takeout directory: $TAKEOUT_DIR"
         return 1
+    else
+        local zip_count
+        zip_count=$(ls -1 "$TAKEOUT_DIR"/*.zip | wc -l | tr -d ' ')
+        log "Found $zip_count zip files to process"
     fi
     
-    local zip_count
-    zip_count=$(ls -1 "$TAKEOUT_DIR"/*.zip | wc -l | tr -d ' ')
-    log "Found $zip_count zip files to process"
-    
     # Validate Immich settings if upload is requested
     if [[ "$SKIP_UPLOAD" != true ]]; then
         if [[ -z "$IMMICH_SERVER" ]] || [[ -z "$IMMICH_API_KEY" ]]; then
@@ -277,7 +321,11 @@ estimate_space() {
     available_space=$(df -h "$OUTPUT_DIR" | awk 'NR==2 {print $4}')
     log "Available space: $available_space"
     
-    warning "Estimated space needed: ~2-3x takeout size (for extraction and processing)"
+    if [[ "$STREAM" == true ]]; then
+        warning "Estimated space needed: ~1x takeout size (streaming, no extraction)"
+    else
+        warning "Estimated space needed: ~2-3x takeout size (for extraction and processing)"
+    fi
 }
 
 run_processor() {
@@ -291,10 +339,81 @@ run_processor() {
     if [[ "$SKIP_UPLOAD" != true ]]; then
         cmd_args+=("--immich-server" "$IMMICH_SERVER")
         cmd_args+=("--api-key" "$IMMICH_API_KEY")
+        cmd_args+=("--uploader" "$UPLOADER")
+        cmd_args+=("--upload-concurrency" "$UPLOAD_CONCURRENCY")
+        if [[ "$PIPELINE" == true ]]; then
+            cmd_args+=("--pipeline")
+        fi
+        if [[ "$DELETE_AFTER_UPLOAD" == true ]]; then
+            cmd_args+=("--delete-after-upload")
+        fi
+        if [[ "$UPLOAD_CHECK" != true ]]; then
+            cmd_args+=("--no-upload-check")
+        fi
     else
         cmd_args+=("--skip-upload")
     fi
     
+    if [[ "$STREAM" == true ]]; then
+        cmd_args+=("--stream")
+    fi
+    
+    if [[ -n "$EXTRACT_WORKERS" ]]; then
+        cmd_args+=("--extract-workers" "$EXTRACT_WORKERS")
+    fi
+    
+    for backend in "${METADATA_BACKENDS[@]}"; do
+        cmd_args+=("--metadata-backend" "$backend")
+    done
+    
+    if [[ -n "$SCRATCH_BUDGET" ]]; then
+        cmd_args+=("--scratch-budget" "$SCRATCH_BUDGET")
+    fi
+    
+    if [[ "$WORKERS" -gt 1 ]]; then
+        cmd_args+=("--workers" "$WORKERS")
+    fi
+    
+    if [[ -n "$LARGE_VIDEO_SIZE" ]]; then
+        cmd_args+=("--large-video-size" "$LARGE_VIDEO_SIZE")
+    fi
+    
+    if [[ -n "$IO_WORKERS" ]]; then
+        cmd_args+=("--io-workers" "$IO_WORKERS")
+    fi
+    
+    if [[ "$RESUME" == true ]]; then
+        cmd_args+=("--resume")
+    fi
+    
+    if [[ "$DEDUP" != off ]]; then
+        cmd_args+=("--dedup" "$DEDUP")
+    fi
+    
+    if [[ -n "$DELTA_INDEX" ]]; then
+        cmd_args+=("--delta" "$DELTA_INDEX")
+    fi
+    
+    if [[ "$PLAN" == true ]]; then
+        cmd_args+=("--plan")
+    fi
+    
+    if [[ -n "$VERIFY" ]]; then
+        cmd_args+=("--verify" "$VERIFY")
+    fi
+    
+    if [[ -n "$PROFILE" ]]; then
+        cmd_args+=("--profile" "$PROFILE")
+    fi
+    
+    if [[ -n "$NEAR_DUPLICATES" ]]; then
+        cmd_args+=("--near-duplicates" "$NEAR_DUPLICATES")
+    fi
+    
+    if [[ "$WATCH" == true ]]; then
+        cmd_args+=("--watch")
+    fi
+    
     # Run the Python processor
     python3 "$SCRIPT_DIR/enhanced_takeout_import.py" "${cmd_args[@]}"
     
@@ -358,6 +477,96 @@ main() {
                 SKIP_UPLOAD=true
                 shift
                 ;;
+            --stream)
+                STREAM=true
+                shift
+                ;;
+            --extract-workers)
+                EXTRACT_WORKERS="$2"
+                shift 2
+                ;;
+            --metadata-backend)
+                METADATA_BACKENDS+=("$2")
+                shift 2
+                ;;
+            --scratch-budget)
+                SCRATCH_BUDGET="$2"
+                shift 2
+                ;;
+            -j|--workers)
+                WORKERS="$2"
+                shift 2
+                ;;
+            --large-video-size)
+                LARGE_VIDEO_SIZE="$2"
+                shift 2
+                ;;
+            --io-workers)
+                IO_WORKERS="$2"
+                shift 2
+                ;;
+            --resume)
+                RESUME=true
+                shift
+                ;;
+            --dedup)
+                DEDUP="$2"
+                shift 2
+                ;;
+            --uploader)
+                UPLOADER="$2"
+                shift 2
+                ;;
+            --upload-concurrency)
+                UPLOAD_CONCURRENCY="$2"
+                shift 2
+                ;;
+            --no-upload-check)
+                UPLOAD_CHECK=false
+                shift
+                ;;
+            --pipeline)
+                PIPELINE=true
+                shift
+                ;;
+            --delete-after-upload)
+                DELETE_AFTER_UPLOAD=true
+                shift
+                ;;
+            --delta)
+                DELTA_INDEX="$2"
+                shift 2
+                ;;
+            --plan)
+                PLAN=true
+                shift
+                ;;
+            --verify)
+                if [[ "${2:-}" == tree || "${2:-}" == assets ]]; then
+                    VERIFY="$2"
+                    shift 2
+                else
+                    VERIFY=tree
+                    shift
+                fi
+                ;;
+            --profile)
+                PROFILE="$2"
+                shift 2
+                ;;
+            --near-duplicates)
+                if [[ "${2:-}" == report || "${2:-}" == keep-original || "${2:-}" == keep-edit ]]; then
+                    NEAR_DUPLICATES="$2"
+                    shift 2
+                else
+                    NEAR_DUPLICATES=report
+                    shift
+                fi
+                ;;
+            --watch)
+                WATCH=true
+                shift
+                ;;
             --skip-deps)
                 SKIP_DEPS=true
                 shift
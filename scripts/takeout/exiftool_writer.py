@@ -0,0 +1,153 @@
+"""
+Persistent exiftool backend for image formats piexif cannot write.
+
+piexif only handles JPEG and WebP, so HEIC, PNG and TIFF need exiftool.
+Starting exiftool costs far more than writing one file's tags, so ExifTool
+keeps a single `exiftool -stay_open True -@ -` process and sends it one
+argfile batch per write: the arguments one per line, then `-execute<n>`.
+exiftool answers with `{ready<n>}` on stdout, and `-echo4` puts the same
+marker on stderr, so both streams can be read up to the end of the reply
+without blocking. Each processor copy (and so each pool worker) owns its
+own process.
+"""
+
+import html
+import os
+import shutil
+import subprocess
+import threading
+import weakref
+from pathlib import Path
+from typing import List, Optional
+
+EXIFTOOL = 'exiftool'
+
+# Options sent with every write: keep going on minor errors, keep the file's
+# modification time, and unescape HTML entities so values can hold newlines
+COMMON_ARGS = ('-m', '-P', '-E', '-charset', 'utf8')
+
+
+class ExifToolError(Exception):
+    """exiftool could not write a file."""
+
+
+def available(executable: str = EXIFTOOL) -> bool:
+    """Return True if exiftool is installed."""
+    return shutil.which(executable) is not None
+
+
+def escape(value: str) -> str:
+    """Escape a tag value for the argfile, where every line is one argument."""
+    return html.escape(value, quote=False).replace('\r', '&#xd;').replace('\n', '&#xa;')
+
+
+def _stop(process: subprocess.Popen) -> None:
+    """Ask a stay-open exiftool to exit, killing it if it does not."""
+    if process.poll() is not None:
+        return
+    try:
+        process.stdin.write(b'-stay_open\nFalse\n')
+        process.stdin.flush()
+        process.stdin.close()
+        process.wait(timeout=5)
+    except (OSError, ValueError, subprocess.TimeoutExpired):
+        process.kill()
+        process.wait()
+
+
+def _discard(process: subprocess.Popen) -> None:
+    """Close a dead or unresponsive exiftool and reap it, without waiting on its protocol."""
+    for stream in (process.stdin, process.stdout, process.stderr):
+        try:
+            stream.close()
+        except OSError:
+            pass
+    if process.poll() is None:
+        process.terminate()
+        try:
+            process.wait(timeout=5)
+        except subprocess.TimeoutExpired:
+            process.kill()
+            process.wait()
+
+
+class ExifTool:
+    """One long-lived exiftool process fed through the -stay_open argfile protocol."""
+
+    def __init__(self, executable: str = EXIFTOOL):
+        self.executable = executable
+        self.process: Optional[subprocess.Popen] = None
+        self.commands = 0
+        self._lock = threading.Lock()
+        self._finalizer = None
+
+    def start(self) -> 'ExifTool':
+        self.process = subprocess.Popen(
+            [self.executable, '-stay_open', 'True', '-@', '-'],
+            stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+        # Processor copies are dropped without notice when pool workers exit
+        self._finalizer = weakref.finalize(self, _stop, self.process)
+        return self
+
+    def close(self) -> None:
+        if self._finalizer is not None:
+            self._finalizer()
+            self._finalizer = None
+        self.process = None
+
+    def _usable(self) -> bool:
+        process = self.process
+        return (process is not None and process.poll() is None
+                and not process.stdout.closed and not process.stderr.closed)
+
+    def _restart(self) -> None:
+        # The old process may be alive but unresponsive, so close it rather than ask it to exit
+        if self._finalizer is not None:
+            self._finalizer.detach()
+            self._finalizer = None
+        if self.process is not None:
+            _discard(self.process)
+        self.start()
+
+    def execute(self, args: List[str]) -> str:
+        """Run one command and return its stdout; raise ExifToolError if exiftool reported an error."""
+        with self._lock:
+            if not self._usable():
+                self._restart()
+            self.commands += 1
+            marker = f'{{ready{self.commands}}}'
+            batch = list(args) + ['-echo4', marker, f'-execute{self.commands}']
+            if any('\n' in arg for arg in batch):
+                raise ValueError("exiftool arguments cannot contain newlines")
+            self.process.stdin.write(('\n'.join(batch) + '\n').encode())
+            self.process.stdin.flush()
+            output = self._read_until(self.process.stdout, marker)
+            errors = self._read_until(self.process.stderr, marker)
+
+        if 'Error' in errors:
+            raise ExifToolError(errors.strip())
+        return output
+
+    def _read_until(self, stream, marker: str) -> str:
+        lines = []
+        while True:
+            line = stream.readline()
+            if not line:
+                # Keep the handle so the next command closes and reaps this process before restarting
+                stream.close()
+                raise ExifToolError(f"exiftool exited unexpectedly: {''.join(lines).strip()}")
+            line = line.decode('utf-8', 'replace')
+            if line.rstrip('\r\n') == marker:
+                return ''.join(lines)
+            lines.append(line)
+
+    def write(self, source: Path, tags: List[str], output: Optional[Path] = None) -> None:
+        """Write tag arguments (like -EXIF:Make=...) into source, or into a new file at output."""
+        args = list(COMMON_ARGS) + tags
+        if output is None:
+            args += ['-overwrite_original', os.fspath(source)]
+        else:
+            # exiftool refuses to replace an existing output file
+            Path(output).unlink(missing_ok=True)
+            args += ['-o', os.fspath(output), os.fspath(source)]
+        self.execute(args)
@@ -0,0 +1,246 @@
+"""
+Small local stand-in for the Immich API, for tests and upload benchmarks.
+
+Implements just enough of the asset and album endpoints for the native
+uploader: POST /api/assets (multipart, duplicates detected by checksum),
+POST /api/assets/bulk-upload-check, GET/POST /api/albums, PUT /api/albums/<id>/assets, GET /api/assets/<id> with
+the asset's checksum, and PUT /api/assets/<id> for metadata updates.
+Connections are kept alive, and the number of connections and bytes received
+are counted so callers can check pooling and measure throughput.
+
+    python3 fake_immich.py --port 2283
+"""
+
+import argparse
+import base64
+import hashlib
+import json
+import threading
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, List, Optional
+
+
+class FakeImmichHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    disable_nagle_algorithm = True
+    server: 'FakeImmichServer'
+
+    def setup(self):
+        super().setup()
+        with self.server.lock:
+            self.server.connections += 1
+            # The first response on the next cut_connections connections stops halfway
+            self.cut = self.server.cut_connections > 0
+            if self.cut:
+                self.server.cut_connections -= 1
+
+    def log_message(self, format, *args):
+        pass
+
+    def send_json(self, status: int, payload) -> None:
+        body = json.dumps(payload).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        if self.cut:
+            # As if the server restarted mid-response: half the promised body, then the connection closes
+            self.wfile.write(body[:len(body) // 2])
+            self.close_connection = True
+            self.cut = False
+            return
+        self.wfile.write(body)
+
+    def read_body(self) -> bytes:
+        return self.rfile.read(int(self.headers.get('Content-Length', 0)))
+
+    def authorized(self) -> bool:
+        if self.headers.get('x-api-key') == self.server.api_key:
+            return True
+        self.read_body()
+        self.send_json(401, {'message': 'Invalid API key'})
+        return False
+
+    def do_GET(self):
+        if not self.authorized():
+            return
+        if self.path == '/api/albums':
+            with self.server.lock:
+                albums = [{'id': album_id, 'albumName': album['albumName']}
+                          for album_id, album in self.server.albums.items()]
+            self.send_json(200, albums)
+        elif self.path.startswith('/api/assets/'):
+            self.send_asset(self.path[len('/api/assets/'):])
+        else:
+            self.send_json(404, {'message': 'Not found'})
+
+    def do_POST(self):
+        if not self.authorized():
+            return
+        body = self.read_body()
+        if self.path == '/api/assets':
+            self.receive_asset(body)
+        elif self.path == '/api/assets/bulk-upload-check':
+            self.check_assets(json.loads(body)['assets'])
+        elif self.path == '/api/albums':
+            request = json.loads(body)
+            album_id = str(uuid.uuid4())
+            with self.server.lock:
+                self.server.albums[album_id] = {'albumName': request['albumName'],
+                                                'assets': list(request.get('assetIds', []))}
+            self.send_json(201, {'id': album_id, 'albumName': request['albumName']})
+        else:
+            self.send_json(404, {'message': 'Not found'})
+
+    def do_PUT(self):
+        if not self.authorized():
+            return
+        body = self.read_body()
+        parts = self.path.strip('/').split('/')
+        if len(parts) == 3 and parts[1] == 'assets':
+            self.update_asset(parts[2], json.loads(body))
+            return
+        with self.server.lock:
+            album = self.server.albums.get(parts[2]) if len(parts) == 4 and parts[3] == 'assets' else None
+            if album is not None:
+                album['assets'].extend(json.loads(body)['ids'])
+        if album is None:
+            self.send_json(404, {'message': 'Not found'})
+        else:
+            self.send_json(200, [])
+
+    def send_asset(self, asset_id: str) -> None:
+        with self.server.lock:
+            asset = self.server.assets.get(asset_id)
+            checksum = next((checksum for checksum, known in self.server.checksums.items() if known == asset_id), None)
+        if asset is None:
+            self.send_json(404, {'message': 'Not found'})
+        else:
+            self.send_json(200, dict(asset, id=asset_id,
+                                     checksum=base64.b64encode(bytes.fromhex(checksum)).decode()))
+
+    def update_asset(self, asset_id: str, changes: Dict) -> None:
+        with self.server.lock:
+            asset = self.server.assets.get(asset_id)
+            if asset is not None:
+                asset.update(changes)
+                self.server.updates.append(asset_id)
+        if asset is None:
+            self.send_json(404, {'message': 'Not found'})
+        else:
+            self.send_json(200, dict(asset, id=asset_id))
+
+    def check_assets(self, assets: List[Dict[str, str]]) -> None:
+        results = []
+        with self.server.lock:
+            self.server.bulk_checks += 1
+            for asset in assets:
+                checksum = asset['checksum']
+                if len(checksum) != 40:
+                    # Immich takes hex or base64 SHA-1
+                    checksum = base64.b64decode(checksum).hex()
+                asset_id = self.server.checksums.get(checksum)
+                if asset_id is None:
+                    results.append({'id': asset['id'], 'action': 'accept'})
+                else:
+                    results.append({'id': asset['id'], 'action': 'reject', 'reason': 'duplicate',
+                                    'assetId': asset_id})
+        self.send_json(200, {'results': results})
+
+    def receive_asset(self, body: bytes) -> None:
+        boundary = self.headers.get_param('boundary', header='Content-Type')
+        fields, data = {}, None
+        for part in body.split(f'--{boundary}'.encode())[1:-1]:
+            head, _, content = part[2:-2].partition(b'\r\n\r\n')
+            disposition = head.decode().split('\r\n')[0]
+            name = disposition.split('name="')[1].split('"')[0]
+            if 'filename="' in disposition:
+                data = content
+            else:
+                fields[name] = content.decode()
+
+        if data is None or self.server.reject(fields):
+            self.send_json(400, {'message': 'Bad asset'})
+            return
+
+        checksum = hashlib.sha1(data).hexdigest()
+        with self.server.lock:
+            self.server.uploads += 1
+            self.server.bytes_received += len(data)
+            asset_id = self.server.checksums.get(checksum)
+            duplicate = asset_id is not None
+            if not duplicate:
+                asset_id = str(uuid.uuid4())
+                self.server.checksums[checksum] = asset_id
+                self.server.assets[asset_id] = fields
+        self.send_json(200 if duplicate else 201, {'id': asset_id, 'status': 'duplicate' if duplicate else 'created'})
+
+
+class FakeImmichServer(ThreadingHTTPServer):
+    """Threaded stand-in Immich server; state is kept in memory."""
+
+    daemon_threads = True
+
+    def __init__(self, host: str = '127.0.0.1', port: int = 0, api_key: str = 'test-key',
+                 reject_names: Optional[List[str]] = None):
+        super().__init__((host, port), FakeImmichHandler)
+        self.api_key = api_key
+        self.reject_names = set(reject_names or ())
+        self.lock = threading.Lock()
+        self.connections = 0
+        self.bytes_received = 0
+        self.assets: Dict[str, Dict[str, str]] = {}
+        self.checksums: Dict[str, str] = {}
+        self.albums: Dict[str, Dict] = {}
+        # Asset ids of metadata updates, in arrival order
+        self.updates: List[str] = []
+        # Bulk upload check requests and asset upload requests received
+        self.bulk_checks = 0
+        self.uploads = 0
+        # Connections whose first response is cut off halfway, to exercise error handling
+        self.cut_connections = 0
+
+    @property
+    def url(self) -> str:
+        host, port = self.server_address[:2]
+        return f'http://{host}:{port}'
+
+    def reject(self, fields: Dict[str, str]) -> bool:
+        """Return True for assets the server should refuse, to exercise error handling."""
+        return any(fields.get('deviceAssetId', '').startswith(name) for name in self.reject_names)
+
+    def album_assets(self) -> Dict[str, List[str]]:
+        """Return asset ids by album name."""
+        with self.lock:
+            return {album['albumName']: list(album['assets']) for album in self.albums.values()}
+
+    def start(self) -> 'FakeImmichServer':
+        """Serve from a background thread."""
+        threading.Thread(target=self.serve_forever, kwargs={'poll_interval': 0.05}, daemon=True).start()
+        return self
+
+    def stop(self) -> None:
+        self.shutdown()
+        self.server_close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Run a local stand-in Immich server')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=2283)
+    parser.add_argument('--api-key', default='test-key')
+    args = parser.parse_args()
+
+    server = FakeImmichServer(args.host, args.port, args.api_key)
+    print(f"Fake Immich listening on {server.url} (API key: {args.api_key})")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+if __name__ == '__main__':
+    main()
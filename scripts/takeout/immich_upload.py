@@ -0,0 +1,620 @@
+"""
+Native asyncio uploader for the Immich asset API.
+
+Assets are uploaded over a small pool of keep-alive HTTP/1.1 connections, so
+a run opens at most `concurrency` connections no matter how many files it
+sends. Multipart bodies are streamed from disk in chunks with a precomputed
+Content-Length, and album membership is assigned in bulk once every asset of
+the run has an id. Only the standard library is used.
+
+When the caller knows the SHA-1 of its files, Immich is asked first which of
+them it already has (POST /api/assets/bulk-upload-check, in batches). Those
+files are not sent again; their existing asset ids go into the albums.
+"""
+
+import asyncio
+import concurrent.futures
+import json
+import socket
+import ssl
+import threading
+import time
+import uuid
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import AsyncIterator, Dict, Iterable, List, NamedTuple, Optional, Tuple, Union
+from urllib.parse import urlsplit
+
+UPLOAD_CHUNK_SIZE = 1024 * 1024
+DEFAULT_CONCURRENCY = 4
+
+# Asset ids sent per album request
+ALBUM_BATCH_SIZE = 1000
+
+# Checksums sent per bulk upload check request
+CHECK_BATCH_SIZE = 1000
+
+DEVICE_ID = 'takeout-import'
+USER_AGENT = 'enhanced-takeout-import'
+
+
+class ImmichError(Exception):
+    """Raised when the Immich API answers with an error status."""
+
+    def __init__(self, status: int, message: str):
+        super().__init__(f"HTTP {status}: {message}")
+        self.status = status
+
+
+class Response(NamedTuple):
+    status: int
+    headers: Dict[str, str]
+    body: bytes
+
+    def json(self):
+        return json.loads(self.body) if self.body else None
+
+
+class MultipartBody:
+    """multipart/form-data body whose file part is streamed from disk."""
+
+    def __init__(self, fields: Dict[str, str], file_field: str, path: Path):
+        self.path = Path(path)
+        self.boundary = uuid.uuid4().hex
+        head = []
+        for name, value in fields.items():
+            head.append(f'--{self.boundary}\r\nContent-Disposition: form-data; name="{name}"\r\n\r\n{value}\r\n')
+        head.append(f'--{self.boundary}\r\nContent-Disposition: form-data; name="{file_field}"; '
+                    f'filename="{self.path.name}"\r\nContent-Type: application/octet-stream\r\n\r\n')
+        self._head = ''.join(head).encode()
+        self._tail = f'\r\n--{self.boundary}--\r\n'.encode()
+        self.length = len(self._head) + self.path.stat().st_size + len(self._tail)
+
+    @property
+    def content_type(self) -> str:
+        return f'multipart/form-data; boundary={self.boundary}'
+
+    async def chunks(self) -> AsyncIterator[bytes]:
+        """Yield the body; the file is read in a thread so the event loop never blocks on disk."""
+        yield self._head
+        loop = asyncio.get_running_loop()
+        with open(self.path, 'rb') as source:
+            while True:
+                # run_in_executor rather than asyncio.to_thread, which needs Python 3.9
+                chunk = await loop.run_in_executor(None, source.read, UPLOAD_CHUNK_SIZE)
+                if not chunk:
+                    break
+                yield chunk
+        yield self._tail
+
+
+Body = Union[bytes, MultipartBody]
+
+
+class HttpConnection:
+    """One keep-alive HTTP/1.1 connection."""
+
+    def __init__(self, host: str, port: int, use_ssl: bool):
+        self.host = host
+        self.port = port
+        self.use_ssl = use_ssl
+        self.requests = 0
+        self._reader: Optional[asyncio.StreamReader] = None
+        self._writer: Optional[asyncio.StreamWriter] = None
+
+    @property
+    def is_open(self) -> bool:
+        return self._writer is not None and not self._writer.is_closing()
+
+    async def open(self) -> None:
+        context = ssl.create_default_context() if self.use_ssl else None
+        self._reader, self._writer = await asyncio.open_connection(self.host, self.port, ssl=context)
+        # Headers and body go out in separate writes; don't let Nagle hold the body back
+        sock = self._writer.get_extra_info('socket')
+        if sock is not None:
+            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self.requests = 0
+
+    def close(self) -> None:
+        if self._writer is not None:
+            self._writer.close()
+        self._reader = self._writer = None
+
+    async def request(self, method: str, target: str, headers: Dict[str, str], body: Body = b'') -> Response:
+        if not self.is_open:
+            await self.open()
+
+        length = body.length if isinstance(body, MultipartBody) else len(body)
+        lines = [f'{method} {target} HTTP/1.1', f'Host: {self.host}:{self.port}',
+                 f'User-Agent: {USER_AGENT}', f'Content-Length: {length}']
+        lines.extend(f'{name}: {value}' for name, value in headers.items())
+        self._writer.write(('\r\n'.join(lines) + '\r\n\r\n').encode('latin-1'))
+
+        if isinstance(body, MultipartBody):
+            async for chunk in body.chunks():
+                self._writer.write(chunk)
+                await self._writer.drain()
+        else:
+            self._writer.write(body)
+            await self._writer.drain()
+
+        response = await self._read_response()
+        self.requests += 1
+        if response.headers.get('connection', '').lower() == 'close':
+            self.close()
+        return response
+
+    async def _read_response(self) -> Response:
+        status_line = await self._reader.readline()
+        if not status_line:
+            raise ConnectionResetError("Connection closed by server")
+        status = int(status_line.split()[1])
+
+        headers = {}
+        while True:
+            line = await self._reader.readline()
+            if line in (b'\r\n', b'\n', b''):
+                break
+            name, _, value = line.decode('latin-1').partition(':')
+            headers[name.strip().lower()] = value.strip()
+
+        if headers.get('transfer-encoding', '').lower() == 'chunked':
+            parts = []
+            while True:
+                size = int((await self._reader.readline()).split(b';')[0], 16)
+                if size == 0:
+                    # Skip trailers up to the blank line
+                    while (await self._reader.readline()) not in (b'\r\n', b'\n', b''):
+                        pass
+                    break
+                parts.append(await self._reader.readexactly(size))
+                await self._reader.readexactly(2)
+            body = b''.join(parts)
+        elif 'content-length' in headers:
+            body = await self._reader.readexactly(int(headers['content-length']))
+        else:
+            body = await self._reader.read()
+            self.close()
+        return Response(status, headers, body)
+
+
+class ConnectionPool:
+    """At most `size` keep-alive connections to one server, reused across requests."""
+
+    def __init__(self, base_url: str, size: int):
+        parts = urlsplit(base_url)
+        self.use_ssl = parts.scheme == 'https'
+        self.host = parts.hostname
+        self.port = parts.port or (443 if self.use_ssl else 80)
+        self.base_path = parts.path.rstrip('/')
+        self.opened = 0
+        self._idle: List[HttpConnection] = []
+        self._slots = asyncio.Semaphore(size)
+
+    async def request(self, method: str, path: str, headers: Dict[str, str], body: Body = b'') -> Response:
+        async with self._slots:
+            conn = self._idle.pop() if self._idle else HttpConnection(self.host, self.port, self.use_ssl)
+            try:
+                try:
+                    response = await self._send(conn, method, path, headers, body)
+                except (ConnectionError, asyncio.IncompleteReadError):
+                    if not conn.requests:
+                        raise
+                    # The server dropped an idle keep-alive connection; retry once on a fresh one
+                    conn.close()
+                    response = await self._send(conn, method, path, headers, body)
+            except asyncio.IncompleteReadError as e:
+                conn.close()
+                # An EOFError, not an OSError; callers handle connection failures as OSError
+                raise ConnectionResetError(f"Connection closed mid-response after "
+                                           f"{len(e.partial)} of {e.expected} bytes") from e
+            except BaseException:
+                conn.close()
+                raise
+            if conn.is_open:
+                self._idle.append(conn)
+            return response
+
+    async def _send(self, conn: HttpConnection, method: str, path: str, headers: Dict[str, str],
+                    body: Body) -> Response:
+        if not conn.is_open:
+            self.opened += 1
+        return await conn.request(method, self.base_path + path, headers, body)
+
+    def close(self) -> None:
+        for conn in self._idle:
+            conn.close()
+        self._idle = []
+
+
+class UploadReport:
+    """Outcome of an upload run."""
+
+    def __init__(self):
+        self.uploaded = 0
+        self.duplicates = 0
+        self.updated = 0
+        self.bytes_sent = 0
+        # Uploads avoided because the bulk upload check found the checksum in Immich
+        self.skipped = 0
+        self.bytes_skipped = 0
+        self.check_error: Optional[str] = None
+        self.seconds = 0.0
+        self.connections = 0
+        self.failed: List[Tuple[Path, str]] = []
+        self.completed_albums: List[str] = []
+        # Asset id of every file Immich accepted, new or duplicate
+        self.asset_ids: Dict[Path, str] = {}
+
+
+class ImmichUploader:
+    """Uploads assets and assigns albums through the Immich REST API."""
+
+    def __init__(self, server: str, api_key: str, concurrency: int = DEFAULT_CONCURRENCY):
+        self.server = server
+        self.api_key = api_key
+        self.concurrency = max(1, concurrency)
+        self.pool: Optional[ConnectionPool] = None
+
+    async def __aenter__(self) -> 'ImmichUploader':
+        self.pool = ConnectionPool(self.server, self.concurrency)
+        return self
+
+    async def __aexit__(self, *exc_info) -> None:
+        self.pool.close()
+
+    @property
+    def headers(self) -> Dict[str, str]:
+        return {'x-api-key': self.api_key, 'Accept': 'application/json'}
+
+    async def api(self, method: str, path: str, payload=None):
+        """Send a JSON request and return the decoded response."""
+        body = json.dumps(payload).encode() if payload is not None else b''
+        headers = dict(self.headers, **({'Content-Type': 'application/json'} if payload is not None else {}))
+        response = await self.pool.request(method, f'/api{path}', headers, body)
+        if response.status >= 400:
+            raise ImmichError(response.status, response.body.decode(errors='replace'))
+        return response.json()
+
+    async def upload_asset(self, path: Path) -> Tuple[str, bool]:
+        """Upload one file and return its asset id and whether Immich already had it."""
+        stat = path.stat()
+        modified = datetime.fromtimestamp(stat.st_mtime, tz=timezone.utc).isoformat()
+        body = MultipartBody({
+            'deviceAssetId': f"{path.name}-{stat.st_size}".replace(' ', ''),
+            'deviceId': DEVICE_ID,
+            'fileCreatedAt': modified,
+            'fileModifiedAt': modified,
+        }, 'assetData', path)
+        headers = dict(self.headers, **{'Content-Type': body.content_type})
+        response = await self.pool.request('POST', '/api/assets', headers, body)
+        if response.status >= 400:
+            raise ImmichError(response.status, response.body.decode(errors='replace'))
+        data = response.json()
+        return data['id'], data.get('status') == 'duplicate'
+
+    async def upload_file(self, path: Path, report: UploadReport) -> Optional[str]:
+        """Upload one file, count it in report, and return its asset id or None if it failed."""
+        try:
+            size = path.stat().st_size
+            asset_id, duplicate = await self.upload_asset(path)
+        except (OSError, ImmichError, ValueError, KeyError) as e:
+            report.failed.append((path, str(e)))
+            return None
+        if duplicate:
+            report.duplicates += 1
+        else:
+            report.uploaded += 1
+            report.bytes_sent += size
+        report.asset_ids[path] = asset_id
+        return asset_id
+
+    async def upload_files(self, files: Iterable[Path], report: UploadReport) -> Dict[Path, str]:
+        """Upload files with `concurrency` requests in flight and return their asset ids."""
+        queue: asyncio.Queue = asyncio.Queue()
+        for path in files:
+            queue.put_nowait(path)
+        asset_ids: Dict[Path, str] = {}
+
+        async def worker() -> None:
+            while not queue.empty():
+                path = queue.get_nowait()
+                asset_id = await self.upload_file(path, report)
+                if asset_id is not None:
+                    asset_ids[path] = asset_id
+
+        await asyncio.gather(*(worker() for _ in range(self.concurrency)))
+        return asset_ids
+
+    async def check_existing(self, checksums: Dict[Path, str], report: UploadReport) -> Dict[Path, str]:
+        """Return the asset ids of files Immich already has by SHA-1 and count them as skipped.
+
+        If the check fails, e.g. on a server without the endpoint, nothing counts as existing.
+        """
+        items = list(checksums.items())
+        existing: Dict[Path, str] = {}
+        try:
+            for start in range(0, len(items), CHECK_BATCH_SIZE):
+                batch = items[start:start + CHECK_BATCH_SIZE]
+                response = await self.api('POST', '/assets/bulk-upload-check', {'assets': [
+                    {'id': str(index), 'checksum': checksum} for index, (_, checksum) in enumerate(batch)]})
+                for result in response['results']:
+                    if result.get('action') == 'reject' and result.get('assetId'):
+                        existing[batch[int(result['id'])][0]] = result['assetId']
+        except (OSError, ImmichError, ValueError, KeyError, IndexError) as e:
+            report.check_error = str(e)
+            return {}
+
+        for path, asset_id in existing.items():
+            report.skipped += 1
+            report.bytes_skipped += path.stat().st_size
+            report.asset_ids[path] = asset_id
+        return existing
+
+    async def assign_albums(self, albums: Dict[str, List[str]]) -> None:
+        """Add asset ids to albums by name, creating albums that do not exist yet."""
+        existing = {album['albumName']: album['id'] for album in await self.api('GET', '/albums')}
+        for name, ids in albums.items():
+            if not ids:
+                continue
+            if name in existing:
+                album_id, remaining = existing[name], ids
+            else:
+                created = await self.api('POST', '/albums', {'albumName': name, 'assetIds': ids[:ALBUM_BATCH_SIZE]})
+                album_id, remaining = created['id'], ids[ALBUM_BATCH_SIZE:]
+            for start in range(0, len(remaining), ALBUM_BATCH_SIZE):
+                await self.api('PUT', f'/albums/{album_id}/assets', {'ids': remaining[start:start + ALBUM_BATCH_SIZE]})
+
+    async def update_assets(self, updates: Dict[str, Dict], report: UploadReport) -> List[str]:
+        """Update the metadata of existing assets by id and return the ids that were updated."""
+        queue: asyncio.Queue = asyncio.Queue()
+        for item in updates.items():
+            queue.put_nowait(item)
+        updated: List[str] = []
+
+        async def worker() -> None:
+            while not queue.empty():
+                asset_id, fields = queue.get_nowait()
+                try:
+                    await self.api('PUT', f'/assets/{asset_id}', fields)
+                except (OSError, ImmichError, ValueError) as e:
+                    report.failed.append((Path(asset_id), str(e)))
+                    continue
+                report.updated += 1
+                updated.append(asset_id)
+
+        await asyncio.gather(*(worker() for _ in range(self.concurrency)))
+        return updated
+
+    async def asset_checksums(self, asset_ids: Iterable[str]) -> Dict[str, Optional[str]]:
+        """Return Immich's base64 SHA-1 checksum per asset id, or None for assets it does not have."""
+        queue: asyncio.Queue = asyncio.Queue()
+        for asset_id in asset_ids:
+            queue.put_nowait(asset_id)
+        checksums: Dict[str, Optional[str]] = {}
+
+        async def worker() -> None:
+            while not queue.empty():
+                asset_id = queue.get_nowait()
+                try:
+                    checksums[asset_id] = (await self.api('GET', f'/assets/{asset_id}')).get('checksum')
+                except ImmichError as e:
+                    if e.status not in (400, 404):
+                        raise
+                    checksums[asset_id] = None
+
+        await asyncio.gather(*(worker() for _ in range(self.concurrency)))
+        return checksums
+
+    async def upload_albums(self, albums: Dict[str, List[Path]],
+                            checksums: Optional[Dict[Path, str]] = None) -> UploadReport:
+        """Upload every album's files, then assign album membership in bulk.
+
+        With checksums, files Immich already has are not uploaded but still assigned to their albums.
+        """
+        report = UploadReport()
+        started = time.monotonic()
+        files = list(dict.fromkeys(path for paths in albums.values() for path in paths))
+        existing = await self.check_existing(checksums, report) if checksums else {}
+        asset_ids = await self.upload_files((path for path in files if path not in existing), report)
+        asset_ids.update(existing)
+
+        failed = {path for path, _ in report.failed}
+        album_ids = {name: list(dict.fromkeys(asset_ids[path] for path in paths if path in asset_ids))
+                     for name, paths in albums.items()}
+        try:
+            await self.assign_albums(album_ids)
+        except (OSError, ImmichError, ValueError, KeyError) as e:
+            report.failed.append((Path('albums'), str(e)))
+        else:
+            report.completed_albums = [name for name, paths in albums.items() if not failed.intersection(paths)]
+
+        report.seconds = time.monotonic() - started
+        report.connections = self.pool.opened
+        return report
+
+
+class BackgroundUploader:
+    """Uploads files handed over by the processing thread while processing continues.
+
+    put() blocks once `depth` files are waiting, so files that are processed
+    but not yet uploaded never exceed depth plus the uploads in flight. With
+    delete_after, each file is removed as soon as Immich has it. Album
+    membership is assigned in bulk by close().
+
+    Files put with a checksum are checked against Immich before upload. Each
+    worker takes every file waiting when it gets one, up to CHECK_BATCH_SIZE,
+    into one bulk upload check, so the batches grow with the backlog.
+    """
+
+    def __init__(self, server: str, api_key: str, concurrency: int = DEFAULT_CONCURRENCY,
+                 depth: int = 64, delete_after: bool = False):
+        self.server = server
+        self.api_key = api_key
+        self.concurrency = max(1, concurrency)
+        self.delete_after = delete_after
+        self.depth = max(1, depth)
+        self.report = UploadReport()
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._queue: Optional[asyncio.Queue] = None
+        self._slots: Optional[asyncio.Semaphore] = None
+        self._ready = threading.Event()
+        self._album_ids: Dict[str, List[str]] = {}
+        self._album_failed = set()
+        self._uploaded = []
+        self._lock = threading.Lock()
+        self._thread = threading.Thread(target=asyncio.run, args=(self._run(),), name='immich-upload', daemon=True)
+
+    def start(self) -> 'BackgroundUploader':
+        self._thread.start()
+        self._ready.wait()
+        return self
+
+    def _enqueue(self, entry) -> None:
+        """Block until the upload queue has room for entry."""
+        if not self._thread.is_alive():
+            raise RuntimeError("Upload thread is not running")
+        future = asyncio.run_coroutine_threadsafe(self._admit(entry), self._loop)
+        while True:
+            try:
+                return future.result(timeout=1)
+            except concurrent.futures.TimeoutError:
+                # Not the builtin TimeoutError before Python 3.11
+                if not self._thread.is_alive():
+                    raise RuntimeError("Upload thread stopped unexpectedly")
+
+    async def _admit(self, entry) -> None:
+        # Workers hold batches outside the queue, so waiting files are bounded by slots, not queue size
+        if entry is not None:
+            await self._slots.acquire()
+        self._queue.put_nowait(entry)
+
+    def put(self, album: str, path: Path, item=None, checksum: Optional[str] = None) -> None:
+        """Queue a finished file for upload; item is handed back by take_uploaded().
+
+        With its hex SHA-1, the file is only uploaded if Immich does not have it yet.
+        """
+        self._enqueue((album, Path(path), item, checksum))
+
+    def take_uploaded(self) -> List:
+        """Return the items uploaded since the last call."""
+        with self._lock:
+            uploaded, self._uploaded = self._uploaded, []
+        return uploaded
+
+    def close(self) -> UploadReport:
+        """Wait for queued uploads, assign albums and return the report."""
+        if self._thread.is_alive():
+            for _ in range(self.concurrency):
+                self._enqueue(None)
+            self._thread.join()
+        return self.report
+
+    async def _run(self) -> None:
+        self._loop = asyncio.get_running_loop()
+        self._queue = asyncio.Queue()
+        self._slots = asyncio.Semaphore(self.depth + self.concurrency)
+        self._ready.set()
+        started = time.monotonic()
+        async with ImmichUploader(self.server, self.api_key, self.concurrency) as uploader:
+            await asyncio.gather(*(self._worker(uploader) for _ in range(self.concurrency)))
+            try:
+                await uploader.assign_albums(self._album_ids)
+            except (OSError, ImmichError, ValueError, KeyError) as e:
+                self.report.failed.append((Path('albums'), str(e)))
+            else:
+                self.report.completed_albums = [name for name in self._album_ids if name not in self._album_failed]
+            self.report.connections = uploader.pool.opened
+        self.report.seconds = time.monotonic() - started
+
+    async def _worker(self, uploader: ImmichUploader) -> None:
+        while True:
+            entry = await self._queue.get()
+            if entry is None:
+                return
+            batch, stop = [entry], False
+            while len(batch) < CHECK_BATCH_SIZE and not self._queue.empty():
+                entry = self._queue.get_nowait()
+                if entry is None:
+                    stop = True
+                    break
+                batch.append(entry)
+
+            done = 0
+            try:
+                checksums = {path: checksum for _, path, _, checksum in batch if checksum}
+                existing = await uploader.check_existing(checksums, self.report) if checksums else {}
+                for album, path, item, _ in batch:
+                    asset_id = existing.get(path) or await uploader.upload_file(path, self.report)
+                    done += 1
+                    self._slots.release()
+                    if asset_id is None:
+                        self._album_failed.add(album)
+                        continue
+                    self._album_ids.setdefault(album, []).append(asset_id)
+                    if self.delete_after:
+                        path.unlink(missing_ok=True)
+                    with self._lock:
+                        self._uploaded.append(item)
+            except Exception as e:
+                # A dead worker would strand the rest of the batch's slots and block producers in put()
+                for album, path, _, _ in batch[done:]:
+                    self.report.failed.append((path, str(e)))
+                    self._album_failed.add(album)
+                    self._slots.release()
+            if stop:
+                return
+
+
+def upload_albums(server: str, api_key: str, albums: Dict[str, List[Path]],
+                  concurrency: int = DEFAULT_CONCURRENCY,
+                  checksums: Optional[Dict[Path, str]] = None) -> UploadReport:
+    """Upload albums from synchronous code."""
+    async def run() -> UploadReport:
+        async with ImmichUploader(server, api_key, concurrency) as uploader:
+            return await uploader.upload_albums(albums, checksums)
+    return asyncio.run(run())
+
+
+def check_existing(server: str, api_key: str, checksums: Dict[Path, str]) -> UploadReport:
+    """Ask Immich which files it already has from synchronous code; their asset ids are in the report."""
+    async def run() -> UploadReport:
+        report = UploadReport()
+        started = time.monotonic()
+        async with ImmichUploader(server, api_key, 1) as uploader:
+            await uploader.check_existing(checksums, report)
+            report.connections = uploader.pool.opened
+        report.seconds = time.monotonic() - started
+        return report
+    return asyncio.run(run())
+
+
+def assign_albums(server: str, api_key: str, albums: Dict[str, List[str]]) -> None:
+    """Add existing asset ids to albums by name from synchronous code."""
+    async def run() -> None:
+        async with ImmichUploader(server, api_key, 1) as uploader:
+            await uploader.assign_albums(albums)
+    asyncio.run(run())
+
+
+def update_assets(server: str, api_key: str, updates: Dict[str, Dict],
+                  concurrency: int = DEFAULT_CONCURRENCY) -> Tuple[UploadReport, List[str]]:
+    """Update asset metadata from synchronous code; return the report and the updated ids."""
+    async def run() -> Tuple[UploadReport, List[str]]:
+        report = UploadReport()
+        started = time.monotonic()
+        async with ImmichUploader(server, api_key, concurrency) as uploader:
+            updated = await uploader.update_assets(updates, report)
+            report.connections = uploader.pool.opened
+        report.seconds = time.monotonic() - started
+        return report, updated
+    return asyncio.run(run())
+
+
+def fetch_checksums(server: str, api_key: str, asset_ids: Iterable[str],
+                    concurrency: int = DEFAULT_CONCURRENCY) -> Dict[str, Optional[str]]:
+    """Fetch asset checksums from synchronous code."""
+    async def run() -> Dict[str, Optional[str]]:
+        async with ImmichUploader(server, api_key, concurrency) as uploader:
+            return await uploader.asset_checksums(asset_ids)
+    return asyncio.run(run())
@@ -0,0 +1,97 @@
+"""
+Persistent index of everything earlier imports processed, for --delta runs.
+
+Google Photos exports repeat the whole library every time, but the path of a
+photo inside the export ("<album>/<file name>") is stable across exports. The
+index keeps one row per path with the media fingerprint (size and CRC-32 from
+the zip central directory), a digest of the sidecar fields that get embedded,
+and the Immich asset id once the file was uploaded. A delta run compares each
+planned file against its row:
+
+- no row, or different media bytes: process and upload it again (new)
+- same media, different metadata: update the Immich asset's metadata only
+- same media and metadata: skip it (unchanged)
+
+Unlike the job manifest, which describes a single run and is reset by a
+fresh run, the index lives across runs and exports.
+"""
+
+import sqlite3
+import time
+from pathlib import Path
+from typing import Iterable, Optional, Set, Tuple
+
+DELTA_NEW = 'new'
+DELTA_METADATA = 'metadata'
+DELTA_UNCHANGED = 'unchanged'
+DELTA_STATES = (DELTA_NEW, DELTA_METADATA, DELTA_UNCHANGED)
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS items (
+    path TEXT PRIMARY KEY,
+    album TEXT NOT NULL,
+    size INTEGER NOT NULL,
+    crc INTEGER NOT NULL,
+    digest TEXT NOT NULL,
+    asset_id TEXT,
+    uploaded INTEGER NOT NULL DEFAULT 0,
+    updated REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS items_album ON items (album);
+"""
+
+
+class ImportIndex:
+    """SQLite-backed fingerprints of every (media, sidecar) pair earlier runs finished."""
+
+    def __init__(self, path: Path):
+        self.path = Path(path)
+        self.conn = sqlite3.connect(str(self.path))
+        self.conn.execute('PRAGMA journal_mode=WAL')
+        self.conn.executescript(SCHEMA)
+
+    def close(self) -> None:
+        self.conn.commit()
+        self.conn.close()
+
+    def classify(self, path: str, size: int, crc: int, digest: str,
+                 uploading: bool) -> Tuple[str, Optional[str]]:
+        """Return the delta state of a planned file and its known Immich asset id.
+
+        When uploading, files that were only processed before count as new so they get uploaded.
+        """
+        row = self.conn.execute('SELECT size, crc, digest, asset_id, uploaded FROM items WHERE path = ?',
+                                (path,)).fetchone()
+        if row is None or (row[0], row[1]) != (size, crc) or (uploading and not row[4]):
+            return DELTA_NEW, None
+        if row[2] != digest:
+            return DELTA_METADATA, row[3]
+        return DELTA_UNCHANGED, row[3]
+
+    def record(self, path: str, album: str, size: int, crc: int, digest: str) -> None:
+        """Record a processed file; upload state is reset until mark_uploaded() says otherwise."""
+        self.conn.execute(
+            'INSERT INTO items (path, album, size, crc, digest, asset_id, uploaded, updated) '
+            'VALUES (?, ?, ?, ?, ?, NULL, 0, ?) '
+            'ON CONFLICT (path) DO UPDATE SET album = excluded.album, size = excluded.size, crc = excluded.crc, '
+            'digest = excluded.digest, asset_id = NULL, uploaded = 0, updated = excluded.updated',
+            (path, album, size, crc, digest, time.time()))
+
+    def update_digest(self, path: str, digest: str) -> None:
+        """Store the metadata digest of a file whose metadata was updated in place."""
+        self.conn.execute('UPDATE items SET digest = ?, updated = ? WHERE path = ?', (digest, time.time(), path))
+
+    def pending(self) -> Set[str]:
+        """Return the paths that were processed but not uploaded yet."""
+        return {path for path, in self.conn.execute('SELECT path FROM items WHERE uploaded = 0')}
+
+    def mark_uploaded(self, assets: Iterable[Tuple[str, Optional[str]]]) -> None:
+        """Mark paths as uploaded, with their asset id when the uploader reported one."""
+        self.conn.executemany('UPDATE items SET uploaded = 1, asset_id = COALESCE(?, asset_id) WHERE path = ?',
+                              [(asset_id, path) for path, asset_id in assets])
+        self.conn.commit()
+
+    def mark_album_uploaded(self, album: str) -> None:
+        """Mark every file of an album as uploaded by a tool that does not report asset ids."""
+        self.conn.execute('UPDATE items SET uploaded = 1 WHERE album = ?', (album,))
+        self.conn.commit()
@@ -0,0 +1,318 @@
+"""
+Integrity manifest of the files the takeout importer wrote into processed/.
+
+Every output is hashed while its bytes are written. The JPEG splice, in-memory
+images, streamed videos and extracted copies all write through a
+HashingWriter, so this costs no extra read pass. Only files written by
+external tools (an ffmpeg remux, an exiftool rewrite) are read back once to be
+hashed. Files placed unmodified by rename or an in-kernel copy take the hash
+their source got when it was extracted.
+
+The hash is SHA-1. hashlib's SHA-1 uses the CPU's SHA extensions where they
+exist and outruns BLAKE2 here, and it is the checksum Immich stores for each
+asset. So one digest checks both the local tree and the uploaded copies.
+
+The manifest is a SQLite table next to the output directory. It keeps one row
+per output with its size, mtime, digest and Immich asset id, and whether the
+output was deleted once uploaded. A run that does not resume starts with no
+outputs recorded. `--verify tree` stats every file still meant to be on disk and
+re-hashes the ones whose size still matches, on a thread pool (hashlib
+releases the GIL). `--verify assets` asks Immich for the
+checksum of every uploaded asset, without reading anything locally.
+
+A second table caches digests by (device, inode, size, mtime). The pre-upload
+duplicate check reads its checksums from there, so files this or an earlier
+run wrote are not read again unless they changed.
+"""
+
+import base64
+import hashlib
+import os
+import sqlite3
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+
+HASH_NAME = 'sha1'
+HASH_CHUNK_SIZE = 1024 * 1024
+
+# Recorded instead of a digest for an output placed unmodified from its source
+SAME_AS_SOURCE = 'source'
+
+# What --verify checks: the processed/ tree on disk, or the assets uploaded to Immich
+VERIFY_TREE = 'tree'
+VERIFY_ASSETS = 'assets'
+VERIFY_TARGETS = (VERIFY_TREE, VERIFY_ASSETS)
+
+# Threads hashing files for --verify and the upload check when no worker count is given
+DEFAULT_HASH_WORKERS = min(os.cpu_count() or 1, 8)
+
+PROBLEM_MISSING = 'missing'
+PROBLEM_SIZE = 'size changed'
+PROBLEM_HASH = 'content changed'
+PROBLEM_UNREADABLE = 'unreadable'
+PROBLEM_ASSET_MISSING = 'asset missing'
+PROBLEM_CHECKSUM = 'checksum differs'
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS outputs (
+    path TEXT PRIMARY KEY,
+    size INTEGER NOT NULL,
+    mtime_ns INTEGER NOT NULL,
+    sha1 TEXT NOT NULL,
+    asset_id TEXT,
+    deleted INTEGER NOT NULL DEFAULT 0,
+    recorded REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS checksums (
+    device INTEGER NOT NULL,
+    inode INTEGER NOT NULL,
+    size INTEGER NOT NULL,
+    mtime_ns INTEGER NOT NULL,
+    sha1 TEXT NOT NULL,
+    PRIMARY KEY (device, inode)
+);
+"""
+
+
+class HashingWriter:
+    """Binary file writer that hashes every byte on its way to disk.
+
+    When closed without an error and given a digests dict, the writer stores
+    its digest there under its path.
+    """
+
+    def __init__(self, path: Path, digests: Optional[Dict[Path, str]] = None):
+        self.path = Path(path)
+        self.digests = digests
+        self.hasher = hashlib.new(HASH_NAME)
+        self._file = open(self.path, 'wb')
+
+    def write(self, data) -> int:
+        self.hasher.update(data)
+        return self._file.write(data)
+
+    def hexdigest(self) -> str:
+        return self.hasher.hexdigest()
+
+    def close(self) -> None:
+        self._file.close()
+
+    def __enter__(self) -> 'HashingWriter':
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback) -> None:
+        self.close()
+        if self.digests is not None:
+            if exc_type is None:
+                self.digests[self.path] = self.hexdigest()
+            else:
+                self.digests.pop(self.path, None)
+
+
+def hash_file(path: Path) -> str:
+    """Return the hex digest of a file, read in chunks."""
+    hasher = hashlib.new(HASH_NAME)
+    with open(path, 'rb') as source:
+        while True:
+            chunk = source.read(HASH_CHUNK_SIZE)
+            if not chunk:
+                break
+            hasher.update(chunk)
+    return hasher.hexdigest()
+
+
+def immich_checksum(digest: str) -> str:
+    """Return a hex SHA-1 digest the way Immich reports asset checksums, base64 encoded."""
+    return base64.b64encode(bytes.fromhex(digest)).decode()
+
+
+class IntegrityManifest:
+    """SQLite-backed size, mtime, digest and asset id of every output file."""
+
+    def __init__(self, path: Path, reset: bool = False):
+        self.path = Path(path)
+        self.conn = sqlite3.connect(str(self.path))
+        self.conn.execute('PRAGMA journal_mode=WAL')
+        self.conn.executescript(SCHEMA)
+        if reset:
+            # The checksum cache is keyed by file identity, so it stays valid across runs
+            self.conn.execute('DELETE FROM outputs')
+            self.conn.commit()
+
+    def close(self) -> None:
+        self.conn.commit()
+        self.conn.close()
+
+    def record(self, path: str, stat: os.stat_result, digest: str) -> None:
+        """Record an output; its asset id is kept only if the content did not change."""
+        self.conn.execute(
+            'INSERT INTO outputs (path, size, mtime_ns, sha1, asset_id, recorded) VALUES (?, ?, ?, ?, NULL, ?) '
+            'ON CONFLICT (path) DO UPDATE SET size = excluded.size, mtime_ns = excluded.mtime_ns, '
+            'asset_id = CASE WHEN sha1 = excluded.sha1 THEN asset_id END, sha1 = excluded.sha1, '
+            'deleted = 0, recorded = excluded.recorded',
+            (path, stat.st_size, stat.st_mtime_ns, digest, time.time()))
+        self.cache(stat, digest)
+
+    def cache(self, stat: os.stat_result, digest: str) -> None:
+        """Remember the digest of a file by its inode, size and mtime."""
+        self.conn.execute('INSERT OR REPLACE INTO checksums (device, inode, size, mtime_ns, sha1) '
+                          'VALUES (?, ?, ?, ?, ?)',
+                          (stat.st_dev, stat.st_ino, stat.st_size, stat.st_mtime_ns, digest))
+
+    def cached(self, stat: os.stat_result) -> Optional[str]:
+        """Return the cached digest of a file, or None if it changed since or was never hashed."""
+        row = self.conn.execute('SELECT sha1 FROM checksums WHERE device = ? AND inode = ? AND size = ? '
+                                'AND mtime_ns = ?', (stat.st_dev, stat.st_ino, stat.st_size,
+                                                     stat.st_mtime_ns)).fetchone()
+        return row[0] if row else None
+
+    def checksums(self, paths: Iterable[Path], workers: int = DEFAULT_HASH_WORKERS) -> Tuple[Dict[Path, str], int]:
+        """Return the digest of each file and how many had to be hashed; cache misses are hashed in parallel."""
+        digests: Dict[Path, str] = {}
+        misses = []
+        for path in paths:
+            stat = path.stat()
+            digest = self.cached(stat)
+            if digest is None:
+                misses.append((path, stat))
+            else:
+                digests[path] = digest
+
+        with ThreadPoolExecutor(max_workers=max(1, workers)) as pool:
+            for (path, stat), digest in zip(misses, pool.map(hash_file, (path for path, _ in misses))):
+                digests[path] = digest
+                self.cache(stat, digest)
+        self.conn.commit()
+        return digests, len(misses)
+
+    def digest(self, path: str) -> Optional[str]:
+        row = self.conn.execute('SELECT sha1 FROM outputs WHERE path = ?', (path,)).fetchone()
+        return row[0] if row else None
+
+    def set_asset_ids(self, assets: Iterable[Tuple[str, str]]) -> None:
+        """Store the Immich asset id of uploaded outputs."""
+        self.conn.executemany('UPDATE outputs SET asset_id = ? WHERE path = ?',
+                              [(asset_id, path) for path, asset_id in assets])
+        self.conn.commit()
+
+    def mark_deleted(self, paths: Iterable[str]) -> None:
+        """Note outputs deleted from processed/ once uploaded; they are only checked in Immich."""
+        self.conn.executemany('UPDATE outputs SET deleted = 1 WHERE path = ?', [(path,) for path in paths])
+        self.conn.commit()
+
+    def remove(self, paths: Iterable[str]) -> None:
+        """Forget outputs that were taken out of processed/."""
+        self.conn.executemany('DELETE FROM outputs WHERE path = ?', [(path,) for path in paths])
+        self.conn.commit()
+
+    def entries(self) -> List[Tuple[str, int, str]]:
+        """Return (path, size, digest) of every output still in processed/."""
+        return self.conn.execute('SELECT path, size, sha1 FROM outputs WHERE NOT deleted ORDER BY path').fetchall()
+
+    def deleted_count(self) -> int:
+        """Return how many outputs were deleted once uploaded."""
+        return self.conn.execute('SELECT COUNT(*) FROM outputs WHERE deleted').fetchone()[0]
+
+    def assets(self) -> List[Tuple[str, str, Optional[str]]]:
+        """Return (path, digest, asset id) of every output, with None for outputs never uploaded."""
+        return self.conn.execute('SELECT path, sha1, asset_id FROM outputs ORDER BY path').fetchall()
+
+
+class VerifyReport:
+    """Outcome of a verification run."""
+
+    def __init__(self):
+        self.checked = 0
+        self.ok = 0
+        self.bytes_hashed = 0
+        self.seconds = 0.0
+        self.problems: List[Tuple[str, str]] = []
+        # Outputs not checked on disk because they were deleted once uploaded
+        self.deleted = 0
+        # Files on disk the manifest does not know, or outputs never uploaded
+        self.untracked: List[str] = []
+
+    def counts(self) -> Dict[str, int]:
+        counts: Dict[str, int] = {}
+        for _, problem in self.problems:
+            counts[problem] = counts.get(problem, 0) + 1
+        return counts
+
+
+def verify_tree(manifest: IntegrityManifest, root: Path, workers: int = DEFAULT_HASH_WORKERS) -> VerifyReport:
+    """Check every output under root against the manifest: stat all of them, re-hash those of the right size."""
+    report = VerifyReport()
+    started = time.monotonic()
+    root = Path(root)
+    report.deleted = manifest.deleted_count()
+
+    to_hash = []
+    known = set()
+    for path, size, digest in manifest.entries():
+        known.add(path)
+        report.checked += 1
+        try:
+            actual_size = (root / path).stat().st_size
+        except FileNotFoundError:
+            report.problems.append((path, PROBLEM_MISSING))
+            continue
+        if actual_size != size:
+            report.problems.append((path, PROBLEM_SIZE))
+            continue
+        to_hash.append((path, size, digest))
+
+    def check(entry: Tuple[str, int, str]) -> Optional[str]:
+        path, _, digest = entry
+        try:
+            return None if hash_file(root / path) == digest else PROBLEM_HASH
+        except OSError:
+            return PROBLEM_UNREADABLE
+
+    with ThreadPoolExecutor(max_workers=max(1, workers)) as pool:
+        for (path, size, _), problem in zip(to_hash, pool.map(check, to_hash)):
+            report.bytes_hashed += size
+            if problem is None:
+                report.ok += 1
+            else:
+                report.problems.append((path, problem))
+
+    for directory, _, names in os.walk(root):
+        for name in names:
+            path = (Path(directory) / name).relative_to(root).as_posix()
+            if path not in known:
+                report.untracked.append(path)
+
+    report.seconds = time.monotonic() - started
+    return report
+
+
+def verify_assets(manifest: IntegrityManifest,
+                  fetch_checksums: Callable[[List[str]], Dict[str, Optional[str]]]) -> VerifyReport:
+    """Check uploaded assets against the manifest by the checksums Immich reports.
+
+    fetch_checksums maps asset ids to Immich's base64 checksums, with None for assets Immich does not have.
+    """
+    report = VerifyReport()
+    started = time.monotonic()
+    uploaded = []
+    for path, digest, asset_id in manifest.assets():
+        if asset_id is None:
+            report.untracked.append(path)
+        else:
+            uploaded.append((path, digest, asset_id))
+
+    checksums = fetch_checksums(list(dict.fromkeys(asset_id for _, _, asset_id in uploaded)))
+    for path, digest, asset_id in uploaded:
+        report.checked += 1
+        checksum = checksums.get(asset_id)
+        if checksum is None:
+            report.problems.append((path, PROBLEM_ASSET_MISSING))
+        elif checksum != immich_checksum(digest):
+            report.problems.append((path, PROBLEM_CHECKSUM))
+        else:
+            report.ok += 1
+
+    report.seconds = time.monotonic() - started
+    return report
@@ -0,0 +1,216 @@
+"""
+Persistent SQLite job manifest for resumable takeout imports.
+
+Every zip member the importer touches is recorded by its identity (archive,
+path, size, CRC) together with its state, so an interrupted run can be resumed
+without re-extracting archives or reprocessing finished files. The manifest is
+also the source of truth for the statistics printed at the end of a run.
+"""
+
+import sqlite3
+import time
+import zipfile
+from pathlib import Path
+from typing import Dict, Iterable, NamedTuple, Optional
+
+# Member states, in the order a member normally moves through them
+STATE_EXTRACTED = 'extracted'
+STATE_EMBEDDED = 'embedded'
+STATE_UPLOADED = 'uploaded'
+STATE_FAILED = 'failed'
+STATE_SKIPPED = 'skipped'
+
+# States a resumed run does not need to process again
+COMPLETED_STATES = (STATE_EMBEDDED, STATE_UPLOADED, STATE_SKIPPED)
+
+# Member updates buffered before a commit
+COMMIT_INTERVAL = 500
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS members (
+    archive TEXT NOT NULL,
+    path TEXT NOT NULL,
+    size INTEGER NOT NULL,
+    crc INTEGER NOT NULL,
+    album TEXT,
+    kind TEXT,
+    state TEXT NOT NULL,
+    linked_to TEXT,
+    bytes_saved INTEGER NOT NULL DEFAULT 0,
+    updated REAL NOT NULL,
+    PRIMARY KEY (archive, path, size, crc)
+);
+CREATE INDEX IF NOT EXISTS members_album_state ON members (album, state);
+CREATE TABLE IF NOT EXISTS archives (
+    name TEXT PRIMARY KEY,
+    size INTEGER NOT NULL,
+    mtime REAL NOT NULL,
+    state TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS albums (
+    name TEXT PRIMARY KEY
+);
+CREATE TABLE IF NOT EXISTS errors (
+    stage TEXT NOT NULL,
+    detail TEXT,
+    created REAL NOT NULL
+);
+"""
+
+
+class MemberKey(NamedTuple):
+    """Identity of a zip member across runs."""
+    archive: str
+    path: str
+    size: int
+    crc: int
+
+    @classmethod
+    def from_zipinfo(cls, archive: Path, info: zipfile.ZipInfo) -> 'MemberKey':
+        return cls(Path(archive).name, info.filename, info.file_size, info.CRC)
+
+
+class JobManifest:
+    """SQLite-backed record of every member's progress through an import."""
+
+    def __init__(self, path: Path, resume: bool = False):
+        self.path = Path(path)
+        if not resume:
+            for stale in (self.path, self.path.with_name(self.path.name + '-wal'),
+                          self.path.with_name(self.path.name + '-shm')):
+                stale.unlink(missing_ok=True)
+
+        self.conn = sqlite3.connect(str(self.path))
+        self.conn.execute('PRAGMA journal_mode=WAL')
+        self.conn.execute('PRAGMA synchronous=NORMAL')
+        self.conn.executescript(SCHEMA)
+
+        # Run-level errors only describe the current attempt
+        self.conn.execute('DELETE FROM errors')
+        self.conn.commit()
+
+        # Completed members are kept in memory so resume checks are O(1)
+        placeholders = ','.join('?' * len(COMPLETED_STATES))
+        rows = self.conn.execute(
+            f'SELECT archive, path, size, crc FROM members WHERE state IN ({placeholders})', COMPLETED_STATES)
+        self._done = {MemberKey(*row) for row in rows}
+        self._uncommitted = 0
+
+    def _touch(self) -> None:
+        """Commit once enough updates have been buffered."""
+        self._uncommitted += 1
+        if self._uncommitted >= COMMIT_INTERVAL:
+            self.commit()
+
+    def commit(self) -> None:
+        self.conn.commit()
+        self._uncommitted = 0
+
+    def close(self) -> None:
+        self.commit()
+        self.conn.close()
+
+    def is_done(self, key: MemberKey) -> bool:
+        """Return True if a previous run already finished this member."""
+        return key in self._done
+
+    def record(self, key: MemberKey, state: str, album: Optional[str] = None, kind: Optional[str] = None,
+               linked_to: Optional[str] = None, bytes_saved: int = 0) -> None:
+        """Set a member's state, keeping any album or kind recorded earlier.
+
+        linked_to names the processed file a duplicate was linked to, relative to processed/.
+        """
+        self.conn.execute(
+            'INSERT INTO members (archive, path, size, crc, album, kind, state, linked_to, bytes_saved, updated) '
+            'VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?) '
+            'ON CONFLICT (archive, path, size, crc) DO UPDATE SET '
+            'album = COALESCE(excluded.album, album), kind = COALESCE(excluded.kind, kind), '
+            'state = excluded.state, linked_to = excluded.linked_to, bytes_saved = excluded.bytes_saved, '
+            'updated = excluded.updated',
+            (*key, album, kind, state, linked_to, bytes_saved, time.time()))
+        if state in COMPLETED_STATES:
+            self._done.add(key)
+        else:
+            self._done.discard(key)
+        self._touch()
+
+    def record_extracted(self, archive: Path, infos: Iterable[zipfile.ZipInfo]) -> None:
+        """Record an archive's members as extracted and mark the archive complete."""
+        now = time.time()
+        rows = [(*MemberKey.from_zipinfo(archive, info), STATE_EXTRACTED, now)
+                for info in infos if not info.is_dir()]
+        # Members a previous run already processed keep their state
+        self.conn.executemany(
+            'INSERT OR IGNORE INTO members (archive, path, size, crc, state, updated) '
+            'VALUES (?, ?, ?, ?, ?, ?)', rows)
+        stat = Path(archive).stat()
+        self.conn.execute(
+            'INSERT OR REPLACE INTO archives (name, size, mtime, state) VALUES (?, ?, ?, ?)',
+            (Path(archive).name, stat.st_size, stat.st_mtime, STATE_EXTRACTED))
+        self.commit()
+
+    def archive_extracted(self, archive: Path) -> bool:
+        """Return True if this exact archive was fully extracted by an earlier run."""
+        stat = Path(archive).stat()
+        row = self.conn.execute(
+            'SELECT size, mtime, state FROM archives WHERE name = ?', (Path(archive).name,)).fetchone()
+        return row is not None and row == (stat.st_size, stat.st_mtime, STATE_EXTRACTED)
+
+    def reset_archives(self) -> None:
+        """Forget extracted archives, e.g. after the extraction tree was removed."""
+        self.conn.execute('DELETE FROM archives')
+        self.commit()
+
+    def record_album(self, name: str) -> None:
+        self.conn.execute('INSERT OR IGNORE INTO albums (name) VALUES (?)', (name,))
+        self._touch()
+
+    def record_error(self, stage: str, detail: str) -> None:
+        """Record an error that is not tied to a single member."""
+        self.conn.execute('INSERT INTO errors (stage, detail, created) VALUES (?, ?, ?)',
+                          (stage, detail, time.time()))
+        self._touch()
+
+    def album_uploaded(self, album: str) -> bool:
+        """Return True if every processed member of an album has been uploaded."""
+        pending = self.conn.execute(
+            'SELECT COUNT(*) FROM members WHERE album = ? AND state = ?', (album, STATE_EMBEDDED)).fetchone()[0]
+        uploaded = self.conn.execute(
+            'SELECT COUNT(*) FROM members WHERE album = ? AND state = ?', (album, STATE_UPLOADED)).fetchone()[0]
+        return pending == 0 and uploaded > 0
+
+    def mark_album_uploaded(self, album: str) -> None:
+        self.conn.execute(
+            'UPDATE members SET state = ?, updated = ? WHERE album = ? AND state = ?',
+            (STATE_UPLOADED, time.time(), album, STATE_EMBEDDED))
+        self.commit()
+
+    def mark_uploaded(self, keys: Iterable[MemberKey]) -> None:
+        """Mark individual members as uploaded."""
+        now = time.time()
+        self.conn.executemany(
+            'UPDATE members SET state = ?, updated = ? WHERE archive = ? AND path = ? AND size = ? AND crc = ?',
+            ((STATE_UPLOADED, now, *key) for key in keys))
+        self.commit()
+
+    def stats(self) -> Dict[str, int]:
+        """Return the import statistics in the same shape as TakeoutProcessor.stats."""
+        self.commit()
+        stats = dict.fromkeys(('total_files', 'processed_images', 'processed_videos', 'skipped_files', 'errors'), 0)
+        rows = self.conn.execute('SELECT state, kind, COUNT(*) FROM members GROUP BY state, kind')
+        for state, kind, count in rows:
+            if state == STATE_EXTRACTED:
+                continue
+            stats['total_files'] += count
+            if state in (STATE_EMBEDDED, STATE_UPLOADED) and kind in ('image', 'video'):
+                stats[f'processed_{kind}s'] += count
+            elif state == STATE_SKIPPED:
+                stats['skipped_files'] += count
+            elif state == STATE_FAILED:
+                stats['errors'] += count
+
+        stats['errors'] += self.conn.execute('SELECT COUNT(*) FROM errors').fetchone()[0]
+        stats['albums_created'] = self.conn.execute('SELECT COUNT(*) FROM albums').fetchone()[0]
+        stats['duplicates'], stats['bytes_saved'] = self.conn.execute(
+            'SELECT COUNT(linked_to), COALESCE(SUM(bytes_saved), 0) FROM members').fetchone()
+        return stats
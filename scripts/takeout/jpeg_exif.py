@@ -0,0 +1,87 @@
+"""
+Single-pass JPEG EXIF splicing for the takeout importer.
+
+Only the marker segments in front of the scan data are read into memory. The
+new APP1/EXIF segment is merged into them the same way piexif.insert does, and
+the compressed scan data is then copied through in large chunks, so each image
+is written exactly once and peak memory does not grow with image size.
+"""
+
+import shutil
+import struct
+from typing import BinaryIO, List, Optional
+
+SOI_MARKER = b"\xff\xd8"
+SOS_MARKER = b"\xff\xda"
+APP0_MARKER = b"\xff\xe0"
+APP1_MARKER = b"\xff\xe1"
+EXIF_HEADER = b"Exif\x00\x00"
+
+COPY_CHUNK_SIZE = 1024 * 1024
+
+
+class JpegFormatError(ValueError):
+    """Raised when a stream is not a JPEG this module can splice."""
+
+
+def read_header_segments(source: BinaryIO) -> List[bytes]:
+    """Read the segments in front of the scan data.
+
+    The first element is the SOI marker and the last is the SOS marker, which
+    has already been consumed from source; the rest of the stream is scan data.
+    """
+    if source.read(2) != SOI_MARKER:
+        raise JpegFormatError("Given data isn't JPEG.")
+
+    segments = [SOI_MARKER]
+    while True:
+        marker = source.read(2)
+        if marker == SOS_MARKER:
+            segments.append(marker)
+            return segments
+
+        length_bytes = source.read(2)
+        if len(marker) < 2 or len(length_bytes) < 2:
+            raise JpegFormatError("Wrong JPEG data.")
+
+        length = struct.unpack(">H", length_bytes)[0]
+        body = source.read(length - 2)
+        if len(body) < length - 2:
+            raise JpegFormatError("Wrong JPEG data.")
+        segments.append(marker + length_bytes + body)
+
+
+def find_exif(segments: List[bytes]) -> Optional[bytes]:
+    """Return the EXIF payload (starting with the Exif header) of the first APP1/EXIF segment."""
+    for segment in segments:
+        if segment[0:2] == APP1_MARKER and segment[4:10] == EXIF_HEADER:
+            return segment[4:]
+    return None
+
+
+def merge_exif(segments: List[bytes], exif_bytes: bytes) -> List[bytes]:
+    """Return segments with exif_bytes in place of the existing APP0/APP1 segment.
+
+    Mirrors piexif.insert so the spliced output is byte-identical to it.
+    """
+    if exif_bytes[0:6] != EXIF_HEADER:
+        raise ValueError("Given data is not exif data")
+
+    exif_segment = APP1_MARKER + struct.pack(">H", len(exif_bytes) + 2) + exif_bytes
+    merged = list(segments)
+    if merged[1][0:2] == APP0_MARKER and merged[2][0:2] == APP1_MARKER and merged[2][4:10] == EXIF_HEADER:
+        merged[2] = exif_segment
+        merged.pop(1)
+    elif merged[1][0:2] == APP0_MARKER:
+        merged[1] = exif_segment
+    elif merged[1][0:2] == APP1_MARKER and merged[1][4:10] == EXIF_HEADER:
+        merged[1] = exif_segment
+    else:
+        merged.insert(1, exif_segment)
+    return merged
+
+
+def write_spliced(segments: List[bytes], exif_bytes: bytes, source: BinaryIO, output: BinaryIO) -> None:
+    """Write the header with exif_bytes spliced in, then copy the rest of source through."""
+    output.write(b"".join(merge_exif(segments, exif_bytes)))
+    shutil.copyfileobj(source, output, COPY_CHUNK_SIZE)
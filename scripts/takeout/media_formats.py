@@ -0,0 +1,99 @@
+"""
+Registry of the media formats the takeout importer processes.
+
+Each FormatHandler covers a family of extensions. It names the processor
+methods that handle an extracted file and a zip member, and the modules
+those methods need: piexif for EXIF images, ffmpeg-python for videos, and
+pillow-heif so Pillow can decode HEIC. The modules are imported the first
+time a file of the format is processed. So `--help`, `--plan` and pool
+workers that only ever see JPEGs never import ffmpeg-python or Pillow.
+
+A new format is one register() call. The processor only asks handler_for()
+which handler a file name has.
+"""
+
+import importlib
+import threading
+from pathlib import Path
+from typing import Callable, Dict, Optional, Sequence, Set
+
+KIND_IMAGE = 'image'
+KIND_VIDEO = 'video'
+
+
+class FormatHandler:
+    """How files of a family of extensions are processed, and what that needs imported."""
+
+    def __init__(self, name: str, kind: str, extensions: Sequence[str], file_method: str, member_method: str,
+                 modules: Sequence[str] = (), plugins: Sequence[str] = (),
+                 on_plugin: Optional[Callable] = None):
+        self.name = name
+        self.kind = kind
+        self.extensions = tuple(extension.lower() for extension in extensions)
+        # Names of TakeoutProcessor methods: (path, metadata, output) and (zip_ref, info, metadata, output)
+        self.file_method = file_method
+        self.member_method = member_method
+        # Modules the methods import; plugins are optional and handed to on_plugin once imported
+        self.modules = tuple(modules)
+        self.plugins = tuple(plugins)
+        self.on_plugin = on_plugin
+        self._loaded = False
+        self._lock = threading.Lock()
+
+    def load(self) -> 'FormatHandler':
+        """Import the modules this format needs, once per process; raises ImportError if one is missing."""
+        if self._loaded:
+            return self
+        with self._lock:
+            if not self._loaded:
+                for module in self.modules:
+                    importlib.import_module(module)
+                for plugin in self.plugins:
+                    try:
+                        module = importlib.import_module(plugin)
+                    except ImportError:
+                        continue
+                    if self.on_plugin is not None:
+                        self.on_plugin(module)
+                self._loaded = True
+        return self
+
+    def process_file(self, processor, path: Path, metadata: Dict, output_path: Path) -> bool:
+        return getattr(processor, self.file_method)(path, metadata, output_path)
+
+    def process_member(self, processor, zip_ref, info, metadata: Dict, output_path: Path) -> bool:
+        return getattr(processor, self.member_method)(zip_ref, info, metadata, output_path)
+
+
+_handlers: Dict[str, FormatHandler] = {}
+
+
+def register(handler: FormatHandler) -> FormatHandler:
+    """Add a format, replacing whatever handled its extensions before."""
+    for extension in handler.extensions:
+        _handlers[extension] = handler
+    return handler
+
+
+def handler_for(name: str) -> Optional[FormatHandler]:
+    """Return the handler for a file name's extension, or None if the format is not supported."""
+    return _handlers.get(Path(name).suffix.lower())
+
+
+def extensions(kind: Optional[str] = None) -> Set[str]:
+    """Return the registered extensions, optionally only those of one kind."""
+    return {extension for extension, handler in _handlers.items() if kind is None or handler.kind == kind}
+
+
+def register_heif_opener(pillow_heif) -> None:
+    pillow_heif.register_heif_opener()
+
+
+register(FormatHandler('jpeg', KIND_IMAGE, ('.jpg', '.jpeg'), 'process_image_metadata', 'process_jpeg_member',
+                       modules=('piexif',)))
+register(FormatHandler('image', KIND_IMAGE, ('.png', '.webp', '.tiff', '.bmp'), 'process_image_metadata',
+                       'process_image_member', modules=('piexif',)))
+register(FormatHandler('heic', KIND_IMAGE, ('.heic',), 'process_image_metadata', 'process_image_member',
+                       modules=('piexif',), plugins=('pillow_heif',), on_plugin=register_heif_opener))
+register(FormatHandler('video', KIND_VIDEO, ('.mp4', '.mov', '.avi', '.mkv', '.m4v', '.3gp', '.webm'),
+                       'process_video_metadata', 'process_video_member', modules=('ffmpeg',)))
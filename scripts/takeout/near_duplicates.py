@@ -0,0 +1,245 @@
+"""
+Near-duplicate detection for the takeout importer.
+
+Takeout exports IMG_1234.jpg next to IMG_1234-edited.jpg, and the same shot
+uploaded twice at different JPEG qualities. The bytes differ, so neither
+--dedup nor the upload check treats them as the same photo. This pass
+compares what the images look like instead.
+
+Each image gets a 128-bit gradient hash: whether brightness rises between
+neighbouring pixels of a 9x8 and an 8x9 grayscale thumbnail. The thumbnail
+comes from a reduced decode. JPEG draft mode decodes at 1/8 scale, so a
+12 MP photo is never decoded in full. Hashing runs on a process pool.
+Outputs with the same bytes (the same photo in several albums) are hashed
+once and reported as one image.
+
+Matching does not compare all pairs. The hashes are split into
+max_distance + 1 bands. Two hashes that differ in at most max_distance bits
+must agree exactly on at least one band (pigeonhole), so only hashes
+sharing a band value are compared. Python ints are the bit vectors, and
+popcount() of their XOR gives the Hamming distance; it is int.bit_count()
+where Python has it (3.10+) and counts bin()'s ones before that. 100k images take a few seconds
+to match.
+
+Flat or dark images all hash near 0 and land in the same bucket of every
+band, which would make matching quadratic again. A bucket with more than
+MAX_BUCKET_SIZE hashes carries little information, so it is skipped; images
+alike only there are not grouped. numpy is not a dependency of the importer,
+so it is not used here.
+"""
+
+import itertools
+import time
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple
+
+import media_formats
+from sidecar_index import strip_edited_suffix
+
+# Gradient grid per direction; the hash has 2 * HASH_SIZE ** 2 bits
+HASH_SIZE = 8
+HASH_BITS = 2 * HASH_SIZE * HASH_SIZE
+
+# Most differing hash bits for two images to count as near duplicates
+DEFAULT_MAX_DISTANCE = 8
+
+# What --near-duplicates does with a group: only report it, or keep only its originals or its edits
+POLICY_REPORT = 'report'
+POLICY_KEEP_ORIGINAL = 'keep-original'
+POLICY_KEEP_EDIT = 'keep-edit'
+POLICIES = (POLICY_REPORT, POLICY_KEEP_ORIGINAL, POLICY_KEEP_EDIT)
+
+# Images hashed per task sent to a pool worker
+HASH_BATCH_SIZE = 64
+
+# Hashes sharing one band value beyond which the bucket is not compared pairwise
+MAX_BUCKET_SIZE = 64
+
+
+def _count_ones(value: int) -> int:
+    return bin(value).count('1')
+
+
+# Number of set bits of a non-negative int
+popcount = getattr(int, 'bit_count', _count_ones)
+
+
+def image_hash(path: Path) -> Optional[int]:
+    """Return the gradient hash of an image, decoded at reduced size; None if it can't be decoded."""
+    handler = media_formats.handler_for(path.name)
+    try:
+        if handler is not None:
+            # Registers the HEIC opener where pillow-heif is installed
+            handler.load()
+        from PIL import Image, ImageOps
+        with Image.open(path) as image:
+            image.draft('L', (HASH_SIZE * 4, HASH_SIZE * 4))
+            gray = ImageOps.exif_transpose(image).convert('L')
+        rows = gray.resize((HASH_SIZE + 1, HASH_SIZE), Image.Resampling.BOX).tobytes()
+        columns = gray.resize((HASH_SIZE, HASH_SIZE + 1), Image.Resampling.BOX).tobytes()
+    except Exception:
+        return None
+
+    value = 0
+    for y in range(HASH_SIZE):
+        for x in range(HASH_SIZE):
+            left = y * (HASH_SIZE + 1) + x
+            value = (value << 1) | (rows[left + 1] > rows[left])
+    for y in range(HASH_SIZE):
+        for x in range(HASH_SIZE):
+            value = (value << 1) | (columns[(y + 1) * HASH_SIZE + x] > columns[y * HASH_SIZE + x])
+    return value
+
+
+def _hash_batch(paths: Sequence[Path]) -> List[Optional[int]]:
+    return [image_hash(path) for path in paths]
+
+
+def hash_images(paths: Sequence[Path], workers: int = 1) -> List[Optional[int]]:
+    """Return the hash of every image, in order, computed on a process pool with several workers."""
+    if workers <= 1 or len(paths) <= HASH_BATCH_SIZE:
+        return _hash_batch(paths)
+    batches = [paths[start:start + HASH_BATCH_SIZE] for start in range(0, len(paths), HASH_BATCH_SIZE)]
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        return [value for batch in pool.map(_hash_batch, batches) for value in batch]
+
+
+def bands(max_distance: int, bits: int = HASH_BITS) -> List[Tuple[int, int]]:
+    """Split a hash into max_distance + 1 bands, as (shift, mask) pairs."""
+    count = min(max_distance + 1, bits)
+    result = []
+    start = 0
+    for index in range(count):
+        width = bits // count + (index < bits % count)
+        result.append((start, (1 << width) - 1))
+        start += width
+    return result
+
+
+def near_pairs(hashes: Sequence[Optional[int]], max_distance: int = DEFAULT_MAX_DISTANCE,
+               max_bucket: int = MAX_BUCKET_SIZE) -> Dict[Tuple[int, int], int]:
+    """Return the Hamming distance of every pair of hashes at most max_distance apart, keyed by index pair.
+
+    Pairs that only share buckets of more than max_bucket hashes are left out.
+    """
+    pairs: Dict[Tuple[int, int], int] = {}
+    for shift, mask in bands(max_distance):
+        buckets: Dict[int, List[int]] = {}
+        for index, value in enumerate(hashes):
+            if value is not None:
+                buckets.setdefault((value >> shift) & mask, []).append(index)
+        for bucket in buckets.values():
+            if len(bucket) > max_bucket:
+                continue
+            for first, second in itertools.combinations(bucket, 2):
+                if (first, second) in pairs:
+                    continue
+                distance = popcount(hashes[first] ^ hashes[second])
+                if distance <= max_distance:
+                    pairs[first, second] = distance
+    return pairs
+
+
+def group_pairs(count: int, pairs: Iterable[Tuple[int, int]]) -> List[List[int]]:
+    """Return the connected groups of at least two indices, each sorted."""
+    parent = list(range(count))
+
+    def root(index: int) -> int:
+        while parent[index] != index:
+            parent[index] = parent[parent[index]]
+            index = parent[index]
+        return index
+
+    for first, second in pairs:
+        parent[root(second)] = root(first)
+    groups: Dict[int, List[int]] = {}
+    for index in range(count):
+        groups.setdefault(root(index), []).append(index)
+    return [members for members in groups.values() if len(members) > 1]
+
+
+def is_edit(name: str) -> bool:
+    """Return True for Google's edited copy of a photo, e.g. IMG_1234-edited.jpg."""
+    return strip_edited_suffix(name) is not None
+
+
+def edited_from(edit: Dict, original: Dict) -> bool:
+    """Return True if an edit entry is named after an original entry, e.g. IMG_1234-edited.jpg and IMG_1234.jpg."""
+    originals = {Path(path).name for path in [original['path']] + original['copies']}
+    return any(strip_edited_suffix(Path(path).name) in originals for path in [edit['path']] + edit['copies'])
+
+
+class NearDuplicateReport:
+    """Groups of images that look alike, and what the policy removed from each."""
+
+    def __init__(self, max_distance: int, policy: str = POLICY_REPORT):
+        self.max_distance = max_distance
+        self.policy = policy
+        self.images = 0
+        self.undecodable: List[str] = []
+        self.hash_seconds = 0.0
+        self.match_seconds = 0.0
+        # Per group: every image as (path, other paths with the same bytes, is an edit), and pair distances
+        self.groups: List[Dict] = []
+
+    def removed(self) -> List[str]:
+        """Paths the policy takes out of the import."""
+        return [path for group in self.groups for path in group['removed']]
+
+    def to_dict(self) -> Dict:
+        return {
+            'max_distance': self.max_distance,
+            'policy': self.policy,
+            'images': self.images,
+            'undecodable': self.undecodable,
+            'seconds': {'hash': round(self.hash_seconds, 3), 'match': round(self.match_seconds, 3)},
+            'groups': self.groups,
+        }
+
+
+def find_near_duplicates(images: Sequence[Tuple[str, Sequence[str]]], root: Path, workers: int = 1,
+                         max_distance: int = DEFAULT_MAX_DISTANCE,
+                         policy: str = POLICY_REPORT) -> NearDuplicateReport:
+    """Group images that look alike and choose which to remove under policy.
+
+    images holds one entry per distinct content: a path relative to root and the paths of
+    other outputs with the same bytes. A keep policy only removes an edit or an original
+    when the edit is named after that original. Groups join look-alikes transitively, so
+    any other file in them, like a re-save or a similar shot, is only reported.
+    """
+    report = NearDuplicateReport(max_distance, policy)
+    report.images = len(images)
+
+    started = time.monotonic()
+    hashes = hash_images([Path(root) / path for path, _ in images], workers)
+    report.hash_seconds = time.monotonic() - started
+    report.undecodable = [path for (path, _), value in zip(images, hashes) if value is None]
+
+    started = time.monotonic()
+    pairs = near_pairs(hashes, max_distance)
+    groups = group_pairs(len(images), pairs)
+    report.match_seconds = time.monotonic() - started
+
+    group_of = {index: number for number, members in enumerate(groups) for index in members}
+    distances: List[List] = [[] for _ in groups]
+    for (first, second), distance in sorted(pairs.items()):
+        distances[group_of[first]].append([images[first][0], images[second][0], distance])
+
+    for number, members in enumerate(groups):
+        files = [{'path': images[index][0], 'copies': list(images[index][1]),
+                  'edit': is_edit(Path(images[index][0]).name)} for index in members]
+        edits = [entry for entry in files if entry['edit']]
+        originals = [entry for entry in files if not entry['edit']]
+        matched = [(edit, original) for edit in edits for original in originals if edited_from(edit, original)]
+        removed: List[Dict] = []
+        if policy == POLICY_KEEP_ORIGINAL:
+            removed = [entry for entry in edits if any(edit is entry for edit, _ in matched)]
+        elif policy == POLICY_KEEP_EDIT:
+            removed = [entry for entry in originals if any(original is entry for _, original in matched)]
+        report.groups.append({
+            'files': files,
+            'distances': distances[number],
+            'removed': [path for entry in removed for path in [entry['path']] + entry['copies']],
+        })
+    return report
@@ -0,0 +1,202 @@
+"""
+Watch mode for the takeout importer: import each part as soon as it has downloaded.
+
+A large export arrives as dozens of 50 GB takeout-*.zip parts that take hours
+to download one after another. With --watch the importer does not wait for
+the last of them. A DownloadTracker polls the takeout directory, and a part
+counts as finished once its size and mtime held still for the settle time
+and its end of central directory record is intact. The record is the last
+thing a zip writer or a download writes, so a part still growing or cut
+short fails the check even when its size happens to stand still.
+
+Every time parts finish, PartWatcher runs an import pass over all finished
+parts. The checkpoint manifest skips whatever earlier passes completed, so
+each pass only processes the new parts. A sidecar can sit in a different
+part than its media. Media without a sidecar are therefore deferred while
+more parts may come, and imported in a last pass once no part has changed
+for the idle time. The watcher then keeps polling for the next export, so
+it can run as a launchd job.
+"""
+
+import logging
+import struct
+import threading
+import time
+from pathlib import Path
+from typing import Callable, Dict, List, Optional, Set, Tuple
+
+logger = logging.getLogger(__name__)
+
+PART_PATTERN = 'takeout-*.zip'
+
+# Seconds a part's size and mtime must hold still before it is checked
+DEFAULT_SETTLE_SECONDS = 60.0
+
+# Seconds without a part changing before media still missing a sidecar are imported without one
+DEFAULT_IDLE_SECONDS = 3600.0
+
+# Seconds between polls of the takeout directory
+POLL_INTERVAL = 15.0
+
+END_RECORD_SIGNATURE = b'PK\x05\x06'
+END_RECORD_SIZE = 22
+MAX_COMMENT_SIZE = 0xFFFF
+ZIP64_LOCATOR_SIGNATURE = b'PK\x06\x07'
+ZIP64_LOCATOR_SIZE = 20
+ZIP64_END_RECORD_SIGNATURE = b'PK\x06\x06'
+ZIP64_END_RECORD_SIZE = 56
+CENTRAL_HEADER_SIGNATURE = b'PK\x01\x02'
+
+
+def end_record_valid(path: Path) -> bool:
+    """Return True if a zip ends with an end of central directory record pointing at its central directory."""
+    try:
+        with open(path, 'rb') as archive:
+            size = archive.seek(0, 2)
+            if size < END_RECORD_SIZE:
+                return False
+            tail_size = min(size, END_RECORD_SIZE + MAX_COMMENT_SIZE)
+            archive.seek(size - tail_size)
+            tail = archive.read(tail_size)
+
+            # The record is followed by its comment and nothing else
+            position = tail.rfind(END_RECORD_SIGNATURE)
+            while position >= 0:
+                if position + END_RECORD_SIZE <= tail_size:
+                    entries, directory_size, directory_offset, comment_size = struct.unpack(
+                        '<HIIH', tail[position + 10:position + END_RECORD_SIZE])
+                    if position + END_RECORD_SIZE + comment_size == tail_size:
+                        break
+                position = tail.rfind(END_RECORD_SIGNATURE, 0, position)
+            if position < 0:
+                return False
+            record_offset = size - tail_size + position
+
+            if entries == 0xFFFF or 0xFFFFFFFF in (directory_size, directory_offset):
+                # Zip64: the real counts are in a record found through the locator just before this one
+                if record_offset < ZIP64_LOCATOR_SIZE:
+                    return False
+                archive.seek(record_offset - ZIP64_LOCATOR_SIZE)
+                locator = archive.read(ZIP64_LOCATOR_SIZE)
+                if locator[:4] != ZIP64_LOCATOR_SIGNATURE:
+                    return False
+                record_offset = struct.unpack('<Q', locator[8:16])[0]
+                archive.seek(record_offset)
+                record = archive.read(ZIP64_END_RECORD_SIZE)
+                if len(record) < ZIP64_END_RECORD_SIZE or record[:4] != ZIP64_END_RECORD_SIGNATURE:
+                    return False
+                entries, directory_size, directory_offset = struct.unpack('<QQQ', record[32:56])
+
+            if directory_offset + directory_size > record_offset:
+                return False
+            if entries == 0:
+                return directory_size == 0
+            archive.seek(directory_offset)
+            return archive.read(4) == CENTRAL_HEADER_SIGNATURE
+    except OSError:
+        return False
+
+
+class DownloadTracker:
+    """Polls a directory for takeout parts and reports each once it has finished downloading."""
+
+    def __init__(self, directory: Path, settle_seconds: float = DEFAULT_SETTLE_SECONDS,
+                 pattern: str = PART_PATTERN, clock: Callable[[], float] = time.monotonic):
+        self.directory = Path(directory)
+        self.settle_seconds = settle_seconds
+        self.pattern = pattern
+        self.clock = clock
+        # Size, mtime and since when of every part not finished yet
+        self._seen: Dict[Path, Tuple[int, int, float]] = {}
+        self._invalid: Set[Path] = set()
+        self.finished: Set[Path] = set()
+        # When a part last grew, appeared or finished
+        self.last_change = clock()
+
+    def poll(self) -> List[Path]:
+        """Return the parts that finished downloading since the last poll."""
+        now = self.clock()
+        finished = []
+        for path in sorted(self.directory.glob(self.pattern)):
+            if path in self.finished:
+                continue
+            try:
+                stat = path.stat()
+            except FileNotFoundError:
+                continue
+            state = (stat.st_size, stat.st_mtime_ns)
+            seen = self._seen.get(path)
+            if seen is None or seen[:2] != state:
+                self._seen[path] = (*state, now)
+                self._invalid.discard(path)
+                self.last_change = now
+                continue
+            if now - seen[2] < self.settle_seconds:
+                continue
+            if not end_record_valid(path):
+                if path not in self._invalid:
+                    logger.warning(f"{path.name} stopped growing but has no valid end of central directory; "
+                                   f"waiting for it to change")
+                    self._invalid.add(path)
+                continue
+            del self._seen[path]
+            self.finished.add(path)
+            self.last_change = now
+            finished.append(path)
+        return finished
+
+
+class PartWatcher:
+    """Runs import passes over the parts of a takeout as they finish downloading."""
+
+    def __init__(self, processor, settle_seconds: float = DEFAULT_SETTLE_SECONDS,
+                 idle_seconds: float = DEFAULT_IDLE_SECONDS, clock: Callable[[], float] = time.monotonic):
+        self.processor = processor
+        self.tracker = DownloadTracker(processor.takeout_dir, settle_seconds, clock=clock)
+        self.idle_seconds = idle_seconds
+        self.clock = clock
+        self.passes = 0
+        # Whether the last pass imported media without sidecars too
+        self.complete = True
+
+    def step(self) -> bool:
+        """Poll once and run a pass if parts finished or the download went idle; True if a pass ran."""
+        finished = self.tracker.poll()
+        if finished:
+            logger.info(f"{len(finished)} takeout parts finished downloading: "
+                        f"{', '.join(path.name for path in finished)}")
+            self.run_pass(final=False)
+            return True
+        if not self.complete and self.clock() - self.tracker.last_change >= self.idle_seconds:
+            logger.info(f"No takeout part changed for {self.idle_seconds:.0f}s; "
+                        f"importing media still missing a sidecar")
+            self.run_pass(final=True)
+            return True
+        return False
+
+    def run_pass(self, final: bool) -> None:
+        """Import every finished part; media without a sidecar wait unless this is the final pass."""
+        processor = self.processor
+        processor.archives = sorted(self.tracker.finished)
+        processor.defer_unmatched = not final
+        # Sidecars in the new parts change the plan
+        processor.plan = None
+        try:
+            processor.process_all()
+        except Exception as e:
+            logger.error(f"Import pass over {len(processor.archives)} parts failed: {e}")
+        # Later passes continue from the manifest this one left behind
+        processor.resume = True
+        self.passes += 1
+        self.complete = final
+
+    def run(self, poll_interval: float = POLL_INTERVAL, stop: Optional[threading.Event] = None,
+            exit_when_complete: bool = False) -> None:
+        """Poll until stopped, or until every finished part was fully imported if exit_when_complete."""
+        stop = stop or threading.Event()
+        logger.info(f"Watching {self.tracker.directory} for finished {self.tracker.pattern} parts")
+        while not stop.is_set():
+            self.step()
+            if exit_when_complete and self.passes and self.complete:
+                return
+            stop.wait(poll_interval)
@@ -0,0 +1,143 @@
+"""
+Output file placement for the takeout importer.
+
+Places a file that already exists in processed/ at a second location without
+writing its bytes again: as a reflink (FICLONE on Linux, clonefile on APFS)
+or as a hardlink, falling back to a regular copy when neither is possible.
+
+Outputs that are plain copies of a source are placed with the cheapest tier
+that works, tried in PLACEMENT_TIERS order: a rename when the source is a
+throwaway extracted or scratch copy on the same filesystem, a reflink, an
+in-kernel copy_file_range or sendfile, and only then a copy through
+userspace buffers.
+"""
+
+import ctypes
+import os
+import shutil
+import sys
+from pathlib import Path
+from typing import Optional
+
+# ioctl request number for FICLONE from <linux/fs.h>
+FICLONE = 0x40049409
+
+LINK_MODES = ('hardlink', 'reflink')
+
+PLACEMENT_TIERS = ('rename', 'reflink', 'copy_file_range', 'sendfile', 'copy')
+
+# Bytes per in-kernel copy call and per userspace buffer
+COPY_CHUNK_SIZE = 8 * 1024 * 1024
+
+
+def reflink(src: Path, dst: Path) -> None:
+    """Clone src to dst so both share data blocks; raises OSError if the filesystem can't."""
+    if sys.platform == 'darwin':
+        libc = ctypes.CDLL(None, use_errno=True)
+        if libc.clonefile(os.fsencode(src), os.fsencode(dst), 0) != 0:
+            err = ctypes.get_errno()
+            raise OSError(err, os.strerror(err), str(dst))
+        return
+
+    import fcntl
+    with open(src, 'rb') as source, open(dst, 'wb') as target:
+        try:
+            fcntl.ioctl(target.fileno(), getattr(fcntl, 'FICLONE', FICLONE), source.fileno())
+        except OSError:
+            target.close()
+            os.unlink(dst)
+            raise
+
+
+def copy_range(source: int, target: int, offset: int, size: int) -> Optional[str]:
+    """Copy size bytes at offset in source to the start of target without them passing through userspace.
+
+    Both are file descriptors; target is truncated first. Returns the system
+    call that did the copy, or None if neither copy_file_range nor sendfile
+    works between these files.
+    """
+    calls = []
+    if hasattr(os, 'copy_file_range'):
+        calls.append(('copy_file_range', lambda position, count: os.copy_file_range(
+            source, target, count, offset + position, position)))
+    if sys.platform.startswith('linux'):
+        # Since Linux 2.6.33 the target of sendfile may be a regular file
+        calls.append(('sendfile', lambda position, count: os.sendfile(target, source, offset + position, count)))
+
+    for name, call in calls:
+        os.lseek(target, 0, os.SEEK_SET)
+        os.ftruncate(target, 0)
+        position = 0
+        try:
+            while position < size:
+                copied = call(position, min(COPY_CHUNK_SIZE, size - position))
+                if copied == 0:
+                    break
+                position += copied
+        except OSError:
+            continue
+        if position == size:
+            return name
+    return None
+
+
+def kernel_copy(src: Path, dst: Path) -> Optional[str]:
+    """Copy src to dst without the bytes passing through userspace.
+
+    Returns the system call that did the copy, or None if neither
+    copy_file_range nor sendfile works between these files.
+    """
+    with open(src, 'rb') as source, open(dst, 'wb') as target:
+        return copy_range(source.fileno(), target.fileno(), 0, os.fstat(source.fileno()).st_size)
+
+
+def copy_file(src: Path, dst: Path) -> str:
+    """Copy src to dst with the cheapest tier that works and return its name; metadata is copied too."""
+    dst.unlink(missing_ok=True)
+    try:
+        reflink(src, dst)
+        tier = 'reflink'
+    except OSError:
+        tier = kernel_copy(src, dst)
+        if tier is None:
+            with open(src, 'rb') as source, open(dst, 'wb') as target:
+                shutil.copyfileobj(source, target, COPY_CHUNK_SIZE)
+            tier = 'copy'
+    shutil.copystat(src, dst)
+    return tier
+
+
+def place_file(src: Path, dst: Path, move: bool = False) -> str:
+    """Place src's bytes at dst and return the tier used.
+
+    With move, src is a throwaway copy: it is renamed into place when both
+    are on the same filesystem and removed after a copy otherwise.
+    """
+    if move:
+        try:
+            os.replace(src, dst)
+            return 'rename'
+        except OSError:
+            pass
+    tier = copy_file(src, dst)
+    if move:
+        os.unlink(src)
+    return tier
+
+
+def link_file(src: Path, dst: Path, mode: str) -> bool:
+    """Place dst as a hardlink or reflink of src.
+
+    Falls back to a copy when linking is not possible. Returns True if dst
+    shares src's data, False if the bytes had to be copied.
+    """
+    dst.unlink(missing_ok=True)
+    try:
+        if mode == 'reflink':
+            reflink(src, dst)
+        else:
+            os.link(src, dst)
+        return True
+    except OSError:
+        copy_file(src, dst)
+        return False
@@ -0,0 +1,164 @@
+"""
+Non-blocking, rate-limited logging for the takeout importer.
+
+setup_logging() is called from main(). It points the root logger at a queue,
+so a log call on the hot path only formats its message and enqueues it. A
+background LogWriter thread drains the queue into the JSON lines log file and
+a human-readable console. The queue is a multiprocessing queue, so pool
+workers log through the same writer: forked workers inherit the handler, and
+spawned workers attach to the queue in their initializer.
+
+Warnings are rate limited per call site. The first COALESCE_BURST warnings
+from one line of code within COALESCE_INTERVAL seconds are written. Any more
+are counted, and one summary record per call site reports them when the
+window ends or the writer stops. "No metadata found" for ten thousand files
+becomes a handful of lines.
+"""
+
+import json
+import logging
+import logging.handlers
+import multiprocessing
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+# Warnings written per call site and window before the rest are only counted
+COALESCE_BURST = 5
+COALESCE_INTERVAL = 60.0
+
+CONSOLE_FORMAT = '%(asctime)s - %(levelname)s - %(message)s'
+
+# LogRecord attributes that are not extra fields passed by the caller
+RECORD_ATTRIBUTES = set(vars(logging.LogRecord('', 0, '', 0, '', (), None))) | {'message', 'asctime'}
+
+
+class JsonLinesFormatter(logging.Formatter):
+    """Formats a record as one JSON object per line, including any extra fields."""
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            'time': datetime.fromtimestamp(record.created, tz=timezone.utc).isoformat(),
+            'level': record.levelname,
+            'logger': record.name,
+            'process': record.processName,
+            'thread': record.threadName,
+            'message': record.getMessage(),
+        }
+        entry.update((key, value) for key, value in vars(record).items() if key not in RECORD_ATTRIBUTES)
+        return json.dumps(entry, default=str)
+
+
+class Window:
+    """Warnings seen from one call site in the current window."""
+
+    __slots__ = ('started', 'written', 'suppressed', 'last')
+
+    def __init__(self, started: float):
+        self.started = started
+        self.written = 0
+        self.suppressed = 0
+        self.last: Optional[logging.LogRecord] = None
+
+
+class LogWriter(logging.handlers.QueueListener):
+    """Background thread writing queued records, with repeated warnings coalesced."""
+
+    def __init__(self, queue, *handlers: logging.Handler, burst: int = COALESCE_BURST,
+                 interval: float = COALESCE_INTERVAL):
+        super().__init__(queue, *handlers, respect_handler_level=True)
+        self.burst = burst
+        self.interval = interval
+        self._windows: Dict[Tuple[str, int], Window] = {}
+
+    def handle(self, record: logging.LogRecord) -> None:
+        if record.levelno != logging.WARNING:
+            super().handle(record)
+            return
+
+        site = (record.pathname, record.lineno)
+        window = self._windows.get(site)
+        if window is None or record.created - window.started >= self.interval:
+            if window is not None:
+                self.summarize(window)
+            window = self._windows[site] = Window(record.created)
+        if window.written < self.burst:
+            window.written += 1
+            super().handle(record)
+        else:
+            window.suppressed += 1
+            window.last = record
+
+    def summarize(self, window: Window) -> None:
+        """Write one record counting the warnings a window suppressed."""
+        if not window.suppressed:
+            return
+        last = window.last
+        summary = logging.makeLogRecord(dict(vars(last), msg=(
+            f"{window.suppressed} more like this in {last.created - window.started:.0f}s, "
+            f"last: {last.getMessage()}"), args=None, suppressed=window.suppressed))
+        super().handle(summary)
+        window.suppressed = 0
+
+    def stop(self) -> None:
+        super().stop()
+        for window in self._windows.values():
+            self.summarize(window)
+        self._windows = {}
+        for handler in self.handlers:
+            handler.flush()
+
+
+_writer: Optional[LogWriter] = None
+_queue = None
+
+
+def setup_logging(log_path: Path, level: int = logging.INFO, console: bool = True) -> LogWriter:
+    """Route the root logger through a queue to a background writer; call stop_logging() at exit."""
+    global _writer, _queue
+    stop_logging()
+
+    file_handler = logging.FileHandler(log_path)
+    file_handler.setFormatter(JsonLinesFormatter())
+    handlers: List[logging.Handler] = [file_handler]
+    if console:
+        console_handler = logging.StreamHandler()
+        console_handler.setFormatter(logging.Formatter(CONSOLE_FORMAT))
+        handlers.append(console_handler)
+
+    _queue = multiprocessing.Queue()
+    attach(_queue, level)
+    _writer = LogWriter(_queue, *handlers)
+    _writer.start()
+    return _writer
+
+
+def attach(queue, level: int = logging.INFO) -> None:
+    """Make the root logger of this process enqueue its records, e.g. in a spawned pool worker."""
+    root = logging.getLogger()
+    for handler in list(root.handlers):
+        root.removeHandler(handler)
+    root.addHandler(logging.handlers.QueueHandler(queue))
+    root.setLevel(level)
+
+
+def log_queue():
+    """Return the queue pool workers should log to, or None if logging was not set up."""
+    return _queue
+
+
+def stop_logging() -> None:
+    """Write everything still queued, then detach the root logger from the queue."""
+    global _writer, _queue
+    if _writer is None:
+        return
+    root = logging.getLogger()
+    for handler in list(root.handlers):
+        if isinstance(handler, logging.handlers.QueueHandler):
+            root.removeHandler(handler)
+    _writer.stop()
+    for handler in _writer.handlers:
+        handler.close()
+    _queue.close()
+    _queue.join_thread()
+    _writer = _queue = None
@@ -0,0 +1,231 @@
+"""
+Per-stage timing and the machine-readable run report for the takeout importer.
+
+The processor wraps each hot-path stage (archive extraction, sidecar parsing,
+EXIF building, image and video embedding, ffprobe, remux, duplicate linking,
+upload) in Instrumentation.measure(). Each stage keeps a count, total and
+maximum latency, a fixed-bucket latency histogram, the bytes it moved and its
+slowest files. Everything is plain data, so pool workers send their timings
+back with their stats and the parent merges them.
+
+A run can also be profiled with cProfile or tracemalloc. write_report() saves
+the whole picture as JSON next to takeout_import.log.
+"""
+
+import cProfile
+import heapq
+import io
+import json
+import platform
+import pstats
+import resource
+import sys
+import time
+import tracemalloc
+from contextlib import contextmanager
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Dict, Iterator, List, Optional, Tuple
+
+# Upper bounds of the latency histogram buckets in milliseconds; one more bucket catches the rest
+HISTOGRAM_BOUNDS_MS = (1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 2000, 5000, 10000, 30000, 60000)
+
+# Slowest files kept per stage
+SLOWEST_N = 10
+
+# Entries kept from a profile
+PROFILE_TOP_N = 30
+
+PROFILE_MODES = ('cprofile', 'tracemalloc')
+
+
+class StageStats:
+    """Latency and throughput of one stage."""
+
+    __slots__ = ('count', 'seconds', 'max_seconds', 'bytes', 'buckets', 'slowest')
+
+    def __init__(self):
+        self.count = 0
+        self.seconds = 0.0
+        self.max_seconds = 0.0
+        self.bytes = 0
+        self.buckets = [0] * (len(HISTOGRAM_BOUNDS_MS) + 1)
+        # Min-heap of (seconds, label), so the fastest of the slowest is evicted first
+        self.slowest: List[Tuple[float, str]] = []
+
+    def add(self, seconds: float, nbytes: int = 0, label: Optional[str] = None) -> None:
+        self.count += 1
+        self.seconds += seconds
+        self.max_seconds = max(self.max_seconds, seconds)
+        self.bytes += nbytes
+        milliseconds = seconds * 1000
+        for index, bound in enumerate(HISTOGRAM_BOUNDS_MS):
+            if milliseconds <= bound:
+                self.buckets[index] += 1
+                break
+        else:
+            self.buckets[-1] += 1
+        if label is not None:
+            self._keep_slowest((seconds, label))
+
+    def _keep_slowest(self, entry: Tuple[float, str]) -> None:
+        if len(self.slowest) < SLOWEST_N:
+            heapq.heappush(self.slowest, entry)
+        elif entry > self.slowest[0]:
+            heapq.heapreplace(self.slowest, entry)
+
+    def merge(self, other: 'StageStats') -> None:
+        self.count += other.count
+        self.seconds += other.seconds
+        self.max_seconds = max(self.max_seconds, other.max_seconds)
+        self.bytes += other.bytes
+        self.buckets = [a + b for a, b in zip(self.buckets, other.buckets)]
+        for entry in other.slowest:
+            self._keep_slowest(entry)
+
+    def percentile(self, fraction: float) -> float:
+        """Return the upper bound, in milliseconds, of the bucket holding the given fraction of samples."""
+        if not self.count:
+            return 0.0
+        threshold = fraction * self.count
+        seen = 0
+        for index, count in enumerate(self.buckets):
+            seen += count
+            if seen >= threshold:
+                if index < len(HISTOGRAM_BOUNDS_MS):
+                    return float(HISTOGRAM_BOUNDS_MS[index])
+                break
+        return self.max_seconds * 1000
+
+    def to_dict(self) -> Dict:
+        labels = [f"<={bound}ms" for bound in HISTOGRAM_BOUNDS_MS] + [f">{HISTOGRAM_BOUNDS_MS[-1]}ms"]
+        return {
+            'count': self.count,
+            'total_s': round(self.seconds, 6),
+            'mean_ms': round(self.seconds * 1000 / self.count, 3) if self.count else 0.0,
+            'p50_ms': self.percentile(0.5),
+            'p90_ms': self.percentile(0.9),
+            'p99_ms': self.percentile(0.99),
+            'max_ms': round(self.max_seconds * 1000, 3),
+            'bytes': self.bytes,
+            'mb_per_s': round(self.bytes / (1024 * 1024) / self.seconds, 3) if self.seconds else 0.0,
+            'histogram': {label: count for label, count in zip(labels, self.buckets) if count},
+            'slowest': [{'file': label, 'ms': round(seconds * 1000, 3)}
+                        for seconds, label in sorted(self.slowest, reverse=True)],
+        }
+
+
+class Measurement:
+    """Handle yielded by Instrumentation.measure(); set bytes once they are known."""
+
+    __slots__ = ('bytes',)
+
+    def __init__(self, nbytes: int = 0):
+        self.bytes = nbytes
+
+
+class Instrumentation:
+    """Stage timings of one processor."""
+
+    def __init__(self):
+        self.stages: Dict[str, StageStats] = {}
+
+    def record(self, stage: str, seconds: float, nbytes: int = 0, label: Optional[str] = None) -> None:
+        stats = self.stages.get(stage)
+        if stats is None:
+            stats = self.stages[stage] = StageStats()
+        stats.add(seconds, nbytes, label)
+
+    @contextmanager
+    def measure(self, stage: str, label: Optional[str] = None, nbytes: int = 0) -> Iterator[Measurement]:
+        """Time the body of a with block as one sample of stage."""
+        measurement = Measurement(nbytes)
+        started = time.perf_counter()
+        try:
+            yield measurement
+        finally:
+            self.record(stage, time.perf_counter() - started, measurement.bytes, label)
+
+    def drain(self) -> Dict[str, StageStats]:
+        """Return the timings gathered so far and start over, e.g. to ship them from a worker."""
+        stages, self.stages = self.stages, {}
+        return stages
+
+    def merge(self, stages: Dict[str, StageStats]) -> None:
+        for name, stats in stages.items():
+            if name in self.stages:
+                self.stages[name].merge(stats)
+            else:
+                self.stages[name] = stats
+
+    def to_dict(self) -> Dict[str, Dict]:
+        return {name: self.stages[name].to_dict() for name in sorted(self.stages)}
+
+
+class Profiler:
+    """Optional whole-run cProfile or tracemalloc session."""
+
+    def __init__(self, mode: Optional[str]):
+        if mode not in (None,) + PROFILE_MODES:
+            raise ValueError(f"Unknown profile mode: {mode}")
+        self.mode = mode
+        self._profile: Optional[cProfile.Profile] = None
+
+    def start(self) -> None:
+        if self.mode == 'cprofile':
+            self._profile = cProfile.Profile()
+            self._profile.enable()
+        elif self.mode == 'tracemalloc':
+            tracemalloc.start(10)
+
+    def stop(self, dump_path: Optional[Path] = None) -> Optional[Dict]:
+        """Stop profiling and return a summary; cProfile data is also dumped to dump_path."""
+        if self.mode == 'cprofile' and self._profile is not None:
+            self._profile.disable()
+            if dump_path is not None:
+                self._profile.dump_stats(str(dump_path))
+            stats = pstats.Stats(self._profile, stream=io.StringIO())
+            stats.sort_stats('cumulative')
+            top = []
+            for func in stats.fcn_list[:PROFILE_TOP_N]:
+                calls, _, total, cumulative, _ = stats.stats[func]
+                top.append({'function': f"{func[0]}:{func[1]}({func[2]})", 'calls': calls,
+                            'total_s': round(total, 6), 'cumulative_s': round(cumulative, 6)})
+            self._profile = None
+            return {'mode': 'cprofile', 'dump': str(dump_path) if dump_path else None, 'top': top}
+
+        if self.mode == 'tracemalloc' and tracemalloc.is_tracing():
+            snapshot = tracemalloc.take_snapshot()
+            current, peak = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+            top = [{'location': str(stat.traceback[0]), 'size_kb': round(stat.size / 1024, 1), 'count': stat.count}
+                   for stat in snapshot.statistics('lineno')[:PROFILE_TOP_N]]
+            return {'mode': 'tracemalloc', 'current_kb': round(current / 1024, 1),
+                    'peak_kb': round(peak / 1024, 1), 'top': top}
+        return None
+
+
+def peak_rss_bytes() -> int:
+    """Return the peak RSS of this process and its finished children."""
+    own = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    children = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss
+    # ru_maxrss is in bytes on macOS and in kilobytes elsewhere
+    scale = 1 if sys.platform == 'darwin' else 1024
+    return max(own, children) * scale
+
+
+def write_report(path: Path, started: float, options: Dict, stats: Dict[str, int],
+                 timings: Instrumentation, profile: Optional[Dict] = None) -> None:
+    """Write the JSON run report."""
+    report = {
+        'started': datetime.fromtimestamp(started, tz=timezone.utc).isoformat(),
+        'seconds': round(time.time() - started, 3),
+        'host': {'python': platform.python_version(), 'platform': platform.platform()},
+        'options': options,
+        'stats': stats,
+        'peak_rss_mb': round(peak_rss_bytes() / (1024 * 1024), 1),
+        'stages': timings.to_dict(),
+    }
+    if profile is not None:
+        report['profile'] = profile
+    Path(path).write_text(json.dumps(report, indent=2))
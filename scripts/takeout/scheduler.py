@@ -0,0 +1,70 @@
+"""
+Size-aware worker lanes for the takeout importer.
+
+Album order says nothing about cost. A multi-gigabyte video found late in a
+run keeps one worker busy long after every other file is done, and the run
+ends on a single core. With --workers, jobs are therefore routed to lanes:
+videos of at least the large-video size run on a small I/O lane of threads,
+which mostly wait on ffmpeg and the disk, and are dispatched before anything
+else. Every other file fills the CPU lane, which is the regular process or
+thread pool. Each lane counts its queued tasks, so the dispatcher bounds
+queue depth per lane and the run report shows it.
+"""
+
+from concurrent.futures import Executor, Future
+from typing import Callable, Dict, Iterable, List, TypeVar
+
+LANE_CPU = 'cpu'
+LANE_IO = 'io'
+
+# Videos at least this large get the I/O lane
+DEFAULT_LARGE_VIDEO_SIZE = 256 * 1024 * 1024
+
+# Threads on the I/O lane
+DEFAULT_IO_WORKERS = 1
+
+T = TypeVar('T')
+
+
+class Lane:
+    """An executor and the number of tasks queued or running on it."""
+
+    def __init__(self, name: str, executor: Executor, workers: int):
+        self.name = name
+        self.executor = executor
+        self.workers = workers
+        self.depth = 0
+        self.max_depth = 0
+        self.jobs = 0
+        # Queued and running futures, for cancelling on shutdown
+        self._pending = set()
+
+    def submit(self, fn: Callable, *args) -> Future:
+        future = self.executor.submit(fn, *args)
+        self._pending.add(future)
+        future.add_done_callback(self._pending.discard)
+        self.depth += 1
+        self.max_depth = max(self.max_depth, self.depth)
+        self.jobs += 1
+        return future
+
+    def finished(self) -> None:
+        """Count one task of this lane as collected."""
+        self.depth -= 1
+
+    def shutdown(self, cancel_futures: bool = False) -> None:
+        # Executor.shutdown only takes cancel_futures from Python 3.9, so cancel queued tasks here
+        if cancel_futures:
+            for future in list(self._pending):
+                future.cancel()
+        self.executor.shutdown()
+
+    def to_dict(self) -> Dict[str, int]:
+        return {'workers': self.workers, 'jobs': self.jobs, 'depth': self.depth, 'max_depth': self.max_depth}
+
+
+def large_first(jobs: Iterable[T], is_large: Callable[[T], bool], size: Callable[[T], int]) -> List[T]:
+    """Return jobs with the large ones first, largest first, and the rest in their original order."""
+    jobs = list(jobs)
+    large = sorted((job for job in jobs if is_large(job)), key=size, reverse=True)
+    return large + [job for job in jobs if not is_large(job)]
@@ -0,0 +1,96 @@
+"""
+Media to sidecar JSON resolution for Google Photos takeout albums.
+
+Google does not name sidecars consistently. Besides the plain
+`<name>.supplemental-metadata.json` and legacy `<name>.json` forms, it:
+
+- truncates the sidecar name to 46 characters before `.json`,
+  e.g. `PXL_20230101_120000123.NIGHT.jpg.supplemental-.json`
+- moves the duplicate counter of `IMG_1234(1).jpg` behind the extension,
+  e.g. `IMG_1234.jpg(1).json` or `IMG_1234.jpg.supplemental-metadata(1).json`
+- gives `-edited` copies no sidecar of their own; they share the original's
+
+An album's member names are indexed once and every media file is resolved
+against the set of sidecar names in memory, so no per-file lookups are made.
+"""
+
+import os
+import re
+import sys
+from typing import Iterable, List, Optional
+
+SUPPLEMENTAL_SUFFIX = '.supplemental-metadata'
+SIDECAR_EXTENSION = '.json'
+ALBUM_METADATA_NAME = 'metadata.json'
+
+# Google truncates the sidecar name to this many characters before '.json'
+MAX_SIDECAR_STEM = 46
+
+# Suffixes Google appends to edited copies, including localized exports
+EDITED_SUFFIXES = ('-edited', '-bearbeitet', '-modifié', '-editado')
+
+DUPLICATE_COUNTER = re.compile(r'^(?P<stem>.*)(?P<counter>\(\d+\))$')
+
+
+def split_duplicate_counter(name: str):
+    """Split 'IMG(1).jpg' into ('IMG.jpg', '(1)'); names without a counter get ''."""
+    stem, ext = os.path.splitext(name)
+    match = DUPLICATE_COUNTER.match(stem)
+    if not match:
+        return name, ''
+    return match.group('stem') + ext, match.group('counter')
+
+
+def strip_edited_suffix(name: str) -> Optional[str]:
+    """Return the original name of an edited copy, or None if name is not an edit."""
+    stem, ext = os.path.splitext(name)
+    for suffix in EDITED_SUFFIXES:
+        if stem.endswith(suffix) and len(stem) > len(suffix):
+            return stem[:-len(suffix)] + ext
+    return None
+
+
+def sidecar_candidates(name: str) -> List[str]:
+    """Return every sidecar name Google may have used for a media file, most likely first."""
+    base, counter = split_duplicate_counter(name)
+    originals = [base]
+    original = strip_edited_suffix(base)
+    if original is not None:
+        originals.append(original)
+
+    candidates = []
+    for media_name in originals:
+        for suffix in (SUPPLEMENTAL_SUFFIX, ''):
+            stem = (media_name + suffix)[:MAX_SIDECAR_STEM]
+            candidates.append(stem + counter + SIDECAR_EXTENSION)
+            if counter:
+                # Some exports keep the counter in the media name instead
+                candidates.append((name + suffix)[:MAX_SIDECAR_STEM] + SIDECAR_EXTENSION)
+    # Preserve order but drop repeats
+    return list(dict.fromkeys(candidates))
+
+
+class SidecarIndex:
+    """Media files and sidecar names of one album, built from a single listing."""
+
+    __slots__ = ('media', 'sidecars', 'has_album_metadata')
+
+    def __init__(self, names: Iterable[str]):
+        self.media: List[str] = []
+        sidecars = set()
+        self.has_album_metadata = False
+        for name in names:
+            if name == ALBUM_METADATA_NAME:
+                self.has_album_metadata = True
+            elif name.endswith(SIDECAR_EXTENSION):
+                sidecars.add(sys.intern(name))
+            else:
+                self.media.append(sys.intern(name))
+        self.sidecars = frozenset(sidecars)
+
+    def resolve(self, name: str) -> Optional[str]:
+        """Return the sidecar name for a media file, or None if it has none."""
+        for candidate in sidecar_candidates(name):
+            if candidate in self.sidecars:
+                return candidate
+        return None
@@ -0,0 +1,246 @@
+"""
+Reproducible synthetic Google Photos takeouts for tests and benchmarks.
+
+Builds `takeout-NNN.zip` parts that look like a real export: "Photos from
+<year>" folders plus named albums with metadata.json, supplemental-metadata
+sidecars with timestamps, GPS and device info, album photos repeated in their
+year folder, sidecar names truncated to 46 characters, duplicate counters
+like IMG_1234(1).jpg, and -edited copies without a sidecar of their own.
+The same seed always produces byte-identical archives.
+
+    python3 synthetic_takeout.py /tmp/takeout --photos 500 --videos 20
+"""
+
+import argparse
+import io
+import json
+import random
+import shutil
+import struct
+import subprocess
+import tempfile
+import zipfile
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Dict, List, NamedTuple
+
+from PIL import Image
+
+from sidecar_index import MAX_SIDECAR_STEM, SUPPLEMENTAL_SUFFIX
+
+TAKEOUT_PREFIX = "Takeout/Google Photos/"
+
+ALBUM_NAMES = ["Weekend in Grand County", "Family", "Road Trip 2019", "Birthday", "Hiking", "Screenshots",
+               "Beach Week", "Winter Cabin"]
+
+DEVICE_TYPES = ["ANDROID_PHONE", "IOS_PHONE", "DESKTOP"]
+
+# 2015-01-01 to 2024-12-31
+TIME_RANGE = (1420070400, 1735603200)
+
+# Fixed timestamp for zip entries so archives are reproducible
+ZIP_DATE_TIME = (2025, 9, 12, 6, 1, 18)
+
+
+class SyntheticSummary(NamedTuple):
+    """What generate_takeout wrote."""
+    archives: List[Path]
+    media_files: int
+    media_bytes: int
+    duplicates: int
+
+
+def random_bytes(rng: random.Random, count: int) -> bytes:
+    """Return count random bytes, the same ones Random.randbytes (Python 3.9+) would give."""
+    return rng.getrandbits(8 * count).to_bytes(count, "little") if count else b""
+
+
+def random_image(rng: random.Random, size, fmt: str) -> bytes:
+    """Return a noisy image so it compresses like a real photo rather than a flat color."""
+    width, height = size
+    # Upscaled low-resolution noise: realistic file sizes without paying for full-size random data
+    small = Image.frombytes("RGB", (max(1, width // 8), max(1, height // 8)),
+                            random_bytes(rng, 3 * max(1, width // 8) * max(1, height // 8)))
+    image = small.resize(size, Image.BILINEAR)
+    buffer = io.BytesIO()
+    if fmt == "JPEG":
+        image.save(buffer, format=fmt, quality=90)
+    else:
+        image.save(buffer, format=fmt)
+    return buffer.getvalue()
+
+
+def base_video(duration: float = 1.0) -> bytes:
+    """Return a short MP4, rendered with ffmpeg when it is installed.
+
+    Without ffmpeg a bare ftyp box is returned; such files are still imported
+    but fail the remux like any unreadable video would.
+    """
+    if shutil.which("ffmpeg"):
+        with tempfile.TemporaryDirectory() as tmp:
+            output = Path(tmp) / "clip.mp4"
+            subprocess.run(["ffmpeg", "-v", "error", "-f", "lavfi",
+                            "-i", f"testsrc=duration={duration}:size=320x240:rate=15",
+                            "-pix_fmt", "yuv420p", "-y", str(output)], check=True)
+            return output.read_bytes()
+    return struct.pack(">I4s4sI4s4s", 24, b"ftyp", b"isom", 0x200, b"isom", b"mp41")
+
+
+def padded_video(base: bytes, rng: random.Random, size: int) -> bytes:
+    """Give each clip distinct bytes and a target size with a trailing 'free' box."""
+    padding = max(8, size - len(base))
+    return base + struct.pack(">I4s", padding, b"free") + random_bytes(rng, padding - 8)
+
+
+def make_sidecar(rng: random.Random, title: str, timestamp: int) -> Dict:
+    """Return a supplemental-metadata document shaped like Google's."""
+    taken = datetime.fromtimestamp(timestamp, tz=timezone.utc)
+    geo = {"latitude": round(rng.uniform(-60, 70), 7), "longitude": round(rng.uniform(-180, 180), 7),
+           "altitude": round(rng.uniform(0, 3500), 1), "latitudeSpan": 0.0, "longitudeSpan": 0.0}
+    return {
+        "title": title,
+        "description": rng.choice(["", "", "", "Sunset", "At the lake"]),
+        "imageViews": str(rng.randint(0, 50)),
+        "creationTime": {"timestamp": str(timestamp + rng.randint(60, 86400)),
+                         "formatted": taken.strftime("%b %d, %Y, %I:%M:%S %p UTC")},
+        "photoTakenTime": {"timestamp": str(timestamp), "formatted": taken.strftime("%b %d, %Y, %I:%M:%S %p UTC")},
+        "geoData": geo,
+        "geoDataExif": dict(geo),
+        "url": "https://photos.google.com/photo/synthetic",
+        "googlePhotosOrigin": {"mobileUpload": {"deviceFolder": {"localFolderName": ""},
+                                                "deviceType": rng.choice(DEVICE_TYPES)}},
+    }
+
+
+def sidecar_name(media_name: str, counter: str = "") -> str:
+    """Return the sidecar name Google writes for a media file, truncation included."""
+    return (media_name + SUPPLEMENTAL_SUFFIX)[:MAX_SIDECAR_STEM] + counter + ".json"
+
+
+def media_name(rng: random.Random, index: int, timestamp: int, extension: str) -> str:
+    """Return a camera-style file name; some are long enough to get truncated sidecars."""
+    taken = datetime.fromtimestamp(timestamp, tz=timezone.utc)
+    style = rng.random()
+    if style < 0.15:
+        return f"PXL_{taken:%Y%m%d_%H%M%S}{index:03d}.NIGHT.PORTRAIT-01.COVER{extension}"
+    if style < 0.5:
+        return f"IMG_{taken:%Y%m%d_%H%M%S}_{index:04d}{extension}"
+    return f"IMG_{index:04d}{extension}"
+
+
+class ZipSet:
+    """Writes members into a fixed number of takeout parts."""
+
+    def __init__(self, dest: Path, parts: int):
+        self.paths = [dest / f"takeout-{index:03d}.zip" for index in range(1, parts + 1)]
+        self.zips = [zipfile.ZipFile(path, "w", zipfile.ZIP_DEFLATED) for path in self.paths]
+
+    def write(self, part: int, name: str, data: bytes, compress: bool = True) -> None:
+        info = zipfile.ZipInfo(TAKEOUT_PREFIX + name, ZIP_DATE_TIME)
+        info.compress_type = zipfile.ZIP_DEFLATED if compress else zipfile.ZIP_STORED
+        self.zips[part % len(self.zips)].writestr(info, data)
+
+    def close(self) -> None:
+        for zip_ref in self.zips:
+            zip_ref.close()
+
+
+def generate_takeout(dest: Path, photos: int = 200, pngs: int = 10, videos: int = 5, albums: int = 4,
+                     parts: int = 2, image_size=(1024, 768), video_size: int = 2 * 1024 * 1024,
+                     duplicate_ratio: float = 0.3, quirk_ratio: float = 0.1, seed: int = 0) -> SyntheticSummary:
+    """Write a synthetic takeout into dest and return what was written."""
+    rng = random.Random(seed)
+    dest = Path(dest)
+    dest.mkdir(parents=True, exist_ok=True)
+    album_names = ALBUM_NAMES[:albums] if albums <= len(ALBUM_NAMES) else \
+        ALBUM_NAMES + [f"Album {index}" for index in range(len(ALBUM_NAMES), albums)]
+    video_base = base_video() if videos else b""
+
+    kinds = ["jpg"] * photos + ["png"] * pngs + ["mp4"] * videos
+    rng.shuffle(kinds)
+
+    zips = ZipSet(dest, parts)
+    media_files = media_bytes = duplicates = 0
+    used_names: Dict[str, set] = {}
+    try:
+        for part, album in enumerate(album_names):
+            timestamp = rng.randint(*TIME_RANGE)
+            zips.write(part, f"{album}/metadata.json", json.dumps({
+                "title": album, "description": "", "access": "protected",
+                "date": {"timestamp": str(timestamp), "formatted": ""},
+            }, indent=2).encode())
+
+        for index, kind in enumerate(kinds):
+            timestamp = rng.randint(*TIME_RANGE)
+            year_folder = f"Photos from {datetime.fromtimestamp(timestamp, tz=timezone.utc).year}"
+            name = media_name(rng, index, timestamp, f".{kind}")
+
+            if kind == "jpg":
+                data = random_image(rng, image_size, "JPEG")
+            elif kind == "png":
+                data = random_image(rng, (image_size[0] // 4, image_size[1] // 4), "PNG")
+            else:
+                data = padded_video(video_base, rng, video_size)
+
+            # Album photos also appear in their year folder, like a real export
+            folders = [year_folder]
+            if album_names and rng.random() < duplicate_ratio:
+                folders.append(rng.choice(album_names))
+            sidecar = json.dumps(make_sidecar(rng, name, timestamp), indent=2).encode()
+            quirk = rng.random() < quirk_ratio
+            edited = random_image(rng, image_size, "JPEG") if quirk and kind == "jpg" else None
+
+            for folder in folders:
+                names = used_names.setdefault(folder, set())
+                final_name, counter = name, ""
+                if final_name in names or (quirk and kind == "jpg" and rng.random() < 0.5):
+                    # Google moves the counter behind the extension in the sidecar name
+                    stem, ext = final_name.rsplit(".", 1)
+                    counter = "(1)"
+                    final_name = f"{stem}{counter}.{ext}"
+                names.add(final_name)
+
+                part = rng.randrange(parts)
+                zips.write(part, f"{folder}/{final_name}", data, compress=kind != "mp4")
+                zips.write(rng.randrange(parts), f"{folder}/{sidecar_name(name, counter)}", sidecar)
+                media_files += 1
+                media_bytes += len(data)
+
+                if edited is not None and not counter:
+                    # Edited copy that shares the original's sidecar
+                    stem, ext = final_name.rsplit(".", 1)
+                    zips.write(part, f"{folder}/{stem}-edited.{ext}", edited)
+                    media_files += 1
+                    media_bytes += len(edited)
+            duplicates += len(folders) - 1
+    finally:
+        zips.close()
+
+    return SyntheticSummary(zips.paths, media_files, media_bytes, duplicates)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Generate a synthetic Google Photos takeout')
+    parser.add_argument('dest', help='Directory to write takeout-NNN.zip files into')
+    parser.add_argument('--photos', type=int, default=200, help='JPEG photos')
+    parser.add_argument('--pngs', type=int, default=10, help='PNG images')
+    parser.add_argument('--videos', type=int, default=5, help='Short MP4 videos')
+    parser.add_argument('--albums', type=int, default=4, help='Named albums')
+    parser.add_argument('--parts', type=int, default=2, help='Number of zip parts')
+    parser.add_argument('--image-size', default='1024x768', help='JPEG dimensions, WIDTHxHEIGHT')
+    parser.add_argument('--video-mb', type=float, default=2, help='Size of each video in MB')
+    parser.add_argument('--duplicate-ratio', type=float, default=0.3,
+                        help='Share of media also placed in a named album')
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    width, height = (int(value) for value in args.image_size.lower().split('x'))
+    summary = generate_takeout(Path(args.dest), args.photos, args.pngs, args.videos, args.albums, args.parts,
+                               (width, height), int(args.video_mb * 1024 * 1024), args.duplicate_ratio,
+                               seed=args.seed)
+    print(f"Wrote {summary.media_files} media files ({summary.media_bytes / (1024 * 1024):.1f} MB, "
+          f"{summary.duplicates} cross-album duplicates) in {len(summary.archives)} archives to {args.dest}")
+
+
+if __name__ == '__main__':
+    main()
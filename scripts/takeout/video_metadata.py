@@ -0,0 +1,99 @@
+"""
+Container metadata checks for videos in the takeout importer.
+
+Most phone videos already carry the creation time and location that Google
+stores in the sidecar, so remuxing them only rewrites gigabytes to produce the
+same tags. probe_tags reads the container tags once per file version with
+ffprobe and metadata_matches decides whether a remux would change anything.
+"""
+
+import os
+import re
+import threading
+from collections import OrderedDict
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Dict, Optional, Tuple
+
+# ffprobe results kept per process, keyed by path and file version
+PROBE_CACHE_SIZE = 4096
+
+# Coordinates that differ by less than this (about 10 m) are considered equal
+LOCATION_TOLERANCE = 1e-4
+
+# Tags that decide whether a remux is needed. The title is the file name, which
+# Google's videos never carry, so comparing it would make every video remux.
+COMPARED_TAGS = ('creation_time', 'location', 'location-eng', 'comment')
+
+# Fractional seconds, which are compared away anyway. Before Python 3.11
+# datetime.fromisoformat only accepts exactly three or six digits.
+FRACTION_PATTERN = re.compile(r'(?<=:\d\d)\.\d+')
+
+ISO6709_PATTERN = re.compile(r'^(?P<lat>[+-]\d+(?:\.\d*)?)(?P<lon>[+-]\d+(?:\.\d*)?)')
+
+_cache: 'OrderedDict[Tuple[str, int, int], Dict[str, str]]' = OrderedDict()
+_cache_lock = threading.Lock()
+
+
+def probe_tags(path: Path) -> Dict[str, str]:
+    """Return the container tags of a video, lowercased, from a cached ffprobe run."""
+    stat = os.stat(path)
+    cache_key = (os.fspath(path), stat.st_size, stat.st_mtime_ns)
+    with _cache_lock:
+        if cache_key in _cache:
+            _cache.move_to_end(cache_key)
+            return _cache[cache_key]
+
+    import ffmpeg
+    tags = ffmpeg.probe(os.fspath(path)).get('format', {}).get('tags', {})
+    tags = {name.lower(): value for name, value in tags.items()}
+
+    with _cache_lock:
+        _cache[cache_key] = tags
+        if len(_cache) > PROBE_CACHE_SIZE:
+            _cache.popitem(last=False)
+    return tags
+
+
+def parse_creation_time(value: str) -> Optional[datetime]:
+    """Parse an ffprobe or isoformat creation_time into an aware UTC datetime."""
+    try:
+        parsed = datetime.fromisoformat(FRACTION_PATTERN.sub('', value.strip()).replace('Z', '+00:00'))
+    except ValueError:
+        return None
+    if parsed.tzinfo is None:
+        parsed = parsed.replace(tzinfo=timezone.utc)
+    return parsed.astimezone(timezone.utc).replace(microsecond=0)
+
+
+def parse_location(value: str) -> Optional[Tuple[float, float]]:
+    """Parse the latitude and longitude of an ISO 6709 location string."""
+    match = ISO6709_PATTERN.match(value.strip())
+    if not match:
+        return None
+    return float(match.group('lat')), float(match.group('lon'))
+
+
+def tag_matches(name: str, wanted: str, tags: Dict[str, str]) -> bool:
+    """Return True if the probed tags already hold the wanted value for one ffmpeg metadata key."""
+    if name in ('location', 'location-eng'):
+        # QuickTime files expose the location under the Apple key instead
+        current = tags.get(name) or tags.get('location') or tags.get('com.apple.quicktime.location.iso6709')
+        if current is None:
+            return False
+        have, want = parse_location(current), parse_location(wanted)
+        return (have is not None and want is not None
+                and all(abs(a - b) < LOCATION_TOLERANCE for a, b in zip(have, want)))
+
+    current = tags.get(name)
+    if current is None:
+        return False
+    if name == 'creation_time':
+        have = parse_creation_time(current)
+        return have is not None and have == parse_creation_time(wanted)
+    return current == wanted
+
+
+def metadata_matches(tags: Dict[str, str], ffmpeg_metadata: Dict[str, str]) -> bool:
+    """Return True if remuxing with ffmpeg_metadata would leave the creation time, location and comment unchanged."""
+    return all(tag_matches(name, value, tags) for name, value in ffmpeg_metadata.items() if name in COMPARED_TAGS)
@@ -0,0 +1,198 @@
+"""
+Work plan for a takeout import, built without extracting any media.
+
+TakeoutProcessor.build_plan() reads the central directory of every zip,
+groups the Google Photos members by album and resolves each media file's
+sidecar, wherever it lives. The resulting WorkPlan is what every mode of the
+real run executes, album by album. With --plan, the plan is also analyzed:
+the sidecars are read to find files without usable metadata and duplicates
+that share size, CRC and embedded metadata, and the runtime is estimated from
+the per-stage throughput of the last run report.
+"""
+
+import json
+import zipfile
+from pathlib import Path
+from typing import Callable, Dict, Iterator, List, NamedTuple, Optional, Tuple
+
+from dedup import metadata_digest
+from job_manifest import MemberKey
+
+# MB/s per stage used until a run report is available to calibrate against
+DEFAULT_THROUGHPUT = {'extract': 150.0, 'image': 40.0, 'video': 200.0, 'upload': 40.0}
+
+# Stages whose throughput scales with --workers
+WORKER_STAGES = ('image', 'video')
+
+
+class ArchiveMember(NamedTuple):
+    """A picklable reference to a member of a takeout zip."""
+    archive: Path
+    info: zipfile.ZipInfo
+
+
+class PlannedFile(NamedTuple):
+    """One file of an album and the sidecar it resolved to."""
+    album: str
+    name: str
+    member: ArchiveMember
+    sidecar: Optional[ArchiveMember]
+
+    @property
+    def size(self) -> int:
+        return self.member.info.file_size
+
+    @property
+    def key(self) -> MemberKey:
+        return MemberKey.from_zipinfo(self.member.archive, self.member.info)
+
+
+class AlbumPlan(NamedTuple):
+    """An album's metadata.json and files, in archive order."""
+    name: str
+    metadata: Optional[ArchiveMember]
+    files: List[PlannedFile]
+
+
+def load_calibration(report_path: Optional[Path]) -> Dict[str, float]:
+    """Return MB/s per stage, measured by the run report at report_path where it has data."""
+    throughput = dict(DEFAULT_THROUGHPUT)
+    if report_path is None or not Path(report_path).exists():
+        return throughput
+    try:
+        stages = json.loads(Path(report_path).read_text()).get('stages', {})
+    except (OSError, ValueError):
+        return throughput
+    for stage in throughput:
+        measured = stages.get(stage, {}).get('mb_per_s', 0)
+        if measured > 0:
+            throughput[stage] = measured
+    return throughput
+
+
+class WorkPlan:
+    """Every album and file an import will process."""
+
+    def __init__(self, albums: Dict[str, AlbumPlan], archives: List[Path], archive_bytes: int):
+        self.albums = albums
+        self.archives = archives
+        # Uncompressed size of every member, which a full extraction writes to scratch
+        self.archive_bytes = archive_bytes
+        self.missing_metadata: List[str] = []
+        self.incomplete_metadata: List[str] = []
+        self.duplicates: List[Tuple[str, str]] = []
+        self.duplicate_bytes = 0
+
+    def files(self) -> Iterator[PlannedFile]:
+        for album in self.albums.values():
+            yield from album.files
+
+    def analyze(self, read_sidecar: Callable[[ArchiveMember], Dict], is_media: Callable[[str], bool]) -> None:
+        """Read every sidecar to find files lacking metadata and duplicates the run could link."""
+        first_copies: Dict[Tuple[int, int, str], str] = {}
+        for planned in self.files():
+            if not is_media(planned.name):
+                continue
+            path = f"{planned.album}/{planned.name}"
+            metadata = read_sidecar(planned.sidecar) if planned.sidecar is not None else {}
+            if planned.sidecar is None:
+                self.missing_metadata.append(path)
+            elif not metadata.get('photoTakenTime', {}).get('timestamp'):
+                self.incomplete_metadata.append(path)
+
+            fingerprint = (planned.size, planned.member.info.CRC, metadata_digest(metadata))
+            first = first_copies.setdefault(fingerprint, path)
+            if first != path:
+                self.duplicates.append((path, first))
+                self.duplicate_bytes += planned.size
+
+    def media_totals(self, is_video: Callable[[str], bool], is_media: Callable[[str], bool]) -> Dict[str, int]:
+        totals = dict.fromkeys(('images', 'image_bytes', 'videos', 'video_bytes'), 0)
+        for planned in self.files():
+            if not is_media(planned.name):
+                continue
+            kind = 'video' if is_video(planned.name) else 'image'
+            totals[f'{kind}s'] += 1
+            totals[f'{kind}_bytes'] += planned.size
+        return totals
+
+    def scratch_bytes(self, stream: bool, scratch_budget: Optional[int]) -> int:
+        """Return the most scratch space the run will use."""
+        if stream:
+            return 0
+        if scratch_budget:
+            largest = max((planned.size for planned in self.files()), default=0)
+            return min(self.archive_bytes, max(scratch_budget, largest))
+        return self.archive_bytes
+
+    def estimate_seconds(self, totals: Dict[str, int], throughput: Dict[str, float], stream: bool,
+                         workers: int, dedup: bool, upload: bool, pipeline: bool) -> Dict[str, float]:
+        """Estimate seconds per stage from MB/s per stage."""
+        mb = 1024 * 1024
+        # Linked duplicates are not processed again; assume they are images, the common case
+        saved = self.duplicate_bytes if dedup else 0
+        seconds = {
+            'extract': 0.0 if stream else self.archive_bytes / mb / throughput['extract'],
+            'image': max(0, totals['image_bytes'] - saved) / mb / throughput['image'],
+            'video': totals['video_bytes'] / mb / throughput['video'],
+            'upload': (totals['image_bytes'] + totals['video_bytes']) / mb / throughput['upload'] if upload else 0.0,
+        }
+        for stage in WORKER_STAGES:
+            seconds[stage] /= max(1, workers)
+        processing = seconds['extract'] + seconds['image'] + seconds['video']
+        # Pipelined uploads overlap processing, so the slower side sets the pace
+        seconds['total'] = max(processing, seconds['upload']) if pipeline else processing + seconds['upload']
+        return {stage: round(value, 3) for stage, value in seconds.items()}
+
+    def to_dict(self, is_video: Callable[[str], bool], is_media: Callable[[str], bool], options: Dict,
+                throughput: Dict[str, float]) -> Dict:
+        """Return the plan summary: per-album counts and bytes, metadata gaps, duplicates, space and time."""
+        totals = self.media_totals(is_video, is_media)
+        albums = {}
+        for album in self.albums.values():
+            media = [planned for planned in album.files if is_media(planned.name)]
+            albums[album.name] = {
+                'files': len(media),
+                'bytes': sum(planned.size for planned in media),
+                'videos': sum(1 for planned in media if is_video(planned.name)),
+                'without_sidecar': sum(1 for planned in media if planned.sidecar is None),
+            }
+        output_bytes = totals['image_bytes'] + totals['video_bytes']
+        if options.get('dedup', 'off') != 'off':
+            output_bytes -= self.duplicate_bytes
+        return {
+            'archives': [archive.name for archive in self.archives],
+            'albums': albums,
+            'totals': dict(totals, files=totals['images'] + totals['videos'], albums=len(self.albums)),
+            'missing_metadata': self.missing_metadata,
+            'incomplete_metadata': self.incomplete_metadata,
+            'duplicates': {'count': len(self.duplicates), 'bytes': self.duplicate_bytes,
+                           'files': [{'file': path, 'first': first} for path, first in self.duplicates]},
+            'scratch_bytes': self.scratch_bytes(options.get('stream', False), options.get('scratch_budget')),
+            'output_bytes': output_bytes,
+            'throughput_mb_per_s': throughput,
+            'estimated_seconds': self.estimate_seconds(
+                totals, throughput, options.get('stream', False), options.get('workers', 1),
+                options.get('dedup', 'off') != 'off', options.get('upload', False), options.get('pipeline', False)),
+        }
+
+
+def format_summary(summary: Dict) -> List[str]:
+    """Return log lines describing a plan summary from WorkPlan.to_dict()."""
+    gb = 1024 ** 3
+    totals = summary['totals']
+    lines = [f"Plan: {totals['files']} media files ({totals['images']} images, {totals['videos']} videos) "
+             f"in {totals['albums']} albums across {len(summary['archives'])} archives"]
+    for name, album in summary['albums'].items():
+        lines.append(f"  {name}: {album['files']} files, {album['bytes'] / (1024 * 1024):.1f} MB"
+                     + (f", {album['without_sidecar']} without sidecar" if album['without_sidecar'] else ''))
+    lines.append(f"Without sidecar: {len(summary['missing_metadata'])}, "
+                 f"sidecar without photo time: {len(summary['incomplete_metadata'])}")
+    lines.append(f"Duplicates: {summary['duplicates']['count']} "
+                 f"({summary['duplicates']['bytes'] / gb:.2f} GB)")
+    lines.append(f"Scratch space: {summary['scratch_bytes'] / gb:.2f} GB, "
+                 f"output: {summary['output_bytes'] / gb:.2f} GB")
+    estimate = summary['estimated_seconds']
+    lines.append(f"Estimated runtime: {estimate['total']:.0f}s ({estimate['total'] / 60:.1f} min; " +
+                 ', '.join(f"{stage} {seconds:.0f}s" for stage, seconds in estimate.items() if stage != 'total') + ")")
+    return lines
@@ -0,0 +1,93 @@
+"""
+Byte-range copies of stored zip members.
+
+Takeout stores media that is already compressed (JPEG, HEIC, MP4) with
+ZIP_STORED, so a member's bytes sit verbatim in the archive right after its
+local file header. Reading them through zipfile moves every byte through a
+Python read loop and a bytes object per chunk. copy_stored() finds where the
+data starts from the local header and copies the range in the kernel with
+copy_file_range or sendfile. Where neither works it writes slices of an mmap
+of the range.
+
+The CRC-32 is still checked, and the SHA-1 for the integrity manifest is
+taken at the same time. Both run over memoryview slices of the same mapping,
+so no bytes are copied into Python objects. The check runs before anything
+is written, so a corrupt member never reaches its target.
+"""
+
+import hashlib
+import mmap
+import os
+import struct
+import zipfile
+import zlib
+from pathlib import Path
+
+import integrity
+import placement
+
+LOCAL_HEADER_SIGNATURE = b'PK\x03\x04'
+LOCAL_HEADER_SIZE = 30
+
+# Bytes per CRC and hash update, and per write when falling back to the mapping
+CHUNK_SIZE = 8 * 1024 * 1024
+
+
+def is_stored(info: zipfile.ZipInfo) -> bool:
+    """Return True for a member stored without compression or encryption."""
+    return info.compress_type == zipfile.ZIP_STORED and not info.flag_bits & 0x1
+
+
+def data_offset(fd: int, info: zipfile.ZipInfo) -> int:
+    """Return where a member's bytes start in the archive.
+
+    The local header's name and extra field lengths can differ from the
+    central directory's, so they are read from the local header itself.
+    """
+    header = os.pread(fd, LOCAL_HEADER_SIZE, info.header_offset)
+    if len(header) != LOCAL_HEADER_SIZE or header[:4] != LOCAL_HEADER_SIGNATURE:
+        raise zipfile.BadZipFile(f"Bad local file header for {info.filename!r}")
+    name_size, extra_size = struct.unpack('<HH', header[26:30])
+    return info.header_offset + LOCAL_HEADER_SIZE + name_size + extra_size
+
+
+def copy_stored(archive: Path, info: zipfile.ZipInfo, target: Path) -> str:
+    """Copy a stored member's bytes from archive to target and return their digest.
+
+    Raises zipfile.BadZipFile if the member is truncated or fails its CRC check.
+    """
+    with open(archive, 'rb') as source:
+        fd = source.fileno()
+        start = data_offset(fd, info)
+        size = info.file_size
+        if start + size > os.fstat(fd).st_size:
+            raise zipfile.BadZipFile(f"{info.filename!r} is truncated")
+
+        hasher = hashlib.new(integrity.HASH_NAME)
+        if not size:
+            if info.CRC != 0:
+                raise zipfile.BadZipFile(f"Bad CRC-32 for file {info.filename!r}")
+            open(target, 'wb').close()
+            return hasher.hexdigest()
+
+        # Mappings start on an allocation boundary
+        aligned = start - start % mmap.ALLOCATIONGRANULARITY
+        skip = start - aligned
+        with mmap.mmap(fd, skip + size, access=mmap.ACCESS_READ, offset=aligned) as mapped, \
+                memoryview(mapped) as view:
+            crc = 0
+            for offset in range(skip, skip + size, CHUNK_SIZE):
+                with view[offset:min(offset + CHUNK_SIZE, skip + size)] as chunk:
+                    crc = zlib.crc32(chunk, crc)
+                    hasher.update(chunk)
+            if crc != info.CRC:
+                raise zipfile.BadZipFile(f"Bad CRC-32 for file {info.filename!r}")
+
+            with open(target, 'wb') as out:
+                if placement.copy_range(fd, out.fileno(), start, size) is None:
+                    out.seek(0)
+                    out.truncate()
+                    for offset in range(skip, skip + size, CHUNK_SIZE):
+                        with view[offset:min(offset + CHUNK_SIZE, skip + size)] as chunk:
+                            out.write(chunk)
+    return hasher.hexdigest()
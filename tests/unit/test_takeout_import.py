@@ -0,0 +1,1650 @@
+#!/usr/bin/env python3
+"""
+Unit tests for the Google Photos takeout importer.
+These tests build small synthetic takeout archives in a temporary directory.
+"""
+
+import argparse
+import hashlib
+import io
+import json
+import logging
+import os
+import random
+import subprocess
+import sys
+import tempfile
+import threading
+import unittest
+import zipfile
+from concurrent.futures import ThreadPoolExecutor
+from unittest import mock
+from pathlib import Path
+
+TAKEOUT_DIR = Path(__file__).parent.parent.parent / "scripts" / "takeout"
+sys.path.insert(0, str(TAKEOUT_DIR))
+
+import piexif
+from PIL import Image, ImageEnhance
+
+import benchmark
+import exiftool_writer
+import immich_upload
+import integrity
+import jpeg_exif
+import media_formats
+import near_duplicates
+import placement
+import run_logging
+import scheduler
+import video_metadata
+import zip_range
+from enhanced_takeout_import import TakeoutProcessor, chunk_paths, parse_backend, parse_size
+from fake_immich import FakeImmichServer
+from import_index import ImportIndex
+from job_manifest import JobManifest, MemberKey, STATE_EMBEDDED, STATE_FAILED
+from part_watcher import PartWatcher, end_record_valid
+from run_report import Instrumentation
+from sidecar_index import SidecarIndex
+from synthetic_takeout import generate_takeout
+
+
+def make_jpeg(color=(200, 100, 50), size=(64, 48), exif: bytes = None) -> bytes:
+    """Return the bytes of a small JPEG image."""
+    buffer = io.BytesIO()
+    if exif:
+        Image.new("RGB", size, color).save(buffer, format="JPEG", exif=exif)
+    else:
+        Image.new("RGB", size, color).save(buffer, format="JPEG")
+    return buffer.getvalue()
+
+
+def make_sidecar(title: str, timestamp: int = 1532281602, **extra) -> bytes:
+    """Return a Google Photos supplemental-metadata JSON document."""
+    metadata = {
+        "title": title,
+        "description": "",
+        "photoTakenTime": {"timestamp": str(timestamp)},
+        "geoData": {"latitude": 40.3992889, "longitude": -105.8353333, "altitude": 3061.0},
+    }
+    metadata.update(extra)
+    return json.dumps(metadata).encode()
+
+
+def write_takeout_zip(path: Path, members: dict) -> None:
+    """Write a takeout zip whose members live under Takeout/Google Photos/."""
+    with zipfile.ZipFile(path, "w") as zip_ref:
+        for name, data in members.items():
+            zip_ref.writestr(f"Takeout/Google Photos/{name}", data)
+
+
+class TakeoutTestCase(unittest.TestCase):
+
+    def setUp(self):
+        """Create a temporary takeout and output directory."""
+        self.tmp = tempfile.TemporaryDirectory()
+        self.root = Path(self.tmp.name)
+        self.takeout_dir = self.root / "takeout"
+        self.output_dir = self.root / "output"
+        self.takeout_dir.mkdir()
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def write_sample_takeout(self) -> None:
+        """Write a two-part takeout with an album split across both zips."""
+        write_takeout_zip(self.takeout_dir / "takeout-001.zip", {
+            "Trip/metadata.json": json.dumps({"title": "Trip"}).encode(),
+            "Trip/IMG_0001.jpg": make_jpeg(),
+            "Trip/IMG_0001.jpg.supplemental-metadata.json": make_sidecar("IMG_0001.jpg"),
+            "Trip/notes.txt": b"not media",
+        })
+        write_takeout_zip(self.takeout_dir / "takeout-002.zip", {
+            "Trip/IMG_0002.jpg": make_jpeg((10, 20, 30)),
+            "Trip/IMG_0002.jpg.json": make_sidecar("IMG_0002.jpg", description="Lake"),
+            "Photos from 2019/IMG_0003.jpg": make_jpeg((0, 0, 255)),
+        })
+
+    def make_processor(self, output_dir: Path = None, **kwargs) -> TakeoutProcessor:
+        return TakeoutProcessor(str(self.takeout_dir), str(output_dir or self.output_dir), **kwargs)
+
+    def assert_same_output(self, first: Path, second: Path) -> None:
+        """Assert that two processed/ trees contain the same files with the same bytes."""
+        first_files = sorted(p.relative_to(first) for p in first.rglob("*") if p.is_file())
+        second_files = sorted(p.relative_to(second) for p in second.rglob("*") if p.is_file())
+        self.assertEqual(first_files, second_files)
+        for relative in first_files:
+            self.assertEqual((first / relative).read_bytes(), (second / relative).read_bytes())
+
+
+class TestStreamingImport(TakeoutTestCase):
+
+    def test_stream_matches_extracted_output(self):
+        """Streaming straight from the zips produces the same tree as extract-then-process."""
+        self.write_sample_takeout()
+
+        extracted = self.make_processor()
+        extracted.process_all()
+        streamed = self.make_processor(self.root / "streamed", stream=True)
+        streamed.process_all()
+
+        self.assert_same_output(self.output_dir / "processed", self.root / "streamed" / "processed")
+        self.assertEqual(extracted.stats, streamed.stats)
+
+    def test_stream_does_not_extract(self):
+        """Streaming mode never creates the intermediate extraction tree."""
+        self.write_sample_takeout()
+        processor = self.make_processor(stream=True)
+        processor.process_all()
+
+        self.assertFalse((self.output_dir / "extracted").exists())
+        exif = piexif.load(str(self.output_dir / "processed" / "Trip" / "IMG_0002.jpg"))
+        self.assertEqual(exif["0th"][piexif.ImageIFD.ImageDescription], b"Lake")
+        self.assertEqual(exif["Exif"][piexif.ExifIFD.DateTimeOriginal], b"2018:07:22 17:46:42")
+        self.assertEqual(processor.stats['processed_images'], 3)
+        self.assertEqual(processor.stats['skipped_files'], 1)
+        self.assertEqual(processor.stats['albums_created'], 2)
+
+
+class TestParallelWorkers(TakeoutTestCase):
+
+    def assert_same_as_serial(self, **kwargs):
+        """Run serially and with a worker pool and compare output bytes and stats."""
+        self.write_sample_takeout()
+        serial = self.make_processor(stream=kwargs.get("stream", False))
+        serial.process_all()
+        parallel = self.make_processor(self.root / "parallel", **kwargs)
+        parallel.process_all()
+
+        self.assert_same_output(self.output_dir / "processed", self.root / "parallel" / "processed")
+        self.assertEqual(serial.stats, parallel.stats)
+
+    def test_process_pool_matches_serial(self):
+        self.assert_same_as_serial(workers=2)
+
+    def test_thread_pool_matches_serial(self):
+        self.assert_same_as_serial(workers=3, worker_type="thread")
+
+    def test_process_pool_streaming_matches_serial(self):
+        self.assert_same_as_serial(workers=2, stream=True)
+
+
+class TestJpegSplice(TakeoutTestCase):
+
+    def piexif_reference(self, source: Path, metadata: dict) -> bytes:
+        """Return what the copy-then-piexif.insert path produces for source."""
+        processor = self.make_processor()
+        reference = self.root / "reference.jpg"
+        reference.write_bytes(source.read_bytes())
+        piexif.insert(processor.build_exif_bytes(str(source), metadata), str(reference))
+        return reference.read_bytes()
+
+    def test_splice_matches_piexif_insert(self):
+        """The single-write path produces exactly the bytes piexif.insert would."""
+        metadata = json.loads(make_sidecar("IMG.jpg", description="Summit"))
+        existing = piexif.dump({"0th": {piexif.ImageIFD.Model: b"Pixel"}, "Exif": {}, "GPS": {}})
+        sources = {
+            "jfif.jpg": make_jpeg(size=(640, 480)),
+            "exif.jpg": make_jpeg(size=(640, 480), exif=existing),
+        }
+        processor = self.make_processor()
+        for name, data in sources.items():
+            source = self.root / name
+            source.write_bytes(data)
+            output = self.root / f"out-{name}"
+            self.assertTrue(processor.process_image_metadata(source, metadata, output))
+            self.assertEqual(output.read_bytes(), self.piexif_reference(source, metadata), name)
+
+        exif = piexif.load(str(self.root / "out-exif.jpg"))
+        self.assertEqual(exif["0th"][piexif.ImageIFD.Model], b"Pixel")
+        self.assertEqual(exif["0th"][piexif.ImageIFD.ImageDescription], b"Summit")
+
+    def test_splice_keeps_source_times(self):
+        source = self.root / "IMG.jpg"
+        source.write_bytes(make_jpeg())
+        os.utime(source, ns=(1_500_000_000_000_000_000, 1_400_000_000_000_000_000))
+        output = self.root / "out.jpg"
+        self.assertTrue(self.make_processor().process_image_metadata(source, {}, output))
+        self.assertEqual(output.stat().st_mtime_ns, 1_400_000_000_000_000_000)
+
+    def test_header_read_stops_at_scan_data(self):
+        """Only the header segments are read; the stream is left at the scan data."""
+        data = make_jpeg(size=(256, 256))
+        stream = io.BytesIO(data)
+        segments = jpeg_exif.read_header_segments(stream)
+        self.assertEqual(segments[-1], jpeg_exif.SOS_MARKER)
+        self.assertEqual(stream.tell(), sum(len(segment) for segment in segments))
+        self.assertLess(stream.tell(), len(data))
+
+    def test_invalid_jpeg_falls_back_to_copy(self):
+        """Data that is not a JPEG is copied unchanged and reported as a failure."""
+        source = self.root / "broken.jpg"
+        source.write_bytes(b"not a jpeg at all")
+        output = self.root / "out.jpg"
+        self.assertFalse(self.make_processor().process_image_metadata(source, {}, output))
+        self.assertEqual(output.read_bytes(), source.read_bytes())
+
+
+class TestExifToolBackend(TakeoutTestCase):
+
+    def test_backend_selection(self):
+        self.assertEqual(parse_backend("PNG=exiftool"), (".png", "exiftool"))
+        with self.assertRaises(argparse.ArgumentTypeError):
+            parse_backend(".png=imagemagick")
+        processor = self.make_processor(metadata_backends={".heic": "piexif"})
+        self.assertEqual(processor.metadata_backends[".heic"], "piexif")
+
+    def test_tags_match_piexif_fields(self):
+        processor = self.make_processor()
+        metadata = json.loads(make_sidecar("IMG_0001.heic", description="Line one\nA & B",
+                                           googlePhotosOrigin={"mobileUpload": {"deviceType": "IOS_PHONE"}}))
+        tags = processor.build_exiftool_tags(metadata)
+        self.assertIn("-EXIF:DateTimeOriginal=2018:07:22 17:46:42", tags)
+        self.assertIn("-EXIF:GPSLongitudeRef=W", tags)
+        self.assertIn("-EXIF:GPSLongitude=105.8353333", tags)
+        self.assertIn("-EXIF:ImageDescription=Line one&#xa;A &amp; B", tags)
+        self.assertIn("-EXIF:Make=Google Photos (IOS_PHONE)", tags)
+        self.assertFalse(any("\n" in tag for tag in tags))
+
+    def test_unresponsive_process_is_closed_before_restart(self):
+        def fake_process(reply):
+            process = mock.Mock(stdin=io.BytesIO(), stdout=io.BytesIO(reply), stderr=io.BytesIO(reply))
+            process.poll.return_value = None
+            return process
+
+        hung = fake_process(b"")
+        hung.wait.side_effect = [subprocess.TimeoutExpired("exiftool", 5), 0]
+        fresh = fake_process(b"{ready2}\n")
+        exiftool = exiftool_writer.ExifTool()
+        with mock.patch.object(exiftool_writer.subprocess, "Popen", side_effect=[hung, fresh]) as popen:
+            with self.assertRaises(exiftool_writer.ExifToolError):
+                exiftool.execute(["-ver"])
+            hung.terminate.assert_not_called()
+            self.assertEqual(exiftool.execute(["-ver"]), "")
+        self.assertEqual(popen.call_count, 2)
+        self.assertTrue(hung.stdin.closed)
+        hung.terminate.assert_called_once_with()
+        hung.kill.assert_called_once_with()
+        self.assertIs(exiftool.process, fresh)
+        exiftool._finalizer.detach()
+
+    @unittest.skipUnless(exiftool_writer.available(), "exiftool is not installed")
+    def test_png_metadata_written_by_one_process(self):
+        buffer = io.BytesIO()
+        Image.new("RGB", (32, 24), (1, 2, 3)).save(buffer, format="PNG")
+        write_takeout_zip(self.takeout_dir / "takeout-001.zip", {
+            "Trip/IMG_0001.png": buffer.getvalue(),
+            "Trip/IMG_0001.png.json": make_sidecar("IMG_0001.png", description="Lake"),
+            "Trip/IMG_0002.png": buffer.getvalue(),
+            "Trip/IMG_0002.png.json": make_sidecar("IMG_0002.png"),
+        })
+        processor = self.make_processor(stream=True, metadata_backends={".png": "exiftool"})
+        processor.process_all()
+        self.assertEqual(processor.stats['errors'], 0)
+        with Image.open(self.output_dir / "processed" / "Trip" / "IMG_0001.png") as image:
+            exif = image.getexif()
+        self.assertEqual(exif[piexif.ImageIFD.ImageDescription], "Lake")
+        self.assertEqual(processor.timings.stages["exiftool"].count, 2)
+
+
+class GifProcessor(TakeoutProcessor):
+    """Processor with handler methods for a format the registry does not know by default."""
+
+    def process_gif_file(self, path, metadata, output_path):
+        output_path.write_bytes(path.read_bytes())
+        return True
+
+    def process_gif_member(self, zip_ref, info, metadata, output_path):
+        output_path.write_bytes(zip_ref.read(info))
+        return True
+
+
+class TestFormatRegistry(TakeoutTestCase):
+
+    def test_import_skips_heavy_modules(self):
+        code = ("import sys, enhanced_takeout_import; "
+                "print(sorted(m for m in ('piexif', 'ffmpeg', 'PIL', 'pillow_heif') if m in sys.modules))")
+        result = subprocess.run([sys.executable, "-c", code], cwd=self.root, capture_output=True, text=True,
+                                env={"PYTHONPATH": str(TAKEOUT_DIR)}, check=True)
+        self.assertEqual(result.stdout.strip(), "[]")
+
+    def test_registered_format_is_processed(self):
+        saved = dict(media_formats._handlers)
+        self.addCleanup(lambda: (media_formats._handlers.clear(), media_formats._handlers.update(saved)))
+        media_formats.register(media_formats.FormatHandler(
+            'gif', media_formats.KIND_IMAGE, ('.gif',), 'process_gif_file', 'process_gif_member'))
+        write_takeout_zip(self.takeout_dir / "takeout-001.zip", {
+            "Trip/anim.gif": b"GIF89a",
+            "Trip/anim.gif.supplemental-metadata.json": make_sidecar("anim.gif"),
+        })
+        for stream in (False, True):
+            output_dir = self.root / f"output-{stream}"
+            processor = GifProcessor(str(self.takeout_dir), str(output_dir), stream=stream)
+            processor.process_all()
+            self.assertEqual(processor.stats['processed_images'], 1)
+            self.assertEqual((output_dir / "processed" / "Trip" / "anim.gif").read_bytes(), b"GIF89a")
+
+
+class TestSidecarIndex(unittest.TestCase):
+
+    def test_google_naming_quirks(self):
+        """Each known Google naming quirk resolves to its sidecar."""
+        long_name = "PXL_20230101_120000123.NIGHT.jpg"
+        index = SidecarIndex([
+            "metadata.json",
+            "IMG_0001.jpg", "IMG_0001.jpg.supplemental-metadata.json",
+            "IMG_0002.jpg", "IMG_0002.jpg.json",
+            long_name, "PXL_20230101_120000123.NIGHT.jpg.supplemental-.json",
+            "IMG_0003(1).jpg", "IMG_0003.jpg.supplemental-metadata(1).json",
+            "IMG_0004(2).jpg", "IMG_0004.jpg(2).json",
+            "IMG_0005-edited.jpg", "IMG_0005.jpg", "IMG_0005.jpg.supplemental-metadata.json",
+            "IMG_0006.jpg",
+        ])
+        self.assertTrue(index.has_album_metadata)
+        self.assertEqual(index.resolve("IMG_0001.jpg"), "IMG_0001.jpg.supplemental-metadata.json")
+        self.assertEqual(index.resolve("IMG_0002.jpg"), "IMG_0002.jpg.json")
+        self.assertEqual(index.resolve(long_name), "PXL_20230101_120000123.NIGHT.jpg.supplemental-.json")
+        self.assertEqual(index.resolve("IMG_0003(1).jpg"), "IMG_0003.jpg.supplemental-metadata(1).json")
+        self.assertEqual(index.resolve("IMG_0004(2).jpg"), "IMG_0004.jpg(2).json")
+        self.assertEqual(index.resolve("IMG_0005-edited.jpg"), "IMG_0005.jpg.supplemental-metadata.json")
+        self.assertIsNone(index.resolve("IMG_0006.jpg"))
+        self.assertNotIn("metadata.json", index.media)
+
+
+class TestSidecarQuirksImport(TakeoutTestCase):
+
+    def test_truncated_and_edited_sidecars_are_used(self):
+        """Metadata is recovered for truncated, duplicate and edited names in both modes."""
+        long_name = "Screenshot_20200101-120000_Google_Photos_app.jpg"
+        write_takeout_zip(self.takeout_dir / "takeout-001.zip", {
+            f"Album/{long_name}": make_jpeg(),
+            f"Album/{(long_name + '.supplemental-metadata')[:46]}.json": make_sidecar(long_name, description="Long"),
+            "Album/IMG_0005-edited.jpg": make_jpeg(),
+            "Album/IMG_0005.jpg.supplemental-metadata.json": make_sidecar("IMG_0005.jpg", description="Edit"),
+        })
+        for stream in (False, True):
+            output_dir = self.root / f"output-{stream}"
+            self.make_processor(output_dir, stream=stream).process_all()
+            album = output_dir / "processed" / "Album"
+            self.assertEqual(piexif.load(str(album / long_name))["0th"][piexif.ImageIFD.ImageDescription], b"Long")
+            self.assertEqual(piexif.load(str(album / "IMG_0005-edited.jpg"))["0th"][piexif.ImageIFD.ImageDescription],
+                             b"Edit")
+
+
+class TestDuplicateLinking(TakeoutTestCase):
+
+    def write_duplicated_takeout(self) -> None:
+        """Write a takeout where one photo appears in a year folder and an album."""
+        photo, sidecar = make_jpeg(), make_sidecar("IMG_0001.jpg")
+        write_takeout_zip(self.takeout_dir / "takeout-001.zip", {
+            "Photos from 2018/IMG_0001.jpg": photo,
+            "Photos from 2018/IMG_0001.jpg.supplemental-metadata.json": sidecar,
+            # Same size as IMG_0001 but different pixels
+            "Photos from 2018/IMG_0002.jpg": make_jpeg((201, 100, 50)),
+        })
+        write_takeout_zip(self.takeout_dir / "takeout-002.zip", {
+            "Trip/IMG_0001.jpg": photo,
+            "Trip/IMG_0001.jpg.supplemental-metadata.json": sidecar,
+            "Trip/IMG_0009.jpg": photo,
+            "Trip/IMG_0009.jpg.supplemental-metadata.json": make_sidecar("IMG_0009.jpg", description="Other"),
+        })
+
+    def test_duplicates_are_hardlinked(self):
+        """A photo repeated across albums is linked, and the output matches a run without dedup."""
+        self.write_duplicated_takeout()
+        for stream in (False, True):
+            output_dir = self.root / f"dedup-{stream}"
+            processor = self.make_processor(output_dir, stream=stream, dedup="hardlink")
+            processor.process_all()
+            plain_dir = self.root / f"plain-{stream}"
+            self.make_processor(plain_dir, stream=stream).process_all()
+
+            self.assert_same_output(plain_dir / "processed", output_dir / "processed")
+            processed = output_dir / "processed"
+            self.assertEqual((processed / "Photos from 2018" / "IMG_0001.jpg").stat().st_ino,
+                             (processed / "Trip" / "IMG_0001.jpg").stat().st_ino)
+            # Different sidecar metadata means a different output file
+            self.assertNotEqual((processed / "Trip" / "IMG_0009.jpg").stat().st_ino,
+                                (processed / "Trip" / "IMG_0001.jpg").stat().st_ino)
+            self.assertEqual(processor.stats['duplicates'], 1)
+            self.assertGreater(processor.stats['bytes_saved'], 0)
+            self.assertEqual(processor.stats['processed_images'], 4)
+
+    def test_duplicates_with_workers(self):
+        self.write_duplicated_takeout()
+        processor = self.make_processor(dedup="hardlink", workers=2, worker_type="thread")
+        processor.process_all()
+        self.assertEqual(processor.stats['duplicates'], 1)
+        self.assertEqual(processor.stats['processed_images'], 4)
+
+
+class ProbedProcessor(TakeoutProcessor):
+    """Processor with canned ffprobe tags that records remuxes instead of running ffmpeg."""
+
+    probed_tags = {}
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.remuxed = []
+
+    def probe_video(self, video_path):
+        return self.probed_tags
+
+    def remux_video(self, source_path, output_path, ffmpeg_metadata):
+        self.remuxed.append(source_path.name)
+        output_path.write_bytes(source_path.read_bytes())
+
+
+class TestVideoRemux(TakeoutTestCase):
+
+    def write_video_takeout(self) -> None:
+        write_takeout_zip(self.takeout_dir / "takeout-001.zip", {
+            "Trip/VID_0001.mp4": b"not really an mp4",
+            "Trip/VID_0001.mp4.supplemental-metadata.json": make_sidecar("VID_0001.mp4"),
+        })
+
+    def test_matching_tags(self):
+        """ffprobe's spelling of the sidecar's tags counts as a match."""
+        wanted = TakeoutProcessor("in", "out").build_video_metadata(json.loads(make_sidecar("VID_0001.mp4")))
+        # What ffprobe reports for an iPhone video: no title, the location under the Apple key
+        tags = {"major_brand": "qt  ", "creation_time": "2018-07-22T17:46:42.000000Z",
+                "com.apple.quicktime.location.iso6709": "+40.3993-105.8353+3061.000/",
+                "com.apple.quicktime.make": "Apple"}
+        self.assertIn("title", wanted)
+        self.assertTrue(video_metadata.metadata_matches(tags, wanted))
+        self.assertFalse(video_metadata.metadata_matches(dict(tags, creation_time="2020-01-01T00:00:00Z"), wanted))
+        self.assertFalse(video_metadata.metadata_matches({"major_brand": "isom"}, wanted))
+        self.assertTrue(video_metadata.metadata_matches(dict(tags, creation_time="2018-07-22T17:46:42.12Z"), wanted))
+
+        # A sidecar description has to be in the container already
+        described = TakeoutProcessor("in", "out").build_video_metadata(
+            json.loads(make_sidecar("VID_0001.mp4", description="Lake")))
+        self.assertFalse(video_metadata.metadata_matches(tags, described))
+        self.assertTrue(video_metadata.metadata_matches(dict(tags, comment="Lake"), described))
+
+    def test_remux_skipped_when_tags_match(self):
+        self.write_video_takeout()
+        ProbedProcessor.probed_tags = {"major_brand": "isom", "creation_time": "2018-07-22T17:46:42.000000Z",
+                                       "location": "+40.3993-105.8353/"}
+        for stream in (False, True):
+            output_dir = self.root / f"output-{stream}"
+            processor = ProbedProcessor(str(self.takeout_dir), str(output_dir), stream=stream)
+            processor.process_all()
+            self.assertEqual(processor.remuxed, [])
+            self.assertEqual(processor.stats['processed_videos'], 1)
+            album = output_dir / "processed" / "Trip"
+            self.assertEqual((album / "VID_0001.mp4").read_bytes(), b"not really an mp4")
+            self.assertEqual(sorted(p.name for p in album.iterdir()), ["VID_0001.mp4"])
+            if not stream:
+                # The extracted copy is renamed into place rather than copied
+                self.assertIn("place_rename", processor.timings.stages)
+                self.assertFalse((output_dir / "extracted" / "Takeout" / "Google Photos" / "Trip"
+                                  / "VID_0001.mp4").exists())
+
+    def test_remux_reads_source_directly(self):
+        """A needed remux reads the extracted file itself rather than a copy of it."""
+        self.write_video_takeout()
+        ProbedProcessor.probed_tags = {}
+        processor = ProbedProcessor(str(self.takeout_dir), str(self.output_dir))
+        processor.process_all()
+        self.assertEqual(processor.remuxed, ["VID_0001.mp4"])
+        self.assertEqual(sorted(p.name for p in (self.output_dir / "processed" / "Trip").iterdir()),
+                         ["VID_0001.mp4"])
+
+
+    def test_streamed_video_is_staged_outside_processed(self):
+        """Until a streamed video is finished, processed/ holds nothing an upload could pick up."""
+        self.write_video_takeout()
+        seen = []
+
+        class CheckingProcessor(ProbedProcessor):
+            def remux_video(self, source_path, output_path, ffmpeg_metadata):
+                seen.append(sorted(p.name for p in (self.output_dir / "processed").rglob("*") if p.is_file()))
+                seen.append(source_path.relative_to(self.output_dir).parts[0])
+                super().remux_video(source_path, output_path, ffmpeg_metadata)
+
+        # Left behind by an interrupted run
+        leftover = self.output_dir / "staging" / "Trip" / "VID_0009.stream.mp4"
+        leftover.parent.mkdir(parents=True)
+        leftover.write_bytes(b"partial")
+        ProbedProcessor.probed_tags = {}
+        processor = CheckingProcessor(str(self.takeout_dir), str(self.output_dir), stream=True)
+        processor.process_all()
+        self.assertEqual(seen, [[], "staging"])
+        self.assertEqual(sorted(p.name for p in (self.output_dir / "processed" / "Trip").iterdir()),
+                         ["VID_0001.mp4"])
+        self.assertFalse((self.output_dir / "staging").exists())
+
+
+class TestStoredPassthrough(TakeoutTestCase):
+
+    def write_video_zip(self, compression=zipfile.ZIP_STORED) -> Path:
+        part = self.takeout_dir / "takeout-001.zip"
+        with zipfile.ZipFile(part, "w", compression) as zip_ref:
+            zip_ref.writestr("Takeout/Google Photos/Trip/notes.txt", b"x" * 1000)
+            zip_ref.writestr("Takeout/Google Photos/Trip/VID_0001.mp4", bytes(range(256)) * 4000)
+        return part
+
+    def test_copy_stored_member(self):
+        """A stored member is copied as a byte range, through the kernel or the mapped archive."""
+        part = self.write_video_zip()
+        with zipfile.ZipFile(part) as zip_ref:
+            info = zip_ref.getinfo("Takeout/Google Photos/Trip/VID_0001.mp4")
+            expected = zip_ref.read(info)
+        self.assertTrue(zip_range.is_stored(info))
+
+        for name, copy_range in (("kernel", placement.copy_range), ("mapped", lambda *args: None)):
+            with self.subTest(name), mock.patch.object(placement, "copy_range", copy_range):
+                target = self.root / f"{name}.mp4"
+                digest = zip_range.copy_stored(part, info, target)
+                self.assertEqual(target.read_bytes(), expected)
+                self.assertEqual(digest, hashlib.sha1(expected).hexdigest())
+
+    def test_corrupt_member_fails_crc(self):
+        part = self.write_video_zip()
+        with zipfile.ZipFile(part) as zip_ref:
+            info = zip_ref.getinfo("Takeout/Google Photos/Trip/VID_0001.mp4")
+        data = bytearray(part.read_bytes())
+        data[info.header_offset + 200] ^= 0xFF
+        part.write_bytes(bytes(data))
+
+        target = self.root / "corrupt.mp4"
+        with self.assertRaises(zipfile.BadZipFile):
+            zip_range.copy_stored(part, info, target)
+        self.assertFalse(target.exists())
+
+    def test_stream_video_skips_zipfile_reads(self):
+        """A stored video whose tags need no change never goes through zipfile's read loop."""
+        part = self.write_video_zip()
+        processor = self.make_processor(stream=True)
+        output = self.root / "VID_0001.mp4"
+        with zipfile.ZipFile(part) as zip_ref, mock.patch.object(zipfile.ZipFile, "open") as zip_open:
+            info = zip_ref.getinfo("Takeout/Google Photos/Trip/VID_0001.mp4")
+            self.assertTrue(processor.process_video_member(zip_ref, info, {}, output))
+            zip_open.assert_not_called()
+        self.assertEqual(output.read_bytes(), bytes(range(256)) * 4000)
+        self.assertEqual(processor._output_digests[output], integrity.hash_file(output))
+
+    def test_deflated_members_still_inflate(self):
+        part = self.write_video_zip(zipfile.ZIP_DEFLATED)
+        processor = self.make_processor()
+        with zipfile.ZipFile(part) as zip_ref:
+            info = zip_ref.getinfo("Takeout/Google Photos/Trip/VID_0001.mp4")
+            self.assertFalse(zip_range.is_stored(info))
+            digest = processor.write_member(part, info, self.root / "inflated.mp4", zip_ref)
+        self.assertEqual(digest, hashlib.sha1(bytes(range(256)) * 4000).hexdigest())
+
+
+class TestPlacement(unittest.TestCase):
+
+    def test_tiers(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            root = Path(tmp)
+            source = root / "source.mp4"
+            source.write_bytes(b"video" * 100000)
+
+            tier = placement.place_file(source, root / "copy.mp4")
+            self.assertIn(tier, placement.PLACEMENT_TIERS[1:])
+            self.assertEqual((root / "copy.mp4").read_bytes(), source.read_bytes())
+            self.assertEqual((root / "copy.mp4").stat().st_mtime, source.stat().st_mtime)
+
+            self.assertEqual(placement.place_file(root / "copy.mp4", root / "moved.mp4", move=True), "rename")
+            self.assertFalse((root / "copy.mp4").exists())
+            self.assertIn(placement.kernel_copy(source, root / "kernel.mp4"), (None, "copy_file_range", "sendfile"))
+
+
+class DispatchRecordingProcessor(ProbedProcessor):
+    """Processor that records the order jobs are dispatched in and the queue depth per lane."""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.dispatched = []
+        self.depths = []
+
+    def dispatch(self, job):
+        super().dispatch(job)
+        self.dispatched.append(job.name)
+        self.depths.append(self.queue_depths())
+
+
+class TestSizeAwareScheduling(TakeoutTestCase):
+
+    def test_large_videos_run_first_on_the_io_lane(self):
+        ProbedProcessor.probed_tags = {"creation_time": "2018-07-22T17:46:42.000000Z"}
+        write_takeout_zip(self.takeout_dir / "takeout-001.zip", {
+            "Trip/IMG_0001.jpg": make_jpeg(),
+            "Trip/VID_small.mp4": b"v" * 100,
+            "Later/IMG_0002.jpg": make_jpeg((1, 2, 3)),
+            "Later/VID_big.mp4": b"v" * 5000,
+            "Later/VID_bigger.mp4": b"v" * 9000,
+        })
+        processor = DispatchRecordingProcessor(str(self.takeout_dir), str(self.output_dir), stream=True,
+                                               workers=2, worker_type="thread", large_video_size=1000)
+        processor.process_all()
+
+        self.assertEqual(processor.dispatched[:2], ["VID_bigger.mp4", "VID_big.mp4"])
+        self.assertEqual(processor.stats['processed_videos'], 3)
+        self.assertEqual(processor.stats['albums_created'], 2)
+        self.assertEqual({name: lane['jobs'] for name, lane in processor.lane_report.items()}, {"cpu": 3, "io": 2})
+        self.assertEqual(set(processor.depths[0]), {"cpu", "io"})
+        self.assertEqual(processor.lane_report["io"]["depth"], 0)
+
+    def test_without_io_lane_videos_share_the_workers(self):
+        self.write_sample_takeout()
+        processor = self.make_processor(workers=2, worker_type="thread", io_workers=0)
+        processor.process_all()
+        self.assertEqual(list(processor.lane_report), ["cpu"])
+        self.assertEqual(processor.lane_report["cpu"]["jobs"], 4)
+
+    def test_shutdown_cancels_queued_jobs(self):
+        release = threading.Event()
+        lane = scheduler.Lane("io", ThreadPoolExecutor(max_workers=1), 1)
+        running = lane.submit(release.wait)
+        queued = lane.submit(release.wait)
+        threading.Timer(0.1, release.set).start()
+        lane.shutdown(cancel_futures=True)
+        self.assertTrue(running.result())
+        self.assertTrue(queued.cancelled())
+
+
+class TestNativeUpload(TakeoutTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.server = FakeImmichServer().start()
+        self.addCleanup(self.server.stop)
+
+    def test_upload_albums_over_pooled_connections(self):
+        self.write_sample_takeout()
+        processor = self.make_processor(immich_server=self.server.url, api_key="test-key",
+                                        uploader="native", upload_concurrency=2)
+        processor.process_all()
+
+        self.assertEqual(processor.stats['errors'], 0)
+        self.assertLessEqual(self.server.connections, 2)
+        self.assertEqual(len(self.server.assets), 3)
+        self.assertEqual({name: len(ids) for name, ids in self.server.album_assets().items()},
+                         {"Trip": 2, "Photos from 2019": 1})
+
+        manifest = JobManifest(processor.manifest_path, resume=True)
+        try:
+            self.assertTrue(manifest.album_uploaded("Trip"))
+        finally:
+            manifest.close()
+
+    def test_duplicates_and_failures_are_reported(self):
+        album = self.root / "processed"
+        for name in ("a", "b"):
+            (album / name).mkdir(parents=True)
+            (album / name / "IMG_0001.jpg").write_bytes(make_jpeg())
+        (album / "b" / "IMG_0002.jpg").write_bytes(make_jpeg((1, 2, 3)))
+        self.server.reject_names = {"IMG_0002"}
+
+        report = immich_upload.upload_albums(self.server.url, "test-key", {
+            name: sorted((album / name).iterdir()) for name in ("a", "b")}, concurrency=3)
+
+        self.assertEqual((report.uploaded, report.duplicates), (1, 1))
+        self.assertEqual([path.name for path, _ in report.failed], ["IMG_0002.jpg"])
+        self.assertEqual(report.completed_albums, ["a"])
+        self.assertEqual(self.server.album_assets()["b"], self.server.album_assets()["a"])
+
+    def test_bad_api_key(self):
+        path = self.root / "IMG_0001.jpg"
+        path.write_bytes(make_jpeg())
+        report = immich_upload.upload_albums(self.server.url, "wrong", {"a": [path]})
+        self.assertEqual(report.uploaded, 0)
+        self.assertEqual(report.completed_albums, [])
+        self.assertIn("401", report.failed[0][1])
+
+    def test_connection_dropped_mid_response(self):
+        paths = []
+        for index in range(3):
+            paths.append(self.root / f"IMG_000{index}.jpg")
+            paths[-1].write_bytes(make_jpeg((index * 40, 0, 0)))
+        self.server.cut_connections = 1
+
+        uploads = immich_upload.BackgroundUploader(self.server.url, "test-key", 1, 1).start()
+        uploads.put("a", paths[0], "first")
+        for path in paths[1:]:
+            uploads.put("b", path, path.name)
+        report = uploads.close()
+
+        self.assertEqual([path for path, _ in report.failed], [paths[0]])
+        self.assertIn("mid-response", report.failed[0][1])
+        self.assertEqual(report.uploaded, 2)
+        self.assertEqual(uploads.take_uploaded(), ["IMG_0001.jpg", "IMG_0002.jpg"])
+        self.assertEqual(report.completed_albums, ["b"])
+        self.assertEqual(len(self.server.album_assets()["b"]), 2)
+
+
+class DiskWatchingProcessor(TakeoutProcessor):
+    """Processor that records how many processed files are on disk after each file."""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.files_on_disk = []
+
+    def record_result(self, job, stats, linked_to=None):
+        super().record_result(job, stats, linked_to)
+        self.files_on_disk.append(sum(1 for p in (self.output_dir / "processed").rglob("*") if p.is_file()))
+
+
+class TestUploadPipeline(TakeoutTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.server = FakeImmichServer().start()
+        self.addCleanup(self.server.stop)
+
+    def test_pipeline_uploads_and_deletes_as_it_goes(self):
+        for index in range(8):
+            write_takeout_zip(self.takeout_dir / f"takeout-00{index}.zip", {
+                f"Album {index % 2}/IMG_000{index}.jpg": make_jpeg((index * 30, 0, 0)),
+            })
+        processor = DiskWatchingProcessor(str(self.takeout_dir), str(self.output_dir), stream=True,
+                                          immich_server=self.server.url, api_key="test-key", pipeline=True,
+                                          pipeline_depth=1, upload_concurrency=1, delete_after_upload=True)
+        processor.process_all()
+
+        self.assertEqual(processor.stats['errors'], 0)
+        self.assertEqual(len(self.server.assets), 8)
+        self.assertEqual({name: len(ids) for name, ids in self.server.album_assets().items()},
+                         {"Album 0": 4, "Album 1": 4})
+        # One file queued, one uploading and the one just written
+        self.assertLessEqual(max(processor.files_on_disk), 3)
+        self.assertEqual([p for p in (self.output_dir / "processed").rglob("*") if p.is_file()], [])
+
+        manifest = JobManifest(processor.manifest_path, resume=True)
+        try:
+            states = {state for (state,) in manifest.conn.execute("SELECT state FROM members")}
+            self.assertEqual(states, {"uploaded"})
+        finally:
+            manifest.close()
+
+    def test_pipeline_uploads_plain_copies(self):
+        write_takeout_zip(self.takeout_dir / "takeout-001.zip", {
+            "Trip/IMG_0001.jpg": make_jpeg(),
+            "Trip/IMG_0001.jpg.json": make_sidecar("IMG_0001.jpg"),
+            # Not a JPEG inside, so its metadata can't be embedded and it is copied as it is
+            "Trip/IMG_0002.jpg": b"not a jpeg",
+            "Trip/IMG_0002.jpg.json": make_sidecar("IMG_0002.jpg"),
+        })
+        processor = self.make_processor(immich_server=self.server.url, api_key="test-key", pipeline=True,
+                                        delete_after_upload=True)
+        processor.process_all()
+
+        self.assertTrue(processor.stream)
+        self.assertEqual(processor.stats['errors'], 1)
+        self.assertEqual(len(self.server.assets), 2)
+        self.assertEqual({name: len(ids) for name, ids in self.server.album_assets().items()}, {"Trip": 2})
+        self.assertEqual([p for p in (self.output_dir / "processed").rglob("*") if p.is_file()], [])
+
+
+class TestUploadCheck(TakeoutTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.server = FakeImmichServer().start()
+        self.addCleanup(self.server.stop)
+
+    def run_upload(self, output_dir: Path = None, **kwargs) -> TakeoutProcessor:
+        processor = self.make_processor(output_dir, immich_server=self.server.url, api_key="test-key",
+                                        uploader="native", **kwargs)
+        processor.process_all()
+        self.assertEqual(processor.stats['errors'], 0)
+        return processor
+
+    def test_rerun_uploads_only_missing_files(self):
+        self.write_sample_takeout()
+        first = self.run_upload()
+        self.assertEqual((first.uploads_avoided, self.server.uploads), (0, 3))
+
+        # A new photo in an album Immich has, imported into a fresh output directory
+        write_takeout_zip(self.takeout_dir / "takeout-003.zip", {"Trip/IMG_0004.jpg": make_jpeg((0, 255, 0))})
+        second = self.run_upload(self.root / "second")
+        self.assertEqual((second.uploads_avoided, self.server.uploads), (3, 4))
+        self.assertEqual(self.server.bulk_checks, 2)
+        self.assertEqual({name: len(set(ids)) for name, ids in self.server.album_assets().items()},
+                         {"Trip": 3, "Photos from 2019": 1})
+
+        # Without the check, every file is sent again and Immich reports duplicates
+        third = self.run_upload(self.root / "third", upload_check=False)
+        self.assertEqual((third.uploads_avoided, self.server.uploads, self.server.bulk_checks), (0, 8, 2))
+
+    def test_pipeline_checks_before_uploading(self):
+        self.write_sample_takeout()
+        self.run_upload(pipeline=True, stream=True)
+        again = self.run_upload(self.root / "again", pipeline=True, stream=True, pipeline_depth=8)
+        self.assertEqual(again.uploads_avoided, 3)
+        self.assertEqual(self.server.uploads, 3)
+        self.assertEqual(len(self.server.album_assets()["Trip"]), 4)
+
+    def test_checksums_are_cached_by_inode_size_and_mtime(self):
+        manifest = integrity.IntegrityManifest(self.root / "integrity.sqlite")
+        self.addCleanup(manifest.close)
+        path = self.root / "IMG_0001.jpg"
+        path.write_bytes(make_jpeg())
+        digests, hashed = manifest.checksums([path])
+        self.assertEqual((digests[path], hashed), (integrity.hash_file(path), 1))
+        self.assertEqual(manifest.checksums([path])[1], 0)
+        path.write_bytes(make_jpeg((1, 2, 3)))
+        digests, hashed = manifest.checksums([path])
+        self.assertEqual((digests[path], hashed), (integrity.hash_file(path), 1))
+
+    def test_checksum_cache_survives_a_fresh_run(self):
+        path = self.root / "IMG_0001.jpg"
+        path.write_bytes(make_jpeg())
+        manifest = integrity.IntegrityManifest(self.root / "integrity.sqlite")
+        manifest.record(path.name, path.stat(), integrity.hash_file(path))
+        manifest.close()
+
+        manifest = integrity.IntegrityManifest(self.root / "integrity.sqlite", reset=True)
+        self.addCleanup(manifest.close)
+        self.assertEqual(manifest.entries(), [])
+        self.assertEqual(manifest.checksums([path])[1], 0)
+
+    def test_immich_go_gets_missing_files_in_chunks(self):
+        album = self.output_dir / "processed" / "Trip"
+        album.mkdir(parents=True)
+        files = []
+        for index in range(12):
+            files.append(album / f"IMG_{index:04d}.jpg")
+            files[-1].write_bytes(b"x")
+        processor = self.make_processor(immich_server=self.server.url, api_key="test-key")
+        existing = {path: f"asset-{index}" for index, path in enumerate(files[:8])}
+
+        with mock.patch.object(processor, "check_existing", return_value=existing), \
+                mock.patch("immich_upload.assign_albums"), \
+                mock.patch("enhanced_takeout_import.IMMICH_GO_ARGS_BYTES", 2 * len(str(files[0])) + 2), \
+                mock.patch("subprocess.run") as run:
+            processor.upload_to_immich()
+        uploads = [call.args[0] for call in run.call_args_list[1:]]
+        self.assertEqual([command[-2:] for command in uploads], [[str(files[8]), str(files[9])],
+                                                                 [str(files[10]), str(files[11])]])
+
+        # With most of the album missing, immich-go gets the directory instead
+        with mock.patch.object(processor, "check_existing", return_value=dict(list(existing.items())[:2])), \
+                mock.patch("immich_upload.assign_albums"), mock.patch("subprocess.run") as run:
+            processor.upload_to_immich()
+        self.assertEqual([call.args[0][-1] for call in run.call_args_list[1:]], [str(album)])
+
+    def test_chunk_paths(self):
+        paths = [Path(f"/photos/album/IMG_{index:04d}.jpg") for index in range(500)]
+        chunks = chunk_paths(paths, 1000)
+        self.assertEqual([arg for chunk in chunks for arg in chunk], [str(path) for path in paths])
+        self.assertTrue(all(sum(len(arg) + 1 for arg in chunk) <= 1000 for chunk in chunks))
+        self.assertEqual(chunk_paths([]), [])
+
+    def test_server_without_check_endpoint(self):
+        path = self.root / "IMG_0001.jpg"
+        path.write_bytes(make_jpeg())
+        report = immich_upload.upload_albums(self.server.url, "wrong", {"a": [path]},
+                                             checksums={path: integrity.hash_file(path)})
+        self.assertIn("401", report.check_error)
+        self.assertEqual(report.skipped, 0)
+
+
+class TestSyntheticBenchmark(TakeoutTestCase):
+
+    def generate(self, dest: Path):
+        return generate_takeout(dest, photos=12, pngs=2, videos=0, albums=2, image_size=(64, 48),
+                                duplicate_ratio=0.5, quirk_ratio=0.5, seed=7)
+
+    def test_generator_is_reproducible(self):
+        first = self.generate(self.root / "first")
+        second = self.generate(self.root / "second")
+        self.assertEqual([p.read_bytes() for p in first.archives], [p.read_bytes() for p in second.archives])
+        self.assertGreater(first.duplicates, 0)
+
+        names = []
+        for archive in first.archives:
+            with zipfile.ZipFile(archive) as zip_ref:
+                names.extend(zip_ref.namelist())
+        self.assertTrue(any(name.endswith("-edited.jpg") for name in names))
+        self.assertTrue(any("(1)" in name for name in names))
+        self.assertEqual(sum(Path(name).suffix in (".jpg", ".png") for name in names), first.media_files)
+
+    def test_run_mode_reports_measurements(self):
+        summary = self.generate(self.takeout_dir)
+        result = benchmark.run_mode(self.takeout_dir, self.output_dir, benchmark.parse_mode("stream:dedup=hardlink"))
+        self.assertEqual(result['media_files'], summary.media_files)
+        self.assertEqual(result['media_bytes'], summary.media_bytes)
+        self.assertGreater(result['files_per_s'], 0)
+        self.assertGreater(result['peak_rss'], 0)
+        self.assertEqual(set(result['stages']), set(benchmark.STAGES))
+
+        slower = dict(result, files_per_s=result['files_per_s'] * 0.5)
+        self.assertEqual(benchmark.find_regressions({"stream": result}, {"stream": result}, 0.2), [])
+        self.assertEqual(len(benchmark.find_regressions({"stream": slower}, {"stream": result}, 0.2)), 1)
+
+
+class TestParallelExtraction(TakeoutTestCase):
+
+    def test_parallel_matches_serial(self):
+        self.write_sample_takeout()
+        serial = self.make_processor(extract_workers=1)
+        serial.process_all()
+        parallel = self.make_processor(self.root / "parallel", extract_workers=4)
+        parallel.process_all()
+        self.assert_same_output(self.output_dir / "processed", self.root / "parallel" / "processed")
+        self.assertEqual(serial.stats, parallel.stats)
+
+    def test_first_part_wins_conflicts(self):
+        """A path present in several parts is always taken from the first part in sorted order."""
+        write_takeout_zip(self.takeout_dir / "takeout-001.zip", {
+            "Trip/IMG_0001.jpg": make_jpeg(),
+            "Trip/IMG_0001.jpg.json": make_sidecar("IMG_0001.jpg", description="First"),
+        })
+        write_takeout_zip(self.takeout_dir / "takeout-002.zip", {
+            "Trip/IMG_0001.jpg.json": make_sidecar("IMG_0001.jpg", description="Second"),
+        })
+        processor = self.make_processor(extract_workers=4)
+        processor.process_all()
+        exif = piexif.load(str(self.output_dir / "processed" / "Trip" / "IMG_0001.jpg"))
+        self.assertEqual(exif["0th"][piexif.ImageIFD.ImageDescription], b"First")
+
+    def test_unsafe_paths_are_not_extracted(self):
+        self.write_sample_takeout()
+        with zipfile.ZipFile(self.takeout_dir / "takeout-003.zip", "w") as zip_ref:
+            zip_ref.writestr("../escape.txt", b"outside")
+        processor = self.make_processor()
+        processor.process_all()
+        self.assertFalse((self.output_dir / "escape.txt").exists())
+        self.assertEqual(processor.stats['errors'], 1)
+        self.assertEqual(processor.stats['processed_images'], 3)
+
+
+class ScratchWatchingProcessor(TakeoutProcessor):
+    """Processor that records the most scratch space in use whenever a file is processed."""
+
+    peak_scratch = 0
+
+    def process_media_file(self, file_path, output_dir, metadata_file=None):
+        scratch = self.output_dir / "scratch"
+        used = sum(p.stat().st_size for p in scratch.rglob("*") if p.is_file())
+        self.peak_scratch = max(self.peak_scratch, used)
+        super().process_media_file(file_path, output_dir, metadata_file)
+
+
+class TestScratchBudget(TakeoutTestCase):
+
+    def test_budget_matches_extracted_output(self):
+        """Batches of about one photo produce the same tree as a full extraction."""
+        self.write_sample_takeout()
+        extracted = self.make_processor()
+        extracted.process_all()
+        budget = max(len(make_jpeg()), len(make_jpeg((10, 20, 30))), len(make_jpeg((0, 0, 255))))
+        budgeted = ScratchWatchingProcessor(str(self.takeout_dir), str(self.root / "budgeted"),
+                                            scratch_budget=budget)
+        budgeted.process_all()
+
+        self.assert_same_output(self.output_dir / "processed", self.root / "budgeted" / "processed")
+        self.assertEqual(extracted.stats, budgeted.stats)
+        self.assertLessEqual(budgeted.peak_scratch, budget)
+        self.assertFalse((self.root / "budgeted" / "scratch").exists())
+
+    def test_sidecar_in_another_archive(self):
+        write_takeout_zip(self.takeout_dir / "takeout-001.zip", {
+            "Trip/IMG_0001.jpg": make_jpeg(),
+            "Trip/IMG_0002.jpg": make_jpeg((10, 20, 30)),
+        })
+        write_takeout_zip(self.takeout_dir / "takeout-002.zip", {
+            "Trip/IMG_0001.jpg.supplemental-metadata.json": make_sidecar("IMG_0001.jpg", description="Split"),
+            "Trip/IMG_0002.jpg.json": make_sidecar("IMG_0002.jpg"),
+            "Trip/IMG_0003.jpg": make_jpeg((0, 0, 255)),
+        })
+        self.make_processor(scratch_budget=1024 * 1024).process_all()
+        exif = piexif.load(str(self.output_dir / "processed" / "Trip" / "IMG_0001.jpg"))
+        self.assertEqual(exif["0th"][piexif.ImageIFD.ImageDescription], b"Split")
+
+    def test_duplicates_across_batches(self):
+        photo = make_jpeg()
+        sidecar = make_sidecar("IMG_0001.jpg")
+        write_takeout_zip(self.takeout_dir / "takeout-001.zip", {
+            "Photos from 2018/IMG_0001.jpg": photo,
+            "Photos from 2018/IMG_0001.jpg.json": sidecar,
+        })
+        write_takeout_zip(self.takeout_dir / "takeout-002.zip", {
+            "Trip/IMG_0001.jpg": photo,
+            "Trip/IMG_0001.jpg.json": sidecar,
+        })
+        processor = self.make_processor(scratch_budget=len(photo), dedup="hardlink")
+        processor.process_all()
+        self.assertEqual(processor.stats['duplicates'], 1)
+        self.assertEqual((self.output_dir / "processed" / "Trip" / "IMG_0001.jpg").stat().st_nlink, 2)
+
+    def test_parse_size(self):
+        self.assertEqual(parse_size("500M"), 500 * 1024 * 1024)
+        self.assertEqual(parse_size("1.5g"), int(1.5 * 1024 ** 3))
+        self.assertEqual(parse_size("4096"), 4096)
+        with self.assertRaises(argparse.ArgumentTypeError):
+            parse_size("lots")
+
+
+class TestWorkPlan(TakeoutTestCase):
+
+    def write_planned_takeout(self) -> None:
+        self.write_sample_takeout()
+        write_takeout_zip(self.takeout_dir / "takeout-003.zip", {
+            "Photos from 2018/IMG_0001.jpg": make_jpeg(),
+            "Photos from 2018/IMG_0001.jpg.supplemental-metadata.json": make_sidecar("IMG_0001.jpg"),
+            "Photos from 2018/clip.mp4": b"not really a video",
+        })
+
+    def test_plan_summary(self):
+        self.write_planned_takeout()
+        processor = self.make_processor(workers=2)
+        summary = processor.write_plan(self.root / "plan.json")
+
+        self.assertFalse((self.output_dir / "extracted").exists())
+        self.assertEqual(json.loads((self.root / "plan.json").read_text()), summary)
+        self.assertEqual(summary['totals']['files'], 5)
+        self.assertEqual(summary['totals']['videos'], 1)
+        self.assertEqual(summary['albums']['Trip']['files'], 2)
+        self.assertEqual(summary['albums']['Photos from 2019']['without_sidecar'], 1)
+        self.assertEqual(sorted(summary['missing_metadata']),
+                         ["Photos from 2018/clip.mp4", "Photos from 2019/IMG_0003.jpg"])
+        self.assertEqual(summary['duplicates']['files'],
+                         [{'file': "Photos from 2018/IMG_0001.jpg", 'first': "Trip/IMG_0001.jpg"}])
+        self.assertGreater(summary['scratch_bytes'], 0)
+        self.assertEqual(set(summary['estimated_seconds']), {'extract', 'image', 'video', 'upload', 'total'})
+
+    def test_estimate_uses_last_run_report(self):
+        self.write_planned_takeout()
+        report_path = self.root / "report.json"
+        report_path.write_text(json.dumps({'stages': {'image': {'mb_per_s': 0.001}}}))
+        summary = self.make_processor(stream=True, report_path=str(report_path)).write_plan(self.root / "plan.json")
+        self.assertEqual(summary['throughput_mb_per_s']['image'], 0.001)
+        self.assertEqual(summary['scratch_bytes'], 0)
+        self.assertEqual(summary['estimated_seconds']['extract'], 0)
+        self.assertGreater(summary['estimated_seconds']['image'], 1)
+
+    def test_run_executes_the_plan(self):
+        self.write_planned_takeout()
+        for options in ({}, {'stream': True}, {'scratch_budget': 4096}):
+            processor = self.make_processor(self.root / str(len(options) and list(options)[0]), **options)
+            plan = processor.plan_work()
+            processor.process_all()
+            self.assertIs(processor.plan, plan)
+            self.assertEqual(processor.stats['total_files'], sum(1 for _ in plan.files()))
+            self.assertEqual(processor.stats['albums_created'], len(plan.albums))
+
+
+class TestDeltaImport(TakeoutTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.server = FakeImmichServer().start()
+        self.addCleanup(self.server.stop)
+        self.index_path = self.root / "index.sqlite"
+
+    def run_delta(self) -> TakeoutProcessor:
+        processor = self.make_processor(stream=True, immich_server=self.server.url, api_key="test-key",
+                                        uploader="native", delta_index=str(self.index_path))
+        processor.process_all()
+        self.assertEqual(processor.stats['errors'], 0)
+        return processor
+
+    def test_only_new_and_changed_files_are_imported(self):
+        self.write_sample_takeout()
+        first = self.run_delta()
+        self.assertEqual(first.delta_counts['new'], 3)
+        self.assertEqual(len(self.server.assets), 3)
+
+        unchanged = self.run_delta()
+        self.assertEqual(unchanged.delta_counts, {'new': 0, 'metadata': 0, 'unchanged': 3})
+        self.assertEqual(unchanged.stats['total_files'], 0)
+        self.assertEqual(self.server.updates, [])
+
+        # A newer export: one description edited, one photo added
+        write_takeout_zip(self.takeout_dir / "takeout-002.zip", {
+            "Trip/IMG_0002.jpg": make_jpeg((10, 20, 30)),
+            "Trip/IMG_0002.jpg.json": make_sidecar("IMG_0002.jpg", description="Sunset"),
+            "Photos from 2019/IMG_0003.jpg": make_jpeg((0, 0, 255)),
+            "Photos from 2019/IMG_0004.jpg": make_jpeg((0, 255, 0)),
+        })
+        newer = self.run_delta()
+        self.assertEqual(newer.delta_counts, {'new': 1, 'metadata': 1, 'unchanged': 2})
+        self.assertEqual(newer.stats['total_files'], 1)
+        self.assertEqual(len(self.server.assets), 4)
+        self.assertEqual(len(self.server.updates), 1)
+        self.assertEqual(self.server.assets[self.server.updates[0]]['description'], "Sunset")
+
+        self.assertEqual(self.run_delta().delta_counts, {'new': 0, 'metadata': 0, 'unchanged': 4})
+
+    def test_plan_shows_only_the_delta(self):
+        self.write_sample_takeout()
+        self.run_delta()
+        summary = self.make_processor(delta_index=str(self.index_path)).write_plan(self.root / "plan.json")
+        self.assertEqual(summary['totals']['files'], 0)
+
+    def test_metadata_change_without_asset_id_is_reuploaded(self):
+        """Uploads by immich-go record no asset ids, so a changed description can't be applied in place."""
+        self.write_sample_takeout()
+        self.run_delta()
+        index = ImportIndex(self.index_path)
+        try:
+            index.conn.execute("UPDATE items SET asset_id = NULL")
+            index.conn.commit()
+        finally:
+            index.close()
+
+        write_takeout_zip(self.takeout_dir / "takeout-002.zip", {
+            "Trip/IMG_0002.jpg": make_jpeg((10, 20, 30)),
+            "Trip/IMG_0002.jpg.json": make_sidecar("IMG_0002.jpg", description="Sunset"),
+            "Photos from 2019/IMG_0003.jpg": make_jpeg((0, 0, 255)),
+        })
+        processor = self.make_processor(immich_server=self.server.url, api_key="test-key",
+                                        delta_index=str(self.index_path))
+        with self.assertLogs("enhanced_takeout_import", "WARNING") as logs:
+            summary = processor.write_plan(self.root / "plan.json")
+        self.assertEqual(summary['totals']['files'], 1)
+        self.assertIn("only --uploader native records them", "\n".join(logs.output))
+
+    def test_plain_copies_are_uploaded(self):
+        write_takeout_zip(self.takeout_dir / "takeout-001.zip", {
+            "Trip/IMG_0001.jpg": make_jpeg(),
+            "Trip/IMG_0001.jpg.json": make_sidecar("IMG_0001.jpg"),
+            "Trip/IMG_0002.jpg": b"not a jpeg",
+            "Trip/IMG_0002.jpg.json": make_sidecar("IMG_0002.jpg"),
+        })
+        processor = self.make_processor(stream=True, immich_server=self.server.url, api_key="test-key",
+                                        uploader="native", delta_index=str(self.index_path))
+        processor.process_all()
+        self.assertEqual(processor.stats['errors'], 1)
+        self.assertEqual(len(self.server.assets), 2)
+
+        index = ImportIndex(self.index_path)
+        try:
+            self.assertEqual(index.pending(), set())
+        finally:
+            index.close()
+
+
+class TestIntegrityManifest(TakeoutTestCase):
+
+    def manifest_entries(self, processor: TakeoutProcessor) -> dict:
+        manifest = integrity.IntegrityManifest(processor.integrity_path)
+        try:
+            return {path: digest for path, _, digest in manifest.entries()}
+        finally:
+            manifest.close()
+
+    def assert_hashes_match(self, processor: TakeoutProcessor) -> None:
+        """Every output is in the manifest with the digest of its bytes on disk."""
+        processed = self.output_dir / "processed"
+        outputs = sorted(p.relative_to(processed).as_posix() for p in processed.rglob("*") if p.is_file())
+        entries = self.manifest_entries(processor)
+        self.assertEqual(sorted(entries), outputs)
+        for path, digest in entries.items():
+            self.assertEqual(digest, integrity.hash_file(processed / path))
+
+    def test_outputs_are_hashed_while_written(self):
+        self.write_sample_takeout()
+        for kwargs in ({}, {"stream": True}, {"workers": 2}, {"scratch_budget": 1}):
+            with self.subTest(**kwargs):
+                processor = self.make_processor(**kwargs)
+                processor.process_all()
+                self.assert_hashes_match(processor)
+                # Nothing had to be read back to be hashed
+                self.assertNotIn("hash", processor.timings.stages)
+
+    def test_placed_and_remuxed_videos(self):
+        write_takeout_zip(self.takeout_dir / "takeout-001.zip", {
+            "Trip/VID_0001.mp4": b"not really an mp4",
+            "Trip/VID_0001.mp4.supplemental-metadata.json": make_sidecar("VID_0001.mp4"),
+        })
+        ProbedProcessor.probed_tags = {"major_brand": "isom", "creation_time": "2018-07-22T17:46:42.000000Z",
+                                       "location": "+40.3993-105.8353/"}
+        processor = ProbedProcessor(str(self.takeout_dir), str(self.output_dir))
+        processor.process_all()
+        # Renamed into place, so the digest is the one taken during extraction
+        self.assertIn("place_rename", processor.timings.stages)
+        self.assert_hashes_match(processor)
+
+        ProbedProcessor.probed_tags = {}
+        processor = ProbedProcessor(str(self.takeout_dir), str(self.output_dir), stream=True)
+        processor.process_all()
+        self.assertEqual(processor.remuxed, ["VID_0001.stream.mp4"])
+        self.assertEqual(processor.timings.stages["hash"].count, 1)
+        self.assert_hashes_match(processor)
+
+    def test_verify_tree(self):
+        self.write_sample_takeout()
+        processor = self.make_processor(dedup="hardlink")
+        processor.process_all()
+        self.assertTrue(processor.verify())
+
+        processed = self.output_dir / "processed"
+        flipped = processed / "Trip" / "IMG_0001.jpg"
+        data = bytearray(flipped.read_bytes())
+        data[-10] ^= 0xFF
+        flipped.write_bytes(bytes(data))
+        (processed / "Trip" / "IMG_0002.jpg").unlink()
+        (processed / "Trip" / "extra.jpg").write_bytes(b"extra")
+
+        manifest = integrity.IntegrityManifest(processor.integrity_path)
+        try:
+            report = integrity.verify_tree(manifest, processed, workers=2)
+        finally:
+            manifest.close()
+        self.assertEqual(sorted(report.problems), [("Trip/IMG_0001.jpg", integrity.PROBLEM_HASH),
+                                                   ("Trip/IMG_0002.jpg", integrity.PROBLEM_MISSING)])
+        self.assertEqual((report.checked, report.ok), (3, 1))
+        self.assertEqual(report.untracked, ["Trip/extra.jpg"])
+        self.assertFalse(processor.verify())
+
+    def test_verify_uploaded_assets(self):
+        server = FakeImmichServer().start()
+        self.addCleanup(server.stop)
+        self.write_sample_takeout()
+        processor = self.make_processor(immich_server=server.url, api_key="test-key", uploader="native")
+        processor.process_all()
+        self.assertTrue(processor.verify(integrity.VERIFY_ASSETS))
+
+        manifest = integrity.IntegrityManifest(processor.integrity_path)
+        try:
+            asset_ids = {path: asset_id for path, _, asset_id in manifest.assets()}
+        finally:
+            manifest.close()
+        self.assertEqual(set(asset_ids.values()), set(server.assets))
+
+        # The server lost one asset and holds different bytes for another
+        with server.lock:
+            del server.assets[asset_ids["Trip/IMG_0001.jpg"]]
+            checksums = {asset_id: checksum for checksum, asset_id in server.checksums.items()}
+            server.checksums = {("0" * 40 if asset_id == asset_ids["Trip/IMG_0002.jpg"] else checksum): asset_id
+                                for asset_id, checksum in checksums.items()}
+        manifest = integrity.IntegrityManifest(processor.integrity_path)
+        try:
+            report = integrity.verify_assets(manifest, lambda ids: immich_upload.fetch_checksums(
+                server.url, "test-key", ids))
+        finally:
+            manifest.close()
+        self.assertEqual(sorted(report.problems), [("Trip/IMG_0001.jpg", integrity.PROBLEM_ASSET_MISSING),
+                                                   ("Trip/IMG_0002.jpg", integrity.PROBLEM_CHECKSUM)])
+        self.assertEqual(report.ok, 1)
+
+    def test_verify_after_delete_after_upload(self):
+        server = FakeImmichServer().start()
+        self.addCleanup(server.stop)
+        self.write_sample_takeout()
+        processor = self.make_processor(immich_server=server.url, api_key="test-key", pipeline=True,
+                                        delete_after_upload=True)
+        processor.process_all()
+        self.assertEqual([p for p in (self.output_dir / "processed").rglob("*") if p.is_file()], [])
+
+        manifest = integrity.IntegrityManifest(processor.integrity_path)
+        try:
+            report = integrity.verify_tree(manifest, self.output_dir / "processed")
+        finally:
+            manifest.close()
+        self.assertEqual((report.checked, report.deleted, report.problems), (0, 3, []))
+        self.assertTrue(processor.verify())
+        self.assertTrue(processor.verify(integrity.VERIFY_ASSETS))
+
+    def test_fresh_run_resets_manifest(self):
+        self.write_sample_takeout()
+        self.make_processor().process_all()
+        (self.takeout_dir / "takeout-002.zip").unlink()
+        processor = self.make_processor()
+        processor.process_all()
+        # Outputs left over from the first run are no longer tracked
+        self.assertEqual(sorted(self.manifest_entries(processor)), ["Trip/IMG_0001.jpg"])
+        (self.output_dir / "processed" / "Trip" / "IMG_0002.jpg").unlink()
+        self.assertTrue(processor.verify())
+
+        # A resumed run keeps what earlier runs recorded
+        write_takeout_zip(self.takeout_dir / "takeout-002.zip", {"Trip/IMG_0002.jpg": make_jpeg((10, 20, 30))})
+        self.make_processor(resume=True).process_all()
+        self.assertEqual(sorted(self.manifest_entries(processor)), ["Trip/IMG_0001.jpg", "Trip/IMG_0002.jpg"])
+
+
+class TestWatchMode(TakeoutTestCase):
+
+    def test_end_record_validation(self):
+        """Only a zip that ends with its end of central directory record counts as downloaded."""
+        part = self.takeout_dir / "takeout-001.zip"
+        write_takeout_zip(part, {"Trip/IMG_0001.jpg": make_jpeg()})
+        self.assertTrue(end_record_valid(part))
+
+        data = part.read_bytes()
+        part.write_bytes(data[:-10])
+        self.assertFalse(end_record_valid(part))
+        part.write_bytes(data[:len(data) // 2])
+        self.assertFalse(end_record_valid(part))
+
+        with zipfile.ZipFile(part, "w") as zip_ref:
+            zip_ref.comment = b"PK\x05\x06 in a comment"
+            zip_ref.writestr("Takeout/Google Photos/Trip/IMG_0001.jpg", make_jpeg())
+        self.assertTrue(end_record_valid(part))
+
+    def test_zip64_end_record(self):
+        part = self.takeout_dir / "takeout-001.zip"
+        with mock.patch.object(zipfile, "ZIP_FILECOUNT_LIMIT", 1):
+            write_takeout_zip(part, {"Trip/IMG_0001.jpg": make_jpeg(), "Trip/IMG_0002.jpg": make_jpeg()})
+        self.assertIn(b"PK\x06\x06", part.read_bytes())
+        self.assertTrue(end_record_valid(part))
+        part.write_bytes(part.read_bytes()[:-1])
+        self.assertFalse(end_record_valid(part))
+
+    def test_parts_imported_as_they_finish(self):
+        """Each finished part is imported; media without a sidecar wait until the download goes idle."""
+        write_takeout_zip(self.takeout_dir / "takeout-001.zip", {
+            "Trip/IMG_0001.jpg": make_jpeg(),
+            "Trip/IMG_0001.jpg.supplemental-metadata.json": make_sidecar("IMG_0001.jpg"),
+            "Trip/IMG_0002.jpg": make_jpeg((10, 20, 30)),
+        })
+        second = io.BytesIO()
+        with zipfile.ZipFile(second, "w") as zip_ref:
+            zip_ref.writestr("Takeout/Google Photos/Trip/IMG_0002.jpg.json",
+                             make_sidecar("IMG_0002.jpg", description="Lake"))
+            zip_ref.writestr("Takeout/Google Photos/Photos from 2019/IMG_0003.jpg", make_jpeg((0, 0, 255)))
+        # Still downloading: no end of central directory yet
+        (self.takeout_dir / "takeout-002.zip").write_bytes(second.getvalue()[:-30])
+
+        now = [0.0]
+        watcher = PartWatcher(self.make_processor(stream=True), settle_seconds=5, idle_seconds=100,
+                              clock=lambda: now[0])
+        processed = self.output_dir / "processed"
+
+        self.assertFalse(watcher.step())
+        now[0] += 5
+        self.assertTrue(watcher.step())
+        self.assertTrue((processed / "Trip" / "IMG_0001.jpg").exists())
+        self.assertFalse((processed / "Trip" / "IMG_0002.jpg").exists())
+
+        (self.takeout_dir / "takeout-002.zip").write_bytes(second.getvalue())
+        self.assertFalse(watcher.step())
+        now[0] += 5
+        self.assertTrue(watcher.step())
+        exif = piexif.load(str(processed / "Trip" / "IMG_0002.jpg"))
+        self.assertEqual(exif["0th"][piexif.ImageIFD.ImageDescription], b"Lake")
+        self.assertFalse((processed / "Photos from 2019" / "IMG_0003.jpg").exists())
+        self.assertFalse(watcher.complete)
+
+        now[0] += 99
+        self.assertFalse(watcher.step())
+        now[0] += 1
+        self.assertTrue(watcher.step())
+        self.assertTrue((processed / "Photos from 2019" / "IMG_0003.jpg").exists())
+        self.assertTrue(watcher.complete)
+        self.assertEqual(watcher.passes, 3)
+
+        manifest = JobManifest(watcher.processor.manifest_path, resume=True)
+        try:
+            self.assertEqual(manifest.stats()['processed_images'], 3)
+        finally:
+            manifest.close()
+
+
+class TestNearDuplicates(TakeoutTestCase):
+
+    @staticmethod
+    def fractal(extent=(-2, -1.2, 1, 1.2)) -> Image.Image:
+        return Image.effect_mandelbrot((320, 240), extent, 60).convert("RGB")
+
+    @staticmethod
+    def encode(image: Image.Image, quality: int = 90) -> bytes:
+        buffer = io.BytesIO()
+        image.save(buffer, format="JPEG", quality=quality)
+        return buffer.getvalue()
+
+    def test_banded_matching_finds_every_close_pair(self):
+        """Every pair within the distance shares a band, so banding loses no matches."""
+        rng = random.Random(7)
+        hashes = [rng.getrandbits(near_duplicates.HASH_BITS) for _ in range(2000)]
+        expected = {}
+        for first in range(0, 200, 2):
+            distance = first % 10
+            flipped = hashes[first]
+            for bit in rng.sample(range(near_duplicates.HASH_BITS), distance):
+                flipped ^= 1 << bit
+            hashes[first + 1] = flipped
+            if distance <= 8:
+                expected[first, first + 1] = distance
+
+        self.assertEqual(near_duplicates.near_pairs(hashes, 8), expected)
+        # The fallback for Python before 3.10 counts the same bits
+        self.assertEqual([near_duplicates._count_ones(value) for value in hashes[:50]],
+                         [near_duplicates.popcount(value) for value in hashes[:50]])
+        groups = near_duplicates.group_pairs(len(hashes), expected)
+        self.assertEqual(sorted(groups), [[first, second] for first, second in sorted(expected)])
+
+    def test_image_hash_survives_resave(self):
+        original = self.root / "original.jpg"
+        original.write_bytes(self.encode(self.fractal()))
+        resaved = self.root / "resaved.jpg"
+        resaved.write_bytes(self.encode(ImageEnhance.Brightness(self.fractal()).enhance(1.3), quality=25))
+        other = self.root / "other.jpg"
+        other.write_bytes(self.encode(self.fractal((-0.8, -0.3, -0.4, 0.1))))
+
+        hashes = near_duplicates.hash_images([original, resaved, other, self.root / "missing.jpg"])
+        self.assertLessEqual(near_duplicates.popcount(hashes[0] ^ hashes[1]), near_duplicates.DEFAULT_MAX_DISTANCE)
+        self.assertGreater(near_duplicates.popcount(hashes[0] ^ hashes[2]), near_duplicates.DEFAULT_MAX_DISTANCE)
+        self.assertIsNone(hashes[3])
+
+    def test_keep_original_sets_edits_aside(self):
+        """The edit of a photo is set aside, while a re-save and copies in other albums are only reported."""
+        edited = self.encode(ImageEnhance.Contrast(self.fractal()).enhance(1.4))
+        write_takeout_zip(self.takeout_dir / "takeout-001.zip", {
+            "Trip/IMG_0001.jpg": self.encode(self.fractal()),
+            "Trip/IMG_0001-edited.jpg": edited,
+            "Photos from 2018/IMG_0001-edited.jpg": edited,
+            "Trip/IMG_0002.jpg": self.encode(self.fractal((-0.8, -0.3, -0.4, 0.1))),
+            "Trip/IMG_0003.jpg": self.encode(self.fractal((-0.8, -0.3, -0.4, 0.1)), quality=30),
+        })
+        processor = self.make_processor(near_duplicate_policy=near_duplicates.POLICY_KEEP_ORIGINAL)
+        processor.process_all()
+
+        processed = self.output_dir / "processed"
+        aside = self.output_dir / "near-duplicates"
+        self.assertTrue((processed / "Trip" / "IMG_0001.jpg").exists())
+        self.assertFalse((processed / "Trip" / "IMG_0001-edited.jpg").exists())
+        self.assertTrue((aside / "Trip" / "IMG_0001-edited.jpg").exists())
+        self.assertTrue((aside / "Photos from 2018" / "IMG_0001-edited.jpg").exists())
+        self.assertTrue((processed / "Trip" / "IMG_0003.jpg").exists())
+
+        report = json.loads(processor.near_duplicates_path.read_text())
+        # The edit in both albums has the same bytes, so it is one image with a copy
+        self.assertEqual(report['images'], 4)
+        self.assertEqual(len(report['groups']), 2)
+        edits, resaves = sorted(report['groups'], key=lambda group: len(group['removed']), reverse=True)
+        self.assertEqual(sorted(entry['path'] for entry in resaves['files']), ["Trip/IMG_0002.jpg", "Trip/IMG_0003.jpg"])
+        self.assertEqual(resaves['removed'], [])
+        self.assertEqual(sorted(edits['removed']),
+                         ["Photos from 2018/IMG_0001-edited.jpg", "Trip/IMG_0001-edited.jpg"])
+
+        # The set-aside files are no longer outputs, so verification still passes
+        self.assertTrue(self.make_processor().verify())
+
+    def test_keep_edit_only_drops_the_named_original(self):
+        """A look-alike joined to the group through the original is reported but kept."""
+        album = self.root / "album"
+        album.mkdir()
+        (album / "IMG_0001.jpg").write_bytes(self.encode(self.fractal()))
+        (album / "IMG_0001-edited.jpg").write_bytes(self.encode(ImageEnhance.Contrast(self.fractal()).enhance(1.4)))
+        (album / "IMG_0005.jpg").write_bytes(self.encode(self.fractal(), quality=30))
+        images = [(name, []) for name in ("IMG_0001.jpg", "IMG_0001-edited.jpg", "IMG_0005.jpg")]
+
+        report = near_duplicates.find_near_duplicates(images, album, policy=near_duplicates.POLICY_KEEP_EDIT)
+        self.assertEqual(len(report.groups), 1)
+        self.assertEqual(len(report.groups[0]['files']), 3)
+        self.assertEqual(report.removed(), ["IMG_0001.jpg"])
+
+    def test_blank_images_are_not_compared_pairwise(self):
+        """Flat images all hash to 0; their crowded buckets are skipped instead of matched in O(n^2)."""
+        blank = self.encode(Image.new("RGB", (64, 48), (0, 0, 0)))
+        for index in range(300):
+            (self.root / f"blank_{index:03d}.jpg").write_bytes(blank + bytes([index % 256]))
+        (self.root / "photo.jpg").write_bytes(self.encode(self.fractal()))
+        (self.root / "photo-edited.jpg").write_bytes(self.encode(ImageEnhance.Contrast(self.fractal()).enhance(1.4)))
+        names = [f"blank_{index:03d}.jpg" for index in range(300)] + ["photo.jpg", "photo-edited.jpg"]
+
+        report = near_duplicates.find_near_duplicates([(name, []) for name in names], self.root,
+                                                      policy=near_duplicates.POLICY_KEEP_ORIGINAL)
+        self.assertEqual(report.undecodable, [])
+        self.assertEqual([[entry['path'] for entry in group['files']] for group in report.groups],
+                         [["photo.jpg", "photo-edited.jpg"]])
+        self.assertEqual(report.removed(), ["photo-edited.jpg"])
+
+        # 5000 identical hashes would be 12.5M comparisons per band without the cap
+        hashes = [0] * 5000 + [1 << 100, (1 << 100) | 1]
+        self.assertEqual(near_duplicates.near_pairs(hashes), {(5000, 5001): 1})
+
+
+class TestRunLogging(TakeoutTestCase):
+
+    def start_logging(self) -> Path:
+        log_path = self.root / "import.log"
+        run_logging.setup_logging(log_path, console=False)
+        self.addCleanup(run_logging.stop_logging)
+        return log_path
+
+    def read_log(self, log_path: Path) -> list:
+        run_logging.stop_logging()
+        return [json.loads(line) for line in log_path.read_text().splitlines()]
+
+    def test_repeated_warnings_are_coalesced(self):
+        log_path = self.start_logging()
+        logger = logging.getLogger("takeout-test")
+        for index in range(20):
+            logger.warning(f"No metadata found for IMG_{index}.jpg")
+        logger.info("Done", extra={'files': 20})
+
+        records = self.read_log(log_path)
+        warnings = [record for record in records if record['level'] == "WARNING"]
+        self.assertEqual(len(warnings), run_logging.COALESCE_BURST + 1)
+        self.assertEqual(warnings[-1]['suppressed'], 20 - run_logging.COALESCE_BURST)
+        self.assertIn("IMG_19.jpg", warnings[-1]['message'])
+        self.assertEqual([record['files'] for record in records if record['message'] == "Done"], [20])
+
+    def test_pool_workers_log_through_the_queue(self):
+        self.write_sample_takeout()
+        log_path = self.start_logging()
+        self.make_processor(workers=2).process_all()
+
+        records = self.read_log(log_path)
+        missing = [record for record in records if record['message'].startswith("No metadata found")]
+        self.assertEqual(len(missing), 1)
+        self.assertNotEqual(missing[0]['process'], "MainProcess")
+        self.assertTrue(any(record['message'] == "Processing complete!" for record in records))
+
+
+class TestRunReport(TakeoutTestCase):
+
+    def test_report_has_stage_timings(self):
+        self.write_sample_takeout()
+        report_path = self.root / "report.json"
+        self.make_processor(stream=True, workers=2, report_path=str(report_path)).process_all()
+
+        report = json.loads(report_path.read_text())
+        self.assertEqual(report['stats']['processed_images'], 3)
+        self.assertTrue(report['options']['stream'])
+        # Image and EXIF timings come back from the pool workers
+        self.assertEqual(report['stages']['image']['count'], 3)
+        self.assertEqual(report['stages']['exif']['count'], 3)
+        # Two sidecars and the album's metadata.json
+        self.assertEqual(report['stages']['metadata']['count'], 3)
+        self.assertEqual(len(report['stages']['image']['slowest']), 3)
+        self.assertGreater(report['stages']['image']['bytes'], 0)
+
+    def test_profile_summary(self):
+        self.write_sample_takeout()
+        report_path = self.root / "report.json"
+        self.make_processor(profile="cprofile", report_path=str(report_path)).process_all()
+
+        report = json.loads(report_path.read_text())
+        self.assertEqual(report['stages']['extract']['count'], 7)
+        self.assertEqual(report['profile']['mode'], "cprofile")
+        self.assertTrue(report['profile']['top'])
+        self.assertTrue(report_path.with_suffix(".prof").exists())
+
+    def test_histogram_and_slowest(self):
+        timings = Instrumentation()
+        for index, seconds in enumerate([0.0005, 0.003, 0.003, 0.2, 90.0]):
+            timings.record("image", seconds, 1024, f"file{index}")
+        other = Instrumentation()
+        other.record("image", 0.05, 1024, "worker-file")
+        timings.merge(other.drain())
+
+        stage = timings.to_dict()["image"]
+        self.assertEqual(stage['count'], 6)
+        self.assertEqual(stage['bytes'], 6 * 1024)
+        self.assertEqual(stage['histogram'], {"<=1ms": 1, "<=5ms": 2, "<=50ms": 1, "<=200ms": 1, ">60000ms": 1})
+        self.assertEqual(stage['p50_ms'], 5.0)
+        self.assertEqual(stage['max_ms'], 90000.0)
+        self.assertEqual([entry['file'] for entry in stage['slowest'][:2]], ["file4", "file3"])
+        self.assertEqual(other.stages, {})
+
+
+class FlakyProcessor(TakeoutProcessor):
+    """Processor whose EXIF embedding fails for one file, as if the run had been interrupted."""
+
+    def process_jpeg(self, open_source, metadata, output_path):
+        if output_path.name == "IMG_0002.jpg":
+            with open_source() as source:
+                output_path.write_bytes(source.read())
+            return False
+        return super().process_jpeg(open_source, metadata, output_path)
+
+
+class TestResumableImport(TakeoutTestCase):
+
+    def run_interrupted_then_resumed(self, **kwargs):
+        """Run once with a failing file, then resume with a healthy processor."""
+        self.write_sample_takeout()
+        first = FlakyProcessor(str(self.takeout_dir), str(self.output_dir), **kwargs)
+        first.process_all()
+        self.assertEqual(first.stats['errors'], 1)
+
+        resumed = self.make_processor(resume=True, **kwargs)
+        resumed.process_all()
+        return resumed
+
+    def test_resume_retries_only_failures(self):
+        resumed = self.run_interrupted_then_resumed()
+        self.assertEqual(resumed.stats['total_files'], 1)
+        self.assertEqual(resumed.stats['processed_images'], 1)
+        self.assertEqual(resumed.stats['errors'], 0)
+
+        manifest = JobManifest(resumed.manifest_path, resume=True)
+        try:
+            self.assertEqual(manifest.stats(), {
+                'total_files': 4, 'processed_images': 3, 'processed_videos': 0,
+                'skipped_files': 1, 'errors': 0, 'albums_created': 2,
+                'duplicates': 0, 'bytes_saved': 0,
+            })
+        finally:
+            manifest.close()
+
+    def test_resume_streaming(self):
+        resumed = self.run_interrupted_then_resumed(stream=True)
+        self.assertEqual(resumed.stats['total_files'], 1)
+        exif = piexif.load(str(self.output_dir / "processed" / "Trip" / "IMG_0002.jpg"))
+        self.assertEqual(exif["0th"][piexif.ImageIFD.ImageDescription], b"Lake")
+
+    def test_fresh_run_resets_manifest(self):
+        self.write_sample_takeout()
+        FlakyProcessor(str(self.takeout_dir), str(self.output_dir)).process_all()
+        rerun = self.make_processor()
+        rerun.process_all()
+        self.assertEqual(rerun.stats['total_files'], 4)
+
+    def test_manifest_states(self):
+        self.write_sample_takeout()
+        processor = FlakyProcessor(str(self.takeout_dir), str(self.output_dir), stream=True, workers=2)
+        processor.process_all()
+
+        manifest = JobManifest(processor.manifest_path, resume=True)
+        try:
+            rows = dict(((path, state) for path, state in
+                         manifest.conn.execute("SELECT path, state FROM members")))
+        finally:
+            manifest.close()
+        self.assertEqual(rows["Takeout/Google Photos/Trip/IMG_0001.jpg"], STATE_EMBEDDED)
+        self.assertEqual(rows["Takeout/Google Photos/Trip/IMG_0002.jpg"], STATE_FAILED)
+
+
+if __name__ == "__main__":
+    unittest.main()